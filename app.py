@@ -1,3 +1,4 @@
+import logging
 import sys, os
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
@@ -17,6 +18,13 @@ def create_app():
 
     os.makedirs(app.instance_path, exist_ok=True)
 
+    # Під gunicorn — його обробники і рівень (--log-level, за замовчуванням info),
+    # щоб INFO застосунку потрапляли в лог воркера
+    gunicorn_logger = logging.getLogger("gunicorn.error")
+    if gunicorn_logger.handlers:
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+
     db.init_app(app)
     register_blueprints(app)
 
@@ -32,10 +40,31 @@ def create_app():
     from modules.reference.cultures.models import Culture
     from modules.reference.companies.models import Company
     from modules.reference.fields.field_models import Field
+    from cache_bus import CacheVersion  # cache_versions — спільні версії кешів для воркерів
 
     with app.app_context():
         db.create_all()
 
+    # Профіль схеми для сервісів розподілу (моделі планів, колонки тари/виробника) — один раз
+    from modules.purchases.payer_allocation.schema_profile import init_schema_profile
+    init_schema_profile(app)
+
+    # Шина інвалідації кешів між воркерами + кеш довідників і мемо консолідації у пам'яті процесу
+    from cache_bus import init_cache_bus
+    from modules.reference.cache import init_reference_cache
+    from modules.purchases.payer_allocation.result_cache import init_consolidation_cache
+    init_cache_bus(app)
+    init_reference_cache(app)
+    init_consolidation_cache(app)
+
+    # Single-flight для дорогих читань (консолідація, залишки, зведення планів)
+    from singleflight import init_single_flight
+    init_single_flight(app)
+
+    # Фонові задачі (пул потоків процесу, черга в таблиці jobs)
+    from modules.jobs.runner import init_jobs
+    init_jobs(app)
+
     @app.route('/')
     def index():
         return render_template('index.html')
@@ -0,0 +1,204 @@
+# cache_bus.py
+# -*- coding: utf-8 -*-
+"""
+Шина інвалідації кешів між воркерами (gunicorn -w N).
+
+Спільне сховище — маленька таблиця cache_versions (назва таблиці → версія) у тій самій БД,
+тож окремий сервіс не потрібен. Кеш підписується на таблиці (subscribe); далі:
+
+  * after_flush / ORM-виконання запам'ятовують у сесії змінені підписані таблиці
+    (INSERT/UPDATE/DELETE, що не зачепили жодного рядка, таблицю не позначають);
+  * after_commit збільшує їхні версії в cache_versions (окреме з'єднання, бо транзакція
+    сесії вже закрита) і одразу викликає підписників цього процесу;
+  * на початку кожного запиту воркер одним SELECT читає cache_versions і викликає
+    підписників для таблиць, чия версія змінилася з минулої перевірки.
+
+Між commit у воркері A і наступним запитом воркера B кеш B може бути застарілим
+на один запит — це і є ціна «майже нульової» перевірки.
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Set
+
+from flask import current_app, has_app_context, request
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from extensions import db, dialect_insert
+
+_DIRTY_KEY = "cache_bus_dirty"
+
+
+class CacheVersion(db.Model):
+    __tablename__ = "cache_versions"
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class InvalidationBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Callable[[Iterable[str]], None]]] = {}
+        self._seen: Dict[str, int] = {}
+        self._stats = {"polls": 0, "published": 0, "remote_invalidations": 0, "errors": 0}
+
+    # ----------------------------- підписка -----------------------------
+
+    def subscribe(self, names: Iterable[str], callback: Callable[[Iterable[str]], None]) -> None:
+        """callback(назви таблиць) — скинути кеш цих таблиць."""
+        for name in names:
+            self._subscribers.setdefault(name, []).append(callback)
+
+    def tracks(self, name: str) -> bool:
+        return name in self._subscribers
+
+    def _notify(self, names: Set[str]) -> None:
+        callbacks: Dict[Callable, Set[str]] = {}
+        for name in names:
+            for cb in self._subscribers.get(name, ()):
+                callbacks.setdefault(cb, set()).add(name)
+        for cb, cb_names in callbacks.items():
+            cb(cb_names)
+
+    # ----------------------------- зміни в сесії -----------------------------
+
+    def mark_dirty(self, session, names: Iterable[str]) -> None:
+        names = {n for n in names if n and self.tracks(n)}
+        if names:
+            session.info.setdefault(_DIRTY_KEY, set()).update(names)
+
+    @staticmethod
+    def dirty_tables(session) -> Set[str]:
+        """Підписані таблиці, змінені в поточній (ще не закоміченій) транзакції сесії."""
+        return session.info.get(_DIRTY_KEY, set())
+
+    # ----------------------------- публікація / перевірка -----------------------------
+
+    def publish(self, names: Set[str]) -> None:
+        """+1 до спільних версій і скидання кешів цього процесу."""
+        try:
+            self._bump_shared(names)
+            self._stats["published"] += len(names)
+        except Exception as e:  # дані вже закомічені — кеш інших воркерів оновиться пізніше
+            self.record_error("не вдалося оновити cache_versions", e)
+        self._notify(names)
+
+    def _bump_shared(self, names: Set[str]) -> None:
+        t = CacheVersion.__table__
+        now = datetime.utcnow()
+        rows = [{"name": n, "version": 1, "updated_at": now} for n in sorted(names)]
+        with db.engine.begin() as conn:
+            insert = dialect_insert(conn)
+            if insert is not None:
+                stmt = insert(t)
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[t.c.name],
+                    set_={"version": t.c.version + 1, "updated_at": stmt.excluded.updated_at},
+                ), rows)
+            else:
+                for row in rows:
+                    res = conn.execute(
+                        update(t).where(t.c.name == row["name"]).values(version=t.c.version + 1, updated_at=now)
+                    )
+                    if not res.rowcount:
+                        conn.execute(t.insert(), row)
+            current = dict(conn.execute(select(t.c.name, t.c.version).where(t.c.name.in_(names))).all())
+        with self._lock:
+            for name, version in current.items():
+                # інший воркер встиг підняти версію між нашим UPDATE і SELECT — його зміну
+                # має побачити наступний poll, тож «бачене» не переносимо
+                if version == self._seen.get(name, 0) + 1:
+                    self._seen[name] = version
+
+    def poll(self) -> Set[str]:
+        """Читає спільні версії; скидає кеші таблиць, змінених іншими воркерами. Повертає їх назви."""
+        if not self._subscribers:
+            return set()
+        t = CacheVersion.__table__
+        with db.engine.connect() as conn:
+            current = dict(conn.execute(select(t.c.name, t.c.version)).all())
+        with self._lock:
+            changed = {
+                name for name, version in current.items()
+                if name in self._subscribers and version != self._seen.get(name, 0)
+            }
+            for name in changed:
+                self._seen[name] = current[name]
+        self._stats["polls"] += 1
+        if changed:
+            self._stats["remote_invalidations"] += len(changed)
+            self._notify(changed)
+        return changed
+
+    def record_error(self, what: str, e: Exception) -> None:
+        self._stats["errors"] += 1
+        if has_app_context():
+            current_app.logger.warning("cache bus: %s: %s", what, e)
+
+    def stats(self) -> dict:
+        return {**self._stats, "seen": dict(sorted(self._seen.items()))}
+
+
+invalidation_bus = InvalidationBus()
+
+
+# ----------------------------- події сесії -----------------------------
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    invalidation_bus.mark_dirty(session, (
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if hasattr(obj, "__table__")
+    ))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_statement_changes(orm_execute_state):
+    # query.update()/delete(), update(Model)/delete(Model), Core insert/update/delete через сесію
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    name = getattr(table, "name", None)
+    if name is None and orm_execute_state.bind_mapper is not None:
+        name = orm_execute_state.bind_mapper.local_table.name
+    if not name or not invalidation_bus.tracks(name):
+        return None
+    # позначаємо лише за зачепленими рядками: UPDATE ... WHERE без збігів кеш не скидає
+    # (rowcount −1 / недоступний — драйвер не знає, тож вважаємо зміненою)
+    result = orm_execute_state.invoke_statement()
+    if getattr(result, "rowcount", -1) != 0:
+        invalidation_bus.mark_dirty(orm_execute_state.session, [name])
+    return result
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    names = session.info.pop(_DIRTY_KEY, None)
+    if names:
+        invalidation_bus.publish(names)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop(_DIRTY_KEY, None)
+
+
+# ----------------------------- ініціалізація -----------------------------
+
+def init_cache_bus(app) -> None:
+    """Перевірка спільних версій на початку кожного запиту. Викликається з create_app."""
+
+    @app.before_request
+    def _poll_cache_versions():
+        if request.endpoint == "static":
+            return
+        try:
+            invalidation_bus.poll()
+        except Exception as e:
+            invalidation_bus.record_error("не вдалося прочитати cache_versions", e)
@@ -1,3 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql as pg_dialect, sqlite as sqlite_dialect
 
 db = SQLAlchemy()
+
+# Діалекти з підтримкою INSERT ... ON CONFLICT ... DO UPDATE
+_UPSERT_INSERTS = {
+    "postgresql": pg_dialect.insert,
+    "sqlite": sqlite_dialect.insert,
+}
+
+
+def dialect_insert(bind=None):
+    """insert() поточного діалекту з on_conflict_do_update або None, якщо діалект не підтримується."""
+    bind = bind if bind is not None else db.session.get_bind()
+    return _UPSERT_INSERTS.get(bind.dialect.name)
@@ -0,0 +1,10 @@
+from flask import Blueprint
+
+jobs_bp = Blueprint(
+    "jobs",
+    __name__,
+    template_folder="templates",
+    url_prefix="/jobs"
+)
+
+from . import routes  # noqa: F401
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from extensions import db
+
+# статуси, у яких ключ задачі зайнятий (повторний submit приєднується до неї)
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class Job(db.Model):
+    """
+    Фонова задача (jobs.runner): тип + параметри, статус, прогрес, результат і файл-артефакт.
+    key — ключ об'єднання: поки задача з ключем у черзі чи виконується, інша з тим самим
+    ключем не створюється (частковий унікальний індекс ux_jobs_active_key).
+    """
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    key = db.Column(db.String(191), nullable=True)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+
+    status = db.Column(db.String(16), nullable=False, default="queued")  # queued | running | done | failed
+    progress = db.Column(db.Float, nullable=False, default=0.0)          # 0..1
+    message = db.Column(db.Text, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(64), nullable=True)  # host:pid, що виконує задачу
+
+    # артефакт (файл у сховищі runner-а)
+    artifact_path = db.Column(db.Text, nullable=True)
+    artifact_name = db.Column(db.String(255), nullable=True)
+    artifact_mimetype = db.Column(db.String(100), nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index(
+            "ux_jobs_active_key", "key", unique=True,
+            sqlite_where=text("status IN ('queued', 'running')"),
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+        db.Index("ix_jobs_kind_key_finished", "kind", "key", "finished_at"),
+        db.Index("ix_jobs_status_created", "status", "created_at"),
+    )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "params": self.params,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "attempts": self.attempts,
+            "worker": self.worker,
+            "artifact": self.artifact_name,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,103 @@
+import os
+from urllib.parse import urlparse
+
+from flask import abort, flash, jsonify, redirect, render_template, request, send_file, url_for
+
+from extensions import db
+from . import jobs_bp
+from .models import Job
+from .runner import job_runner
+
+
+def _safe_next(url):
+    """Лише адреси цього застосунку (відносні або з того ж хоста, напр. referrer)."""
+    if not url:
+        return None
+    parts = urlparse(url)
+    if parts.netloc and parts.netloc != request.host:
+        return None
+    path = parts.path or "/"
+    if not path.startswith("/") or path.startswith("//"):
+        return None
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+def _job_or_404(job_id: int) -> Job:
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+def _progress_dict(job: Job) -> dict:
+    progress, message = job.progress, job.message
+    live = job_runner.live(job.id) if job.status == "running" else None
+    if live is not None:
+        progress, message = live[0], live[1] or message
+    return {
+        "id": job.id,
+        "status": job.status,
+        "progress": progress,
+        "message": message,
+        "error": job.error,
+        "artifact": job.artifact_name,
+    }
+
+
+@jobs_bp.route("/", methods=["GET"])
+def index():
+    """Останні задачі та метрики runner-а цього процесу (JSON)."""
+    jobs = Job.query.order_by(Job.id.desc()).limit(50).all()
+    return jsonify({"stats": job_runner.stats(), "jobs": [j.as_dict() for j in jobs]})
+
+
+@jobs_bp.route("/<int:job_id>", methods=["GET"])
+def status(job_id):
+    job = _job_or_404(job_id)
+    return jsonify({**job.as_dict(), **_progress_dict(job)})
+
+
+@jobs_bp.route("/<int:job_id>/progress", methods=["GET"])
+def progress(job_id):
+    return jsonify(_progress_dict(_job_or_404(job_id)))
+
+
+@jobs_bp.route("/<int:job_id>/wait", methods=["GET"])
+def wait(job_id):
+    """Сторінка очікування: опитує прогрес; після завершення — артефакт або next."""
+    job = _job_or_404(job_id)
+    return render_template(
+        "jobs/wait.html",
+        job=job,
+        state=_progress_dict(job),
+        next_url=_safe_next(request.args.get("next")),
+        title="Виконується задача",
+        header="⏳ Виконується задача",
+    )
+
+
+@jobs_bp.route("/<int:job_id>/finish", methods=["GET"])
+def finish(job_id):
+    """Повідомлення про результат задачі і повернення на next."""
+    job = _job_or_404(job_id)
+    next_url = _safe_next(request.args.get("next")) or url_for("index")
+    if not job.finished:
+        return redirect(url_for("jobs.wait", job_id=job.id, next=next_url))
+    if job.status == "failed":
+        flash(f"Задачу не виконано: {job.error or 'невідома помилка'}", "danger")
+    elif job.message:
+        flash(job.message, "success")
+    return redirect(next_url)
+
+
+@jobs_bp.route("/<int:job_id>/artifact", methods=["GET"])
+def artifact(job_id):
+    job = _job_or_404(job_id)
+    if job.status != "done" or not job.artifact_path or not os.path.exists(job.artifact_path):
+        abort(404)
+    return send_file(
+        job.artifact_path,
+        as_attachment=True,
+        download_name=job.artifact_name,
+        mimetype=job.artifact_mimetype,
+    )
@@ -0,0 +1,420 @@
+# modules/jobs/runner.py
+# -*- coding: utf-8 -*-
+"""
+Фонові задачі в процесі застосунку без зовнішнього брокера.
+
+Задача — рядок у таблиці jobs (тип, параметри, статус, прогрес, результат, артефакт);
+виконує її обмежений пул потоків цього процесу (JOB_WORKERS). Обробник реєструється
+декоратором і отримує JobContext та параметри задачі:
+
+    @job_handler("payer_allocation.sync")
+    def _sync_job(job, company_id=None):
+        job.progress(0.5, "…")
+        job.save_artifact("звіт.pdf", data, "application/pdf")
+        return {"added": 3}          # результат (JSON)
+
+    submitted = submit_job("payer_allocation.sync", {"company_id": 7})
+
+Об'єднання: ключ задачі за замовчуванням — тип + параметри. Поки задача з ключем у черзі
+чи виконується, повторний submit повертає її ж (десять запитів «синк компанії 7» — одне
+виконання); min_interval — ще й не запускати знову, якщо така сама задача успішно
+завершилась щойно. Унікальність ключа серед активних задач тримає частковий індекс,
+тож це працює і між воркерами.
+
+Статус/прогрес пишуться окремими з'єднаннями, поза транзакцією обробника. На SQLite
+обробник може тримати блокування запису, тож проміжний прогрес там видно лише з цього
+процесу (у пам'яті), а в БД потрапляє фінальний стан.
+
+Поки обробник працює, окремий потік-пульс раз на JOB_HEARTBEAT_SECONDS оновлює heartbeat_at
+(на всіх БД, незалежно від progress()): довга задача без проміжного прогресу не вважається
+«зависшою» і не повертається в чергу вдруге.
+
+Задачу забирає той, хто перевів її queued → running (атомарний UPDATE). Не частіше ніж раз
+на JOB_RECOVER_SECONDS (на запитах) процес повертає в чергу задачі, що «зависли» в running
+(heartbeat старший за JOB_STALE_SECONDS — воркер помер), запускає незабрані queued (загублені
+разом із пулом іншого процесу) і прибирає старі завершені задачі разом з артефактами.
+submit не приєднується до такої «зависшої» задачі, а повертає її в чергу одразу.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import redirect, url_for
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from .models import ACTIVE_STATUSES, Job
+
+DEFAULTS = {
+    "JOB_WORKERS": 2,               # потоків у пулі на процес
+    "JOB_STALE_SECONDS": 120,       # running без пульсу довше — воркер вважається мертвим (кілька HEARTBEAT)
+    "JOB_HEARTBEAT_SECONDS": 30,    # як часто пульс оновлює heartbeat_at (має бути набагато менше STALE)
+    "JOB_RECOVER_SECONDS": 60,      # як часто (на запитах) відновлювати чергу
+    "JOB_MAX_ATTEMPTS": 3,          # скільки разів повертати «зависшу» задачу в чергу
+    "JOB_RETENTION_DAYS": 7,        # скільки тримати завершені задачі й артефакти
+    "JOB_ARTIFACT_DIR": None,       # None → <instance>/job_artifacts
+    "JOBS_EAGER": False,            # виконувати одразу в submit (скрипти/налагодження)
+}
+
+# як часто проміжний прогрес пишеться в БД (сек)
+_PROGRESS_WRITE_INTERVAL = 1.0
+
+
+def job_key(kind: str, params: dict) -> str:
+    """Ключ об'єднання за замовчуванням: тип + параметри."""
+    return f"{kind}:{json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)}"[:191]
+
+
+def _jsonable(value):
+    return None if value is None else json.loads(json.dumps(value, default=str))
+
+
+@dataclass(frozen=True)
+class Submitted:
+    id: int
+    state: str  # queued — нова задача; coalesced — приєднались до активної; recent — свіжий результат
+
+
+class JobContext:
+    """Те, що бачить обробник: прогрес, повідомлення, артефакт."""
+
+    def __init__(self, runner: "JobRunner", job_id: int):
+        self.job_id = job_id
+        self.message: Optional[str] = None
+        self.artifact: Optional[Tuple[str, str, str]] = None  # (шлях, назва, mimetype)
+        self._runner = runner
+        self._written_at = 0.0
+
+    def progress(self, fraction: float, message: Optional[str] = None) -> None:
+        if message is not None:
+            self.message = message
+        fraction = min(max(float(fraction), 0.0), 1.0)
+        self._runner._report(self, fraction)
+
+    def save_artifact(self, name: str, data: bytes, mimetype: str = "application/octet-stream") -> None:
+        path = os.path.join(self._runner.artifact_dir(), str(self.job_id), "artifact")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.artifact = (path, name, mimetype)
+
+
+class JobRunner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers: Dict[str, Callable] = {}
+        self._app = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._recovered: Optional[Tuple[int, float]] = None  # (pid, time.monotonic()) останнього recover
+        self._local: set = set()  # id задач, переданих у пул цього процесу і ще не завершених
+        self._live: Dict[int, Tuple[float, Optional[str]]] = {}
+        self._stats = {"submitted": 0, "coalesced": 0, "recent": 0, "done": 0, "failed": 0, "running": 0}
+
+    # ----------------------------- реєстрація -----------------------------
+
+    def handler(self, kind: str):
+        """Декоратор обробника задач типу kind."""
+        def deco(fn):
+            self._handlers[kind] = fn
+            return fn
+        return deco
+
+    def init_app(self, app) -> None:
+        for k, v in DEFAULTS.items():
+            app.config.setdefault(k, v)
+        self._app = app
+
+        @app.before_request
+        def _jobs_recover():
+            now = time.monotonic()
+            with self._lock:
+                last = self._recovered
+                if last is not None and last[0] == os.getpid() and now - last[1] < app.config["JOB_RECOVER_SECONDS"]:
+                    return
+                self._recovered = (os.getpid(), now)
+            try:
+                self.recover()
+            except Exception as e:
+                app.logger.warning("jobs: не вдалося відновити чергу: %s", e)
+
+    @property
+    def worker_id(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+    def artifact_dir(self) -> str:
+        return self._app.config["JOB_ARTIFACT_DIR"] or os.path.join(self._app.instance_path, "job_artifacts")
+
+    # ----------------------------- постановка в чергу -----------------------------
+
+    def submit(self, kind: str, params: Optional[dict] = None, *, key: Optional[str] = None,
+               coalesce: bool = True, min_interval: Optional[float] = None) -> Submitted:
+        """
+        Ставить задачу в чергу (окрема транзакція — потік-виконавець бачить її одразу).
+        Викликати, коли сесія запиту не тримає незакомічених змін.
+        """
+        if kind not in self._handlers:
+            raise KeyError(f"Невідомий тип задачі: {kind}")
+        params = _jsonable(dict(params or {}))
+        if key is None and coalesce:
+            key = job_key(kind, params)
+
+        t = Job.__table__
+        now = datetime.utcnow()
+        if key is not None:
+            recent = None
+            with db.engine.begin() as conn:
+                active = self._active(conn, key)
+                if active is not None and self._requeue_stale(conn, now, t.c.id == active.id):
+                    # «зависла» задача: повернута в чергу (або failed після JOB_MAX_ATTEMPTS)
+                    active = self._active(conn, key)
+                if active is None and min_interval:
+                    recent = conn.execute(
+                        select(t.c.id)
+                        .where(t.c.kind == kind, t.c.key == key, t.c.status == "done",
+                               t.c.finished_at >= now - timedelta(seconds=min_interval))
+                        .order_by(t.c.finished_at.desc())
+                        .limit(1)
+                    ).scalar()
+            if active is not None:
+                self._stats["coalesced"] += 1
+                if active.status == "queued":
+                    # черга могла загубитися разом з пулом іншого процесу; забере той, чий _claim перший
+                    self._dispatch(active.id)
+                return Submitted(active.id, "coalesced")
+            if recent is not None:
+                self._stats["recent"] += 1
+                return Submitted(recent, "recent")
+
+        try:
+            with db.engine.begin() as conn:
+                job_id = conn.execute(t.insert().values(
+                    kind=kind, key=key, params=params, status="queued", progress=0.0, attempts=0, created_at=now,
+                )).inserted_primary_key[0]
+        except IntegrityError:
+            # інший запит/воркер встиг поставити задачу з тим самим ключем
+            with db.engine.connect() as conn:
+                active = self._active(conn, key)
+            if active is None:
+                raise
+            self._stats["coalesced"] += 1
+            return Submitted(active.id, "coalesced")
+
+        self._stats["submitted"] += 1
+        self._dispatch(job_id)
+        return Submitted(job_id, "queued")
+
+    def _requeue_stale(self, conn, now: datetime, where=None) -> int:
+        """
+        running без пульсу довше JOB_STALE_SECONDS (крім задач, що виконуються в цьому процесі) →
+        queued, або failed після JOB_MAX_ATTEMPTS. Повертає кількість знайдених «зависших».
+        """
+        cfg = self._app.config
+        t = Job.__table__
+        stale = (t.c.status == "running") & (t.c.heartbeat_at < now - timedelta(seconds=cfg["JOB_STALE_SECONDS"]))
+        if where is not None:
+            stale = stale & where
+        with self._lock:
+            local = list(self._local)
+        if local:
+            stale = stale & ~((t.c.worker == self.worker_id) & t.c.id.in_(local))
+        failed = conn.execute(
+            update(t).where(stale, t.c.attempts >= cfg["JOB_MAX_ATTEMPTS"])
+            .values(status="failed", finished_at=now, error="Воркер зупинився під час виконання")
+        ).rowcount
+        return failed + conn.execute(update(t).where(stale).values(status="queued", worker=None)).rowcount
+
+    @staticmethod
+    def _active(conn, key: str):
+        """(id, status) активної задачі з ключем або None."""
+        t = Job.__table__
+        return conn.execute(
+            select(t.c.id, t.c.status).where(t.c.key == key, t.c.status.in_(ACTIVE_STATUSES)).limit(1)
+        ).first()
+
+    def _dispatch(self, job_id: int) -> None:
+        """Передає задачу в пул цього процесу (якщо її там ще немає)."""
+        if self._app.config["JOBS_EAGER"]:
+            self._run(job_id)
+            return
+        with self._lock:
+            # пул створюється в процесі, що виконує задачі (після fork у gunicorn --preload)
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._app.config["JOB_WORKERS"], thread_name_prefix="job",
+                )
+                self._executor_pid = os.getpid()
+                self._local = set()
+            if job_id in self._local:
+                return
+            self._local.add(job_id)
+            executor = self._executor
+        executor.submit(self._run, job_id)
+
+    # ----------------------------- виконання -----------------------------
+
+    def _claim(self, job_id: int) -> bool:
+        t = Job.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            res = conn.execute(
+                update(t)
+                .where(t.c.id == job_id, t.c.status == "queued")
+                .values(status="running", started_at=now, heartbeat_at=now,
+                        worker=self.worker_id, attempts=t.c.attempts + 1)
+            )
+        return res.rowcount == 1
+
+    def _run(self, job_id: int) -> None:
+        try:
+            self._run_claimed(job_id)
+        finally:
+            with self._lock:
+                self._local.discard(job_id)
+
+    def _run_claimed(self, job_id: int) -> None:
+        app = self._app
+        with app.app_context():
+            if not self._claim(job_id):
+                return
+            job = db.session.get(Job, job_id)
+            kind, params = job.kind, dict(job.params or {})
+            ctx = JobContext(self, job_id)
+            with self._lock:
+                self._stats["running"] += 1
+            stop = threading.Event()
+            pulse = threading.Thread(
+                target=self._heartbeat, args=(job_id, db.engine, stop),
+                name=f"job-{job_id}-heartbeat", daemon=True,
+            )
+            pulse.start()
+            try:
+                handler = self._handlers.get(kind)
+                if handler is None:
+                    raise LookupError(f"Невідомий тип задачі: {kind}")
+                result = handler(ctx, **params)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception("job %s (%s) failed", job_id, kind)
+                self._finish(job_id, ctx, "failed", error=f"{type(e).__name__}: {e}")
+            else:
+                self._finish(job_id, ctx, "done", result=result)
+            finally:
+                stop.set()
+                pulse.join()
+                with self._lock:
+                    self._stats["running"] -= 1
+                self._live.pop(job_id, None)
+
+    def _heartbeat(self, job_id: int, engine, stop: threading.Event) -> None:
+        """Потік-пульс задачі: heartbeat_at, поки задача running у цього воркера."""
+        t = Job.__table__
+        interval = self._app.config["JOB_HEARTBEAT_SECONDS"]
+        while not stop.wait(interval):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        update(t)
+                        .where(t.c.id == job_id, t.c.status == "running", t.c.worker == self.worker_id)
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+            except Exception as e:  # SQLite: обробник тримає блокування запису — спробуємо наступного разу
+                self._app.logger.warning("jobs: не вдалося оновити heartbeat %s: %s", job_id, e)
+
+    def _finish(self, job_id: int, ctx: JobContext, status: str, *, result=None, error: Optional[str] = None) -> None:
+        t = Job.__table__
+        now = datetime.utcnow()
+        values = {"status": status, "finished_at": now, "heartbeat_at": now, "message": ctx.message}
+        if status == "done":
+            values.update(progress=1.0, result=_jsonable(result))
+        else:
+            values.update(error=error)
+        if ctx.artifact is not None:
+            path, name, mimetype = ctx.artifact
+            values.update(artifact_path=path, artifact_name=name, artifact_mimetype=mimetype)
+        with db.engine.begin() as conn:
+            conn.execute(update(t).where(t.c.id == job_id).values(**values))
+        self._stats[status] += 1
+
+    def _report(self, ctx: JobContext, fraction: float) -> None:
+        self._live[ctx.job_id] = (fraction, ctx.message)
+        if db.engine.dialect.name == "sqlite":
+            return
+        now = time.monotonic()
+        if now - ctx._written_at < _PROGRESS_WRITE_INTERVAL:
+            return
+        ctx._written_at = now
+        t = Job.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(update(t).where(t.c.id == ctx.job_id).values(
+                    progress=fraction, message=ctx.message, heartbeat_at=datetime.utcnow(),
+                ))
+        except Exception as e:  # прогрес — не привід валити задачу
+            self._app.logger.warning("jobs: не вдалося записати прогрес %s: %s", ctx.job_id, e)
+
+    def live(self, job_id: int) -> Optional[Tuple[float, Optional[str]]]:
+        """(прогрес, повідомлення) задачі, що виконується в цьому процесі."""
+        return self._live.get(job_id)
+
+    # ----------------------------- відновлення / прибирання -----------------------------
+
+    def recover(self) -> int:
+        """
+        «Зависші» running → queued (або failed після JOB_MAX_ATTEMPTS), запуск queued, яких немає
+        в пулі цього процесу, прибирання старих. Повертає кількість переданих у пул задач.
+        """
+        cfg = self._app.config
+        t = Job.__table__
+        now = datetime.utcnow()
+        purge_before = now - timedelta(days=cfg["JOB_RETENTION_DAYS"])
+
+        with db.engine.begin() as conn:
+            self._requeue_stale(conn, now)
+            queued = [r.id for r in conn.execute(select(t.c.id).where(t.c.status == "queued").order_by(t.c.id))]
+            old = conn.execute(
+                select(t.c.id, t.c.artifact_path).where(t.c.status.in_(("done", "failed")), t.c.finished_at < purge_before)
+            ).all()
+            if old:
+                conn.execute(delete(t).where(t.c.id.in_([r.id for r in old])))
+
+        for r in old:
+            if r.artifact_path:
+                shutil.rmtree(os.path.dirname(r.artifact_path), ignore_errors=True)
+        with self._lock:
+            queued = [i for i in queued if i not in self._local]
+        for job_id in queued:
+            self._dispatch(job_id)
+        return len(queued)
+
+    # ----------------------------- метрики -----------------------------
+
+    def stats(self) -> dict:
+        return {**self._stats, "workers": self._app.config["JOB_WORKERS"] if self._app else None}
+
+
+job_runner = JobRunner()
+job_handler = job_runner.handler
+submit_job = job_runner.submit
+
+
+def job_redirect(job_id: int, next_url: Optional[str] = None):
+    """Редірект на сторінку очікування задачі (після завершення — на next_url або артефакт)."""
+    return redirect(url_for("jobs.wait", job_id=job_id, next=next_url))
+
+
+def init_jobs(app) -> None:
+    """Конфіг за замовчуванням і періодичне відновлення черги на запитах. Викликається з create_app."""
+    job_runner.init_app(app)
@@ -8,6 +8,8 @@ from modules.reference.companies.models import Company
 from modules.reference.cultures.models import Culture
 from modules.reference.products.models import Product
 
+from modules.jobs.runner import job_handler, job_redirect, submit_job
+
 from sqlalchemy.orm import joinedload
 
 @bp.route('/', endpoint='index')
@@ -80,8 +82,20 @@ def unapprove_plan(plan_id):
     flash(f'План №{plan.id} знову перенесено до "Готових" ⬅️', 'info')
     return redirect(url_for('approved_plans.index'))
 
+EXPORT_PDF_JOB = "approved_plans.export_pdf"
+EXPORT_PLAN_PDF_JOB = "approved_plans.export_plan_pdf"
+
 @bp.route('/export_pdf')
 def export_pdf():
+    # ✅ Параметри фільтрації — PDF будується фоновою задачею
+    params = {
+        "company_id": request.args.get('company_id', type=int),
+        "culture_id": request.args.get('culture_id', type=int),
+    }
+    return job_redirect(submit_job(EXPORT_PDF_JOB, params).id, request.referrer)
+
+@job_handler(EXPORT_PDF_JOB)
+def _export_pdf_job(job, company_id=None, culture_id=None):
     from reportlab.lib.pagesizes import A4
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
     from reportlab.lib.styles import getSampleStyleSheet
@@ -90,13 +104,6 @@ def export_pdf():
     from reportlab.pdfbase import pdfmetrics
     from reportlab.pdfbase.ttfonts import TTFont
     import os
-    from flask import send_file, request
-    from modules.plans.models import Plan, Treatment
-    from modules.reference.fields.field_models import Field
-
-    # ✅ Параметри фільтрації
-    company_id = request.args.get('company_id', type=int)
-    culture_id = request.args.get('culture_id', type=int)
 
     # 🟩 Фільтрація затверджених планів
     plans_query = Plan.query.filter_by(status='готовий', is_approved=True)
@@ -146,17 +153,15 @@ def export_pdf():
 
     elements.append(table)
     doc.build(elements)
-    buffer.seek(0)
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name="затверджені_плани.pdf",
-        mimetype='application/pdf'
-    )
+    job.save_artifact("затверджені_плани.pdf", buffer.getvalue(), "application/pdf")
 
 @bp.route('/<int:plan_id>/export_pdf')
 def export_plan_pdf(plan_id):
+    plan = Plan.query.get_or_404(plan_id)
+    return job_redirect(submit_job(EXPORT_PLAN_PDF_JOB, {"plan_id": plan.id}).id, request.referrer)
+
+@job_handler(EXPORT_PLAN_PDF_JOB)
+def _export_plan_pdf_job(job, plan_id):
     from reportlab.lib.pagesizes import A4
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
     from reportlab.lib.styles import getSampleStyleSheet
@@ -165,10 +170,10 @@ def export_plan_pdf(plan_id):
     from reportlab.pdfbase.ttfonts import TTFont
     from io import BytesIO
     import os
-    from flask import send_file
-    from modules.plans.models import Plan, Treatment
 
-    plan = Plan.query.get_or_404(plan_id)
+    plan = db.session.get(Plan, plan_id)
+    if plan is None:
+        raise LookupError(f"План №{plan_id} не знайдено")
 
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
@@ -211,11 +216,4 @@ def export_plan_pdf(plan_id):
 
     elements.append(table)
     doc.build(elements)
-    buffer.seek(0)
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=f"план_{plan.id}.pdf",
-        mimetype='application/pdf'
-    )
+    job.save_artifact(f"план_{plan.id}.pdf", buffer.getvalue(), "application/pdf")
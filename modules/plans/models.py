@@ -8,7 +8,7 @@ class Plan(db.Model):
     __tablename__ = 'plans'
 
     id = db.Column(db.Integer, primary_key=True)
-    field_id = db.Column(db.Integer, db.ForeignKey('fields.id'), nullable=False)
+    field_id = db.Column(db.Integer, db.ForeignKey('fields.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String, default='готовий')
     is_approved = db.Column(db.Boolean, default=False)
@@ -21,7 +21,7 @@ class Treatment(db.Model):
     __tablename__ = 'treatments'
 
     id = db.Column(db.Integer, primary_key=True)
-    plan_id = db.Column(db.Integer, db.ForeignKey('plans.id'), nullable=False)
+    plan_id = db.Column(db.Integer, db.ForeignKey('plans.id'), nullable=False, index=True)
 
     treatment_type_id = db.Column(db.Integer, db.ForeignKey('treatment_types.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -3,6 +3,9 @@ from .forms import PlanForm
 from modules.reference.fields.field_models import Field
 from modules.reference.products.models import Product
 from modules.reference.treatment_types.models import TreatmentType
+from modules.reference.manufacturers.models import Manufacturer
+from modules.reference.units.models import Unit
+from modules.reference.cache import reference_cache
 from modules.reference.clusters.models import Cluster
 from modules.reference.cultures.models import Culture
 from modules.reference.companies.models import Company
@@ -61,9 +64,8 @@ def create_plan(field_id):
     field = Field.query.get_or_404(field_id)
     form = PlanForm()
 
-    from sqlalchemy.orm import joinedload
-    treatment_types = TreatmentType.query.all()
-    products = Product.query.options(joinedload(Product.manufacturer), joinedload(Product.unit)).all()
+    treatment_types = reference_cache.all(TreatmentType)
+    products = reference_cache.joined(Product, manufacturer=Manufacturer, unit=Unit)
 
     choices_treatment = [(t.id, t.name) for t in treatment_types]
     choices_product = [(p.id, p.name) for p in products]
@@ -151,8 +153,6 @@ def bulk_template_select_fields():
     )
 @bp.route('/bulk_template/create', methods=['GET', 'POST'])
 def bulk_template_create():
-    from sqlalchemy.orm import joinedload
-
     # ✅ Отримуємо список полів
     field_ids = request.args.get('field_ids') or request.form.get('field_ids')
     if not field_ids:
@@ -164,8 +164,8 @@ def bulk_template_create():
 
     form = PlanForm()
 
-    treatment_types = TreatmentType.query.all()
-    products = Product.query.options(joinedload(Product.manufacturer), joinedload(Product.unit)).all()
+    treatment_types = reference_cache.all(TreatmentType)
+    products = reference_cache.joined(Product, manufacturer=Manufacturer, unit=Unit)
 
     choices_treatment = [(t.id, t.name) for t in treatment_types]
     choices_product = [(p.id, p.name) for p in products]
@@ -1,5 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
-from sqlalchemy.orm import joinedload
+from flask import Blueprint, render_template, request, redirect, url_for, flash
 from extensions import db
 
 from modules.plans.forms import PlanForm
@@ -9,6 +8,10 @@ from modules.reference.companies.models import Company
 from modules.reference.cultures.models import Culture
 from modules.reference.treatment_types.models import TreatmentType
 from modules.reference.products.models import Product
+from modules.reference.manufacturers.models import Manufacturer
+from modules.reference.units.models import Unit
+from modules.reference.cache import reference_cache
+from modules.jobs.runner import job_handler, job_redirect, submit_job
 
 ready_plans_bp = Blueprint(
     'ready_plans',
@@ -70,11 +73,8 @@ def edit_plan(plan_id):
     form = PlanForm()
 
     # Довідники
-    treatment_types = TreatmentType.query.all()
-    products = Product.query.options(
-        joinedload(Product.manufacturer),
-        joinedload(Product.unit)
-    ).all()
+    treatment_types = reference_cache.all(TreatmentType)
+    products = reference_cache.joined(Product, manufacturer=Manufacturer, unit=Unit)
 
     # choices
     choices_treatment = [(t.id, t.name) for t in treatment_types]
@@ -178,8 +178,20 @@ def bulk_approve():
     flash(f"✅ Затверджено {len(plans)} план(ів)", "success")
     return redirect(url_for('ready_plans.index'))
 
+EXPORT_PDF_JOB = "ready_plans.export_pdf"
+EXPORT_SINGLE_PLAN_PDF_JOB = "ready_plans.export_single_plan_pdf"
+
 @ready_plans_bp.route('/export_pdf')
 def export_pdf():
+    # PDF будується фоновою задачею
+    params = {
+        "company_id": request.args.get('company_id', type=int),
+        "culture_id": request.args.get('culture_id', type=int),
+    }
+    return job_redirect(submit_job(EXPORT_PDF_JOB, params).id, request.referrer)
+
+@job_handler(EXPORT_PDF_JOB)
+def _export_pdf_job(job, company_id=None, culture_id=None):
     from reportlab.lib.pagesizes import A4
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -204,9 +216,6 @@ def export_pdf():
     elements.append(Paragraph("Готові плани (фільтровані)", styles['DejaVuTitle']))
     elements.append(Spacer(1, 12))
 
-    company_id = request.args.get('company_id', type=int)
-    culture_id = request.args.get('culture_id', type=int)
-
     plans_query = Plan.query.filter_by(status='готовий', is_approved=False)
 
     if company_id:
@@ -239,12 +248,15 @@ def export_pdf():
 
     elements.append(table)
     doc.build(elements)
-    buffer.seek(0)
-
-    return send_file(buffer, as_attachment=True, download_name="готові_плани.pdf", mimetype='application/pdf')
+    job.save_artifact("готові_плани.pdf", buffer.getvalue(), "application/pdf")
 
 @ready_plans_bp.route('/<int:plan_id>/export_pdf')
 def export_single_plan_pdf(plan_id):
+    plan = Plan.query.get_or_404(plan_id)
+    return job_redirect(submit_job(EXPORT_SINGLE_PLAN_PDF_JOB, {"plan_id": plan.id}).id, request.referrer)
+
+@job_handler(EXPORT_SINGLE_PLAN_PDF_JOB)
+def _export_single_plan_pdf_job(job, plan_id):
     from reportlab.lib.pagesizes import A4
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
     from reportlab.lib.styles import getSampleStyleSheet
@@ -253,7 +265,9 @@ def export_single_plan_pdf(plan_id):
     from reportlab.pdfbase import pdfmetrics
     from reportlab.pdfbase.ttfonts import TTFont
 
-    plan = Plan.query.get_or_404(plan_id)
+    plan = db.session.get(Plan, plan_id)
+    if plan is None:
+        raise LookupError(f"План №{plan_id} не знайдено")
 
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
@@ -298,11 +312,4 @@ def export_single_plan_pdf(plan_id):
 
     elements.append(table)
     doc.build(elements)
-    buffer.seek(0)
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=f"План_поле_{plan.field.name}.pdf",
-        mimetype='application/pdf'
-    )
+    job.save_artifact(f"План_поле_{plan.field.name}.pdf", buffer.getvalue(), "application/pdf")
@@ -1,7 +1,7 @@
 import os
 from io import BytesIO
 
-from flask import render_template, request, make_response, current_app
+from flask import render_template, request, current_app
 from sqlalchemy import func
 
 from reportlab.lib import colors
@@ -12,6 +12,8 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 from extensions import db
+from singleflight import single_flight
+from modules.jobs.runner import job_handler, job_redirect, submit_job
 from . import summary_bp
 
 from modules.plans.models import Plan, Treatment
@@ -66,17 +68,14 @@ def build_summary_query(selected_company=None, selected_culture=None, selected_p
     return query
 
 
-@summary_bp.route('/')
-def index():
-    selected_company = request.args.get('company_id', type=int)
-    selected_culture = request.args.get('culture_id', type=int)
-    selected_product = request.args.get('product_id', type=int)
+# таблиці зведення (обхід single-flight при незакомічених змінах у сесії)
+SUMMARY_TABLES = ("plans", "treatments", "fields", "companies", "cultures", "products", "units")
 
-    companies = Company.query.order_by(Company.name).all()
-    cultures = Culture.query.order_by(Culture.name).all()
-    products = Product.query.order_by(Product.name).all()
 
-    summary_rows = (
+@single_flight("plans_summary.rows", tables=SUMMARY_TABLES, cross_worker=True)
+def get_summary_rows(selected_company=None, selected_culture=None, selected_product=None):
+    """Згруповане зведення (компанія, культура, продукт, од.); однакові одночасні запити — один раз."""
+    return (
         build_summary_query(selected_company, selected_culture, selected_product)
         .group_by(
             Company.name,
@@ -92,6 +91,19 @@ def index():
         .all()
     )
 
+
+@summary_bp.route('/')
+def index():
+    selected_company = request.args.get('company_id', type=int)
+    selected_culture = request.args.get('culture_id', type=int)
+    selected_product = request.args.get('product_id', type=int)
+
+    companies = Company.query.order_by(Company.name).all()
+    cultures = Culture.query.order_by(Culture.name).all()
+    products = Product.query.order_by(Product.name).all()
+
+    summary_rows = get_summary_rows(selected_company, selected_culture, selected_product)
+
     total_quantity = sum((row.total_quantity or 0) for row in summary_rows)
     units_in_result = sorted(set(row.unit_name for row in summary_rows if row.unit_name))
 
@@ -116,29 +128,25 @@ def index():
     )
 
 
+EXPORT_PDF_JOB = "plans_summary.export_pdf"
+
+
 @summary_bp.route('/pdf')
 def export_pdf():
-    register_pdf_fonts()
+    # PDF будується фоновою задачею
+    params = {
+        "selected_company": request.args.get('company_id', type=int),
+        "selected_culture": request.args.get('culture_id', type=int),
+        "selected_product": request.args.get('product_id', type=int),
+    }
+    return job_redirect(submit_job(EXPORT_PDF_JOB, params).id, request.referrer)
 
-    selected_company = request.args.get('company_id', type=int)
-    selected_culture = request.args.get('culture_id', type=int)
-    selected_product = request.args.get('product_id', type=int)
 
-    summary_rows = (
-        build_summary_query(selected_company, selected_culture, selected_product)
-        .group_by(
-            Company.name,
-            Culture.name,
-            Product.name,
-            Unit.name
-        )
-        .order_by(
-            Company.name,
-            Culture.name,
-            Product.name
-        )
-        .all()
-    )
+@job_handler(EXPORT_PDF_JOB)
+def _export_pdf_job(job, selected_company=None, selected_culture=None, selected_product=None):
+    register_pdf_fonts()
+
+    summary_rows = get_summary_rows(selected_company, selected_culture, selected_product)
 
     total_quantity = sum((row.total_quantity or 0) for row in summary_rows)
     units_in_result = sorted(set(row.unit_name for row in summary_rows if row.unit_name))
@@ -224,10 +232,5 @@ def export_pdf():
 
     doc.build(elements)
 
-    pdf = buffer.getvalue()
+    job.save_artifact("plans_summary.pdf", buffer.getvalue(), "application/pdf")
     buffer.close()
-
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'attachment; filename=plans_summary.pdf'
-    return response
\ No newline at end of file
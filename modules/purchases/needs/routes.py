@@ -1,5 +1,5 @@
 # modules/purchases/needs/routes.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from io import BytesIO
 from sqlalchemy.orm import joinedload
 from extensions import db
@@ -13,20 +13,22 @@ from modules.purchases.needs.services import get_summary
 from modules.reference.products.models import Product
 from modules.reference.cultures.models import Culture
 from modules.reference.companies.models import Company
-from modules.reference.units.models import Unit
-from modules.reference.manufacturers.models import Manufacturer
 from modules.reference.payers.models import Payer
+from modules.reference.cache import reference_cache
+from modules.reference.labels import label_resolver, resolve_labels
 
 # Проплати
 from modules.purchases.payments.models import PaymentInbox
+from modules.purchases.payments.services import build_inbox_lines
 
 # Розподіл між платниками (НОВЕ джерело для заявки)
 from modules.purchases.payer_allocation.models import PayerAllocation
 from modules.purchases.payer_allocation.services import (
     get_consolidated_with_remaining,  # (company, product, payer, manufacturer, unit) + qty_remaining
-    get_already_ordered_map,          # (company, product, payer) -> already
-    reconcile_allocations_against_plans,  # авто-очистка "хвостів"
+    sync_pending_changes,             # дельта-синк змінених планів
 )
+from modules.purchases.payer_allocation.jobs import RECONCILE_JOB, RECONCILE_MIN_INTERVAL  # авто-очистка "хвостів"
+from modules.jobs.runner import job_handler, job_redirect, submit_job
 
 needs_bp = Blueprint(
     "needs",
@@ -61,52 +63,6 @@ def _round_up_to_package(qty: float | int | None, package_value: float | None) -
 
 
 # ---- helpers ----
-def _attach_labels(rows):
-    """
-    rows: список dict із ключами company_id, product_id, manufacturer_id, unit_id
-    Додає company_name, product_name, manufacturer_name, unit_name.
-    """
-    if not rows:
-        return rows
-
-    company_ids = {r.get("company_id") for r in rows if r.get("company_id")}
-    product_ids = {r.get("product_id") for r in rows if r.get("product_id")}
-    manufacturer_ids = {r.get("manufacturer_id") for r in rows if r.get("manufacturer_id")}
-    unit_ids = {r.get("unit_id") for r in rows if r.get("unit_id")}
-
-    companies = Company.query.filter(Company.id.in_(company_ids)).all() if company_ids else []
-    products  = Product.query.filter(Product.id.in_(product_ids)).all() if product_ids else []
-    mans      = Manufacturer.query.filter(Manufacturer.id.in_(manufacturer_ids)).all() if manufacturer_ids else []
-    units     = Unit.query.filter(Unit.id.in_(unit_ids)).all() if unit_ids else []
-
-    cmap = {c.id: c.name for c in companies}
-    pmap = {p.id: p.name for p in products}
-    mmap = {m.id: m.name for m in mans}
-    umap = {u.id: u.name for u in units}
-
-    for r in rows:
-        r["company_name"]      = r.get("company_name")      or cmap.get(r.get("company_id"), "—")
-        r["product_name"]      = r.get("product_name")      or pmap.get(r.get("product_id"), "—")
-        r["manufacturer_name"] = r.get("manufacturer_name") or mmap.get(r.get("manufacturer_id"), "—")
-        r["unit_name"]         = r.get("unit_name")         or umap.get(r.get("unit_id"), "—")
-    return rows
-
-
-def _product_package(prod: Product | None) -> str | None:
-    """
-    Тара береться з довідника Продукти. Пробуємо кілька варіантів полів/зв'язків.
-    """
-    if not prod:
-        return None
-    for attr in ("container", "package", "packaging", "package_name", "pack", "pack_name", "package_size", "pack_size", "tare", "tare_name"):
-        val = getattr(prod, attr, None)
-        if val:
-            return str(val)
-    rel = getattr(prod, "package", None)
-    name = getattr(rel, "name", None) if rel is not None else None
-    return str(name) if name else None
-
-
 def _safe_int(x, default=None):
     try:
         return int(x)
@@ -114,37 +70,6 @@ def _safe_int(x, default=None):
         return default
 
 
-def _attach_manufacturer_from_product(rows):
-    """
-    Для кожного елемента rows (dict) гарантує наявність:
-      row["manufacturer_id"], row["manufacturer_name"]
-    Дані беруться з Product.manufacturer_id → Manufacturer.name.
-    """
-    if not rows:
-        return rows
-
-    prod_ids = {r["product_id"] for r in rows if r.get("product_id")}
-    if not prod_ids:
-        return rows
-
-    # product_id -> manufacturer_id
-    products = Product.query.with_entities(Product.id, Product.manufacturer_id)\
-                            .filter(Product.id.in_(prod_ids)).all()
-    mid_map = {p.id: p.manufacturer_id for p in products if p}
-
-    mids = {mid_map.get(r["product_id"]) for r in rows if mid_map.get(r["product_id"]) }
-    mans = Manufacturer.query.with_entities(Manufacturer.id, Manufacturer.name)\
-                             .filter(Manufacturer.id.in_(mids)).all() if mids else []
-    mname = {m.id: m.name for m in mans}
-
-    for r in rows:
-        pid = r.get("product_id")
-        mid = mid_map.get(pid)
-        r["manufacturer_id"] = r.get("manufacturer_id") or mid
-        r["manufacturer_name"] = r.get("manufacturer_name") or (mname.get(mid) if mid else None) or "—"
-    return rows
-
-
 def _no_cache(resp):
     resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     resp.headers["Pragma"] = "no-cache"
@@ -164,9 +89,9 @@ def summary():
     return render_template(
         "needs/summary.html",
         data=data,
-        companies=Company.query.order_by(Company.name.asc()).all(),
-        cultures=Culture.query.order_by(Culture.name.asc()).all(),
-        products=Product.query.order_by(Product.name.asc()).all(),
+        companies=reference_cache.all(Company, order_by="name"),
+        cultures=reference_cache.all(Culture, order_by="name"),
+        products=reference_cache.all(Product, order_by="name"),
         company_id=company_id, culture_id=culture_id, product_id=product_id,
         title="Зведена потреба",
         header="📊 Зведена потреба",
@@ -179,22 +104,31 @@ def summary_sync():
     Запуск синхронізації payer_allocations із планів.
     """
     try:
-        reconcile_allocations_against_plans()
-        flash("Синхронізацію ініційовано (перевірте статуси пізніше).", "success")
+        submitted = submit_job(RECONCILE_JOB)
     except Exception as e:
         flash(f"Помилка синхронізації: {e}", "danger")
-    return redirect(url_for("needs.summary"))
+        return redirect(url_for("needs.summary"))
+    return job_redirect(submitted.id, url_for("needs.summary"))
+
 
+SUMMARY_PDF_JOB = "needs.summary_export_pdf"
 
 @needs_bp.route("/export/pdf", methods=["GET"], endpoint="summary_export_pdf")
 def summary_export_pdf():
     """
-    Експорт PDF для зведення (залишаємо як було).
+    Експорт PDF для зведення — фоновою задачею.
     """
-    company_id = request.args.get("company_id", type=int)
-    culture_id = request.args.get("culture_id", type=int)
-    product_id = request.args.get("product_id", type=int)
+    params = {
+        "company_id": request.args.get("company_id", type=int),
+        "culture_id": request.args.get("culture_id", type=int),
+        "product_id": request.args.get("product_id", type=int),
+    }
+    return job_redirect(submit_job(SUMMARY_PDF_JOB, params).id, request.referrer)
 
+
+@job_handler(SUMMARY_PDF_JOB)
+def _summary_export_pdf_job(job, company_id=None, culture_id=None, product_id=None):
+    """PDF зведення (див. summary_export_pdf) — артефакт задачі."""
     data = get_summary(company_id=company_id, culture_id=culture_id, product_id=product_id)
 
     # ==== PDF (ReportLab) ====
@@ -237,9 +171,7 @@ def summary_export_pdf():
     elements = [Paragraph("Зведена потреба", style_title), Spacer(1, 6), table]
     doc.build(elements)
 
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, mimetype='application/pdf',
-                     download_name='summary.pdf')
+    job.save_artifact("summary.pdf", buffer.getvalue(), "application/pdf")
 
 
 @needs_bp.route("/request", methods=["GET"], endpoint="request_form")
@@ -253,20 +185,23 @@ def request_form():
     product_id = request.args.get("product_id", type=int)
     payer_id   = request.args.get("payer_id", type=int)
 
-    # ── авто-очистка «хвостів» перед побудовою списку ───────────────────────────
+    # ── авто-очистка «хвостів»: дельта-синк тут, звірка — фоновою задачею ─────────
+    # (не частіше RECONCILE_MIN_INTERVAL на область; результат видно з наступного перегляду)
     try:
-        reconcile_allocations_against_plans(
-            company_id=company_id,
-            product_ids=[product_id] if product_id else None,
+        sync_pending_changes()
+        submit_job(
+            RECONCILE_JOB,
+            {"company_id": company_id, "product_ids": [product_id] if product_id else None},
+            min_interval=RECONCILE_MIN_INTERVAL,
         )
     except Exception:
         # не валимо сторінку, якщо щось пішло не так
-        pass
+        db.session.rollback()
     # ────────────────────────────────────────────────────────────────────────────
 
-    companies = Company.query.order_by(Company.name.asc()).all()
-    products  = Product.query.order_by(Product.name.asc()).all()
-    payers    = Payer.query.order_by(Payer.name.asc()).all()
+    companies = reference_cache.all(Company, order_by="name")
+    products  = reference_cache.all(Product, order_by="name")
+    payers    = reference_cache.all(Payer, order_by="name")
 
     # Тягнемо консолідацію навіть без company_id (покаже всі підприємства)
     base = get_consolidated_with_remaining(
@@ -295,9 +230,8 @@ def request_form():
             "available": avail,  # ОКРУГЛЕНО ДО ТАРИ
         })
 
-    # Добиваємо відсутні ярлики/виробника з продукту
-    rows = _attach_manufacturer_from_product(rows)
-    rows = _attach_labels(rows)
+    # Добиваємо відсутні ярлики/виробника з продукту (назви з консолідації вже в мемо запиту)
+    resolve_labels(rows, from_product=("manufacturer",), default="—")
 
     selection_enabled = bool(company_id)
 
@@ -358,25 +292,33 @@ def request_preview():
     )
     idx = {(r["product_id"], r["payer_id"]): r for r in base}
 
+    # продукти, тара, виробники й назва компанії — пакетно з кешу довідників
+    labels = label_resolver()
+    products = labels.products(pid for pid, _ in pairs)
+    packages = labels.package_labels(products)
+    man_names = labels.labels("manufacturer", (p.manufacturer_id for p in products.values() if p is not None))
+    company_name = labels.labels("company", [company_id]).get(company_id)
+
     chosen = []
     for pid, pay in pairs:
         qty = float(qty_map.get((pid, pay), 0.0) or 0.0)
         row = idx.get((pid, pay))
-        product = Product.query.get(pid)
+        product = products.get(pid)
+
+        # виробник тільки з продукту (стале значення)
+        mid = product.manufacturer_id if product else None
+        mname = (man_names.get(mid) if mid else None) or "—"
 
         if not row:
             # fallback: якщо фільтри змінилися між запитами
-            mid = product.manufacturer_id if product else None
-            mobj = Manufacturer.query.get(mid) if mid else None
-            mname = mobj.name if mobj else "—"
             chosen.append({
                 "product_id": pid,
                 "product_name": product.name if product else f"#{pid}",
                 "payer_id": pay,
                 "payer_name": None,
                 "company_id": company_id,
-                "company_name": Company.query.get(company_id).name if company_id else None,
-                "package": _product_package(product),
+                "company_name": company_name,
+                "package": packages.get(pid),
                 "manufacturer_id": mid,
                 "manufacturer_name": mname,
                 "requested_qty": qty,
@@ -388,11 +330,6 @@ def request_preview():
         available = _round_up_to_package(float(row.get("qty_remaining") or row.get("available") or 0.0), pkg_val)
         eff_qty   = min(qty, available)  # не більше округленого залишку
 
-        # виробник тільки з продукту (стале значення)
-        mid = product.manufacturer_id if product else None
-        mobj = Manufacturer.query.get(mid) if mid else None
-        mname = mobj.name if mobj else "—"
-
         chosen.append({
             "product_id": pid,
             "product_name": row.get("product_name") or (product.name if product else f"#{pid}"),
@@ -400,14 +337,14 @@ def request_preview():
             "payer_name": row.get("payer_name"),
             "company_id": company_id,
             "company_name": row.get("company_name"),
-            "package": row.get("package") or _product_package(product),
+            "package": row.get("package") or packages.get(pid),
             "manufacturer_id": mid,
             "manufacturer_name": mname,
             "requested_qty": eff_qty,
             "available_qty": available,
         })
 
-    company = Company.query.get(company_id) if company_id else None
+    company = reference_cache.get(Company, company_id) if company_id else None
 
     # ВАЖЛИВО: не передаємо список manufacturers у шаблон — UI має показувати статичний текст
     return render_template(
@@ -442,28 +379,21 @@ def request_submit():
             flash("Немає позицій для відправки.", "warning")
             return redirect(url_for("needs.request_form", company_id=company_id or ""))
 
-        # Побудуємо мапи для антидублювання й обмеження за залишком
-        totals_rows = get_consolidated_with_remaining(company_id=company_id)
-        total_map = {
-            (r["product_id"], r["payer_id"]): float(r.get("qty_total") or r.get("total_qty") or 0.0)
-            for r in totals_rows
-        }
-
-        already_map = get_already_ordered_map(company_id=company_id)  # (company, product, payer) -> already
-
-        # Базовий залишок (плани - уже замовлено - склад) по (product_id, payer_id)
-        remaining_rows = get_consolidated_with_remaining(company_id=company_id)
+        # Базовий залишок (плани - уже замовлено - склад) по (product_id, payer_id) — один запит;
+        # ключа нема в консолідації → плану нема, залишок 0
         remaining_map = {
             (r["product_id"], r["payer_id"]): float(r.get("qty_remaining") or 0.0)
-            for r in remaining_rows
+            for r in get_consolidated_with_remaining(company_id=company_id)
         }
 
-        # Пакетне підвантаження продуктів і виробників
-        pids = {_safe_int(x) for x in product_ids if _safe_int(x) is not None}
-        products = {p.id: p for p in (Product.query.filter(Product.id.in_(pids)).all() if pids else [])}
-
-        man_ids = {p.manufacturer_id for p in products.values() if p and p.manufacturer_id}
-        manmap = {m.id: m for m in (Manufacturer.query.filter(Manufacturer.id.in_(man_ids)).all() if man_ids else [])}
+        # Пакетне підвантаження продуктів, тари, виробників, одиниць і платників (кеш довідників)
+        labels = label_resolver()
+        products = labels.products(_safe_int(x) for x in product_ids)
+        packages = labels.package_labels(products)
+        man_names = labels.labels("manufacturer", (p.manufacturer_id for p in products.values() if p is not None))
+        unit_names = labels.labels("unit", (p.unit_id for p in products.values() if p is not None))
+        payer_names = labels.labels("payer", (_safe_int(x) for x in payer_ids))
+        company_name = labels.labels("company", [company_id]).get(company_id)
 
         items = []
         used_map = {}  # локально додане у цьому сабміті: (pid, pay) -> added_qty
@@ -481,13 +411,10 @@ def request_submit():
                 continue
 
             product = products.get(pid)
-            package = _product_package(product)
+            package = packages.get(pid)
 
             # межа: (план - уже замовлено - склад) - локально додане у цьому сабміті
-            base_remaining = remaining_map.get(
-                (pid, pay),
-                max(total_map.get((pid, pay), 0.0) - already_map.get((company_id, pid, pay), 0.0), 0.0)
-            )
+            base_remaining = remaining_map.get((pid, pay), 0.0)
             added = used_map.get((pid, pay), 0.0)
             remaining = max(base_remaining - added, 0.0)
 
@@ -501,13 +428,9 @@ def request_submit():
 
             # ВИРОБНИК: тільки з продукту
             mid = product.manufacturer_id if product else None
-            m = manmap.get(mid) if mid else None
 
             # ім'я платника (для зручності відображення)
-            payer_name = None
-            if pay:
-                payer = Payer.query.get(pay)
-                payer_name = payer.name if payer else None
+            payer_name = payer_names.get(pay) if pay else None
 
             items.append({
                 "product_id": pid,
@@ -515,12 +438,12 @@ def request_submit():
                 "qty": eff_qty,
                 "package": package,
                 "manufacturer_id": mid,
-                "manufacturer_name": (m.name if m else None) or "—",
-                "unit": getattr(product, "unit", None).name if product and getattr(product, "unit", None) else None,
+                "manufacturer_name": (man_names.get(mid) if mid else None) or "—",
+                "unit": unit_names.get(product.unit_id) if product and product.unit_id else None,
                 "payer_id": pay,
                 "payer_name": payer_name,
                 "company_id": company_id,
-                "company_name": Company.query.get(company_id).name if company_id else None,
+                "company_name": company_name,
             })
 
             used_map[(pid, pay)] = added + eff_qty
@@ -534,6 +457,8 @@ def request_submit():
             status="submitted",
             items_json=items,
         )
+        # dual-write: ті самі рядки в payment_inbox_items (для SQL-агрегації «вже замовлено»)
+        inbox.lines = build_inbox_lines(items, company_id=company_id, status=inbox.status)
         db.session.add(inbox)
         db.session.commit()
 
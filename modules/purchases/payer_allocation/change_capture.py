@@ -0,0 +1,88 @@
+# modules/purchases/payer_allocation/change_capture.py
+# -*- coding: utf-8 -*-
+"""
+Change capture для дельта-синку payer_allocations.
+
+Слухаємо flush ORM-сесії: будь-яка зміна Plan/Treatment (а також площі/компанії Field)
+записує field_id у payer_allocation_changes у тій самій транзакції.
+Далі services.sync_pending_changes() перераховує лише ці поля.
+
+Масові query.update()/delete() повз ORM сюди не потрапляють — після них потрібен повний синк.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import event, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from modules.plans.models import Plan, Treatment
+from modules.reference.fields.field_models import Field
+from .models import AllocationChange
+
+_INFO_KEY = "payer_allocation_dirty"
+
+# зміна цих колонок Field впливає на qty / company_id у розподілі
+_FIELD_COLS = ("area", "company_id")
+
+
+def _values(obj, attr: str) -> set:
+    """Поточне + попереднє (до зміни) значення атрибута, без None."""
+    out = {getattr(obj, attr, None)}
+    out.update(inspect(obj).attrs[attr].history.deleted)
+    out.discard(None)
+    return out
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_dirty(session, flush_context, instances):
+    field_ids, plan_ids = session.info.setdefault(_INFO_KEY, (set(), set()))
+
+    with session.no_autoflush:
+        for obj in chain(session.new, session.dirty, session.deleted):
+            if isinstance(obj, Plan):
+                if obj in session.dirty and not session.is_modified(obj):
+                    continue
+                field_ids |= _values(obj, "field_id")
+
+            elif isinstance(obj, Treatment):
+                if obj in session.dirty and not session.is_modified(obj):
+                    continue
+                ids = _values(obj, "plan_id")
+                if ids:
+                    plan_ids |= ids
+                elif obj.plan is not None:  # новий обробіток через plan.treatments.append(...)
+                    field_ids |= _values(obj.plan, "field_id")
+
+            elif isinstance(obj, Field) and obj in session.dirty:
+                state = inspect(obj)
+                if any(state.attrs[c].history.has_changes() for c in _FIELD_COLS):
+                    field_ids.add(obj.id)
+
+
+@event.listens_for(Session, "after_flush")
+def _write_changes(session, flush_context):
+    pending = session.info.pop(_INFO_KEY, None)
+    if not pending:
+        return
+    field_ids, plan_ids = pending
+
+    conn = session.connection()
+    if plan_ids:
+        plans_t = Plan.__table__
+        rows = conn.execute(select(plans_t.c.field_id).where(plans_t.c.id.in_(list(plan_ids))))
+        field_ids |= {r.field_id for r in rows if r.field_id is not None}
+
+    if field_ids:
+        now = datetime.utcnow()
+        conn.execute(
+            insert(AllocationChange.__table__),
+            [{"field_id": int(f), "created_at": now} for f in field_ids],
+        )
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session, previous_transaction):
+    session.info.pop(_INFO_KEY, None)
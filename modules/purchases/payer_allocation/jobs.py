@@ -0,0 +1,53 @@
+# modules/purchases/payer_allocation/jobs.py
+# -*- coding: utf-8 -*-
+"""
+Фонові задачі розподілу: повний синк із планів і звірка з планами (modules/jobs).
+Сторінки лише ставлять задачу в чергу; однакові запити об'єднуються за ключем.
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+from flask import current_app
+
+from modules.jobs.runner import job_handler
+from .parallel_sync import sync_from_plans_parallel
+from .services import reconcile_allocations_against_plans, sync_from_plans
+
+SYNC_JOB = "payer_allocation.sync"
+RECONCILE_JOB = "payer_allocation.reconcile"
+
+# звірка перед показом форми заявки — не частіше, ніж раз на стільки секунд на область
+RECONCILE_MIN_INTERVAL = 60
+
+
+@job_handler(SYNC_JOB)
+def sync_job(job, company_id: Optional[int] = None):
+    job.progress(0.0, "Оновлення з планів…")
+    # повний синк — партиціями в пулі процесів, якщо увімкнено (PAYER_ALLOCATION_SYNC_PROCESSES > 1)
+    processes = current_app.config.get("PAYER_ALLOCATION_SYNC_PROCESSES", 1)
+    if company_id is None and processes > 1:
+        stats = sync_from_plans_parallel(
+            processes=processes,
+            on_partition=lambda done, total: job.progress(done / total, f"Оновлення з планів: {done}/{total}…"),
+        )
+    else:
+        stats = sync_from_plans(company_id=company_id)
+    message = (
+        f"Оновлено з планів: додано {stats.get('added', 0)}, змінено {stats.get('updated', 0)}, "
+        f"позначено застарілими {stats.get('marked_stale', 0)}. Активних: {stats.get('total_active', 0)}."
+    )
+    failed = stats.get("failed_partitions")
+    if failed:
+        message += f" Не вдалось для компаній: {', '.join(str(c) for p in failed for c in p['company_ids'])}."
+    job.progress(1.0, message)
+    return stats
+
+
+@job_handler(RECONCILE_JOB)
+def reconcile_job(job, company_id: Optional[int] = None, product_ids: Optional[Sequence[int]] = None):
+    job.progress(0.0, "Звірка розподілу з планами…")
+    marked = reconcile_allocations_against_plans(company_id=company_id, product_ids=product_ids)
+    job.progress(1.0, f"Звірку завершено: позначено застарілими {marked}.")
+    return {"marked_stale": marked}
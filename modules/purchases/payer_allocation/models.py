@@ -40,3 +40,16 @@ class PayerAllocation(db.Model):
     manufacturer = db.relationship("Manufacturer")
     unit = db.relationship("Unit")
     payer = db.relationship("Payer")
+
+
+class AllocationChange(db.Model):
+    """
+    Журнал «брудних» полів для дельта-синку payer_allocations.
+    Рядок пишеться в тій самій транзакції, що й зміна Plan/Treatment (див. change_capture.py);
+    sync_pending_changes() перераховує лише ці поля і вичищає оброблені записи.
+    """
+    __tablename__ = "payer_allocation_changes"
+
+    id = db.Column(db.Integer, primary_key=True)
+    field_id = db.Column(db.Integer, nullable=False, index=True)  # без FK: поле могли вже видалити
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,187 @@
+# modules/purchases/payer_allocation/parallel_sync.py
+# -*- coding: utf-8 -*-
+"""
+Паралельний повний синк payer_allocations із планів (річна хвиля затверджень).
+
+Робота ділиться на партиції — компанії або кластери компаній. Кожна партиція — звичайний
+sync_from_plans(company_id=...) в окремому процесі пулу зі своїм застосунком, engine
+і сесією (spawn — без успадкованих з'єднань). Партиції не перетинаються: ключ
+(field_id, product_id) належить компанії поля, тож процеси не пишуть ті самі рядки.
+Після партицій — один UPDATE ... NOT EXISTS (_mark_stale_scoped) лише для рядків поза
+партиціями (компанії без планів, рядки без компанії): разом це той самий результат, що й
+повний синк одним викликом, і рядки партицій не рахуються двічі (зокрема в dry_run, де
+зміни партицій відкочено). Рядки компаній партиції, що не вдалась, лишаються як були.
+
+Лічильники партицій зводяться в один SyncStats; партиція, що впала, перезапускається
+окремо (retries разів). На SQLite (один записувач) — звичайний послідовний синк.
+
+Як і повний sync_from_plans, наприкінці вичищає журнал payer_allocation_changes до id,
+що був на старті, — крім полів компаній із партицій, що так і не вдались.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import func
+
+from extensions import db
+from .models import PayerAllocation
+from .services import (
+    SyncStats, _build_plans_query, _changes_max_id, _mark_stale_scoped, clear_changes, sync_from_plans,
+)
+
+PARTITION_BY = ("company", "cluster")
+
+Partition = Tuple[int, ...]
+
+
+# ----------------------------- партиції -----------------------------
+
+def _parallel_supported() -> bool:
+    return db.engine.dialect.name != "sqlite"
+
+
+def _plan_partitions(by: str = "company", only_approved_in_plain: bool = True) -> List[Partition]:
+    """
+    Партиції (кортежі company_id) компаній, що мають рядки в планах; найбільші — першими,
+    щоб довгі партиції не лишались на хвіст. Вага — кількість ключів (field_id, product_id).
+    """
+    keys = _build_plans_query(only_approved_in_plain=only_approved_in_plain, aggregate=True).subquery()
+    weights = {
+        int(r.company_id): int(r.n)
+        for r in db.session.query(keys.c.company_id, func.count().label("n"))
+        .filter(keys.c.company_id.isnot(None))
+        .group_by(keys.c.company_id)
+    }
+    if by == "company":
+        groups: Dict[object, List[int]] = {cid: [cid] for cid in weights}
+    elif by == "cluster":
+        companies_t = db.metadata.tables["companies"]
+        groups = {}
+        for r in db.session.query(companies_t.c.id, companies_t.c.cluster_id).filter(
+            companies_t.c.id.in_(list(weights))
+        ):
+            groups.setdefault(r.cluster_id, []).append(int(r.id))
+    else:
+        raise ValueError(f"Невідомий поділ на партиції: {by!r} (очікується одне з {PARTITION_BY})")
+
+    partitions = [tuple(sorted(cids)) for cids in groups.values()]
+    partitions.sort(key=lambda p: sum(weights[c] for c in p), reverse=True)
+    return partitions
+
+
+# ----------------------------- процес пулу -----------------------------
+
+_worker_app = None
+
+
+def _init_worker() -> None:
+    """Ініціалізатор процесу пулу: власний застосунок (а з ним engine і сесія)."""
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+
+
+def _sync_partition(company_ids: Partition, options: dict) -> dict:
+    stats = SyncStats()
+    with _worker_app.app_context():
+        try:
+            for company_id in company_ids:
+                stats.add(sync_from_plans(company_id=company_id, **options))
+        finally:
+            db.session.remove()
+    return stats.as_dict()
+
+
+# ----------------------------- публічне API -----------------------------
+
+def sync_from_plans_parallel(
+    *,
+    processes: Optional[int] = None,
+    by: str = "company",
+    retries: int = 1,
+    only_approved_in_plain: bool = True,
+    dry_run: bool = False,
+    on_partition: Optional[Callable[[int, int], None]] = None,
+) -> dict:
+    """
+    Повний синк із планів партиціями в пулі процесів (processes, за замовчуванням — кількість CPU).
+    by: 'company' | 'cluster'. on_partition(готово, усього) — для прогресу.
+
+    Повертає SyncStats.as_dict() + partitions, processes, retried, failed_partitions
+    (партиції, що не вдались і після повторів; решта даних при цьому синхронізована).
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or not _parallel_supported():
+        stats = sync_from_plans(only_approved_in_plain=only_approved_in_plain, dry_run=dry_run)
+        return {**stats, "partitions": 0, "processes": 1, "retried": 0, "failed_partitions": []}
+
+    changes_max_id = None if dry_run else _changes_max_id()
+    partitions = _plan_partitions(by, only_approved_in_plain)
+    # сесія батьківського процесу не тримає транзакцію, поки партиції пишуть
+    db.session.rollback()
+
+    options = {"only_approved_in_plain": only_approved_in_plain, "dry_run": dry_run}
+    total = SyncStats()
+    errors: Dict[Partition, str] = {}
+    pending = list(partitions)
+    retried = 0
+    done = 0
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            retried += len(pending)
+            current_app.logger.warning("payer_allocation sync: повтор партицій %s", pending)
+        failed: List[Partition] = []
+        with ProcessPoolExecutor(
+            max_workers=min(processes, len(pending)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        ) as pool:
+            futures = {pool.submit(_sync_partition, p, options): p for p in pending}
+            for future in as_completed(futures):
+                partition = futures[future]
+                try:
+                    total.add(future.result())
+                except Exception as e:
+                    errors[partition] = f"{type(e).__name__}: {e}"
+                    failed.append(partition)
+                    continue
+                errors.pop(partition, None)
+                done += 1
+                if on_partition is not None:
+                    on_partition(done, len(partitions))
+        pending = failed
+
+    for partition in pending:
+        current_app.logger.error("payer_allocation sync: партиція %s не вдалась: %s", partition, errors[partition])
+
+    # рядки поза партиціями (компанії без планів, без company_id)
+    total.marked_stale += _mark_stale_scoped(
+        datetime.utcnow(),
+        exclude_company_ids=[cid for p in partitions for cid in p],
+        only_approved_in_plain=only_approved_in_plain,
+    )
+    if dry_run:
+        db.session.rollback()
+    else:
+        if changes_max_id is not None:
+            clear_changes(changes_max_id, keep_company_ids=[cid for p in pending for cid in p])
+        db.session.commit()
+    total.total_active = PayerAllocation.query.filter_by(status="active").count()
+
+    return {
+        **total.as_dict(),
+        "partitions": len(partitions),
+        "processes": min(processes, len(partitions)) if partitions else 0,
+        "retried": retried,
+        "failed_partitions": [{"company_ids": list(p), "error": errors[p]} for p in pending],
+    }
@@ -0,0 +1,122 @@
+# modules/purchases/payer_allocation/result_cache.py
+# -*- coding: utf-8 -*-
+"""
+Мемо результатів консолідації (get_consolidated_with_remaining) у пам'яті процесу.
+
+Ключ = (аргументи фільтра, версії таблиць-джерел). Версії — локальні лічильники, які
+збільшує шина інвалідації (cache_bus) після commit, що змінив таблицю, у цьому процесі
+або в іншому воркері (перевірка на початку запиту). Старі записи просто перестають
+збігатися за ключем і витісняються LRU (не більше maxsize записів).
+
+Обхід мемо:
+  * поза запитом (скрипти) — крос-воркерні версії там не перевіряються;
+  * сесія вже змінила таблицю-джерело і ще не закомітила — рахуємо по БД.
+
+Повертаються копії рядків, тож викликач може їх змінювати.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from flask import has_request_context
+
+from cache_bus import invalidation_bus
+from extensions import db
+
+# таблиці, від яких залежать цифри й назви консолідації
+CONSOLIDATION_TABLES = (
+    "payer_allocations",
+    "payment_inbox",
+    "payment_inbox_items",
+    "stock_transactions",
+    "stock_balances",
+    "products",
+    "companies",
+    "units",
+    "payers",
+    "manufacturers",
+)
+CONSOLIDATION_CACHE_SIZE = 256
+
+
+class VersionedResultCache:
+    def __init__(self, name: str, tables: Iterable[str], maxsize: int):
+        self.name = name
+        self.tables = tuple(tables)
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {t: 0 for t in self.tables}
+        self._entries: "OrderedDict[tuple, List[dict]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "bypass": 0, "evictions": 0, "invalidations": 0}
+
+    # ----------------------------- версії -----------------------------
+
+    def bump(self, table_names: Iterable[str]) -> None:
+        """Нова версія таблиць — записи зі старими версіями більше не збігаються."""
+        with self._lock:
+            for name in table_names:
+                if name in self._versions:
+                    self._versions[name] += 1
+                    self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _version_key(self) -> Tuple[int, ...]:
+        return tuple(self._versions[t] for t in self.tables)
+
+    def _bypassed(self) -> bool:
+        if not has_request_context():
+            return True
+        dirty = invalidation_bus.dirty_tables(db.session)
+        return any(t in dirty for t in self.tables)
+
+    # ----------------------------- читання -----------------------------
+
+    def get_or_compute(self, args: tuple, compute: Callable[[], List[dict]]) -> List[dict]:
+        if self._bypassed():
+            self._stats["bypass"] += 1
+            return compute()
+
+        key = (args, self._version_key())
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+        if rows is None:
+            self._stats["misses"] += 1
+            rows = compute()
+            with self._lock:
+                # поки рахували, версії могли змінитися — тоді результат не зберігаємо
+                if self._version_key() == key[1]:
+                    self._entries[key] = [dict(r) for r in rows]
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self._stats["evictions"] += 1
+            return rows
+        return [dict(r) for r in rows]
+
+    # ----------------------------- метрики -----------------------------
+
+    def stats(self) -> dict:
+        total = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": round(self._stats["hits"] / total, 3) if total else None,
+            "entries": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+consolidation_cache = VersionedResultCache("consolidation", CONSOLIDATION_TABLES, CONSOLIDATION_CACHE_SIZE)
+
+
+def init_consolidation_cache(app) -> None:
+    """Підписка мемо консолідації на шину інвалідації. Викликається з create_app."""
+    invalidation_bus.subscribe(CONSOLIDATION_TABLES, consolidation_cache.bump)
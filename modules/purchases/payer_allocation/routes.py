@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from datetime import datetime
 from io import BytesIO
 import re
@@ -8,9 +8,13 @@ from extensions import db
 from .models import PayerAllocation
 from .forms import AllocationFilterForm, BulkAssignForm
 from modules.reference.payers.models import Payer
+from modules.reference.cache import reference_cache
 from modules.reference.fields.field_models import Field
 from modules.reference.products.models import Product
-from .services import sync_from_plans  # синхронізація з планів
+from .services import sync_pending_changes  # дельта-синк з планів
+from .jobs import SYNC_JOB  # повний синк — фоновою задачею
+from . import change_capture  # noqa: F401  — журнал змін Plan/Treatment для дельта-синку
+from modules.jobs.runner import job_handler, job_redirect, submit_job
 
 bp = Blueprint(
     "payer_allocation",
@@ -22,7 +26,7 @@ bp = Blueprint(
 # ----------------------- ХЕЛПЕРИ -----------------------
 
 def _pick_id(x):
-    """Повертає .id для QuerySelectField або саме значення для SelectField(coerce=int)."""
+    """Повертає .id для CachedSelectField (RefRow) або саме значення для SelectField(coerce=int)."""
     return getattr(x, "id", x) if x else None
 
 def _unit_text(u):
@@ -45,6 +49,9 @@ def index():
     manufacturer_id = _pick_id(form.manufacturer.data)
     payer_id = _pick_id(form.payer.data)
 
+    # Дельта-синк полів, чиї плани змінились після останнього перегляду
+    sync_pending_changes()
+
     q = (
         PayerAllocation.query
         .filter(PayerAllocation.status == "active")
@@ -74,18 +81,16 @@ def index():
 
     rows = q.all()
 
-    # Первинний автосинк лише коли ФІЛЬТРИ НЕ ЗАДАНО, щоб уникнути петлі редіректів.
+    # Первинний автосинк лише коли ФІЛЬТРИ НЕ ЗАДАНО — фоновою задачею; щойно виконаний
+    # (state == "recent") повторно не запускаємо, щоб уникнути петлі редіректів.
     if not rows and not any([company_id, product_id, manufacturer_id, payer_id]):
-        stats = sync_from_plans()
-        if stats.get("added") or stats.get("updated"):
-            flash(
-                f"Виконано первинний імпорт з планів: додано {stats.get('added', 0)}, змінено {stats.get('updated', 0)}.",
-                "info",
-            )
-            return redirect(url_for("payer_allocation.index", **request.args))
+        submitted = submit_job(SYNC_JOB, min_interval=60)
+        if submitted.state != "recent":
+            flash("Виконується первинний імпорт з планів.", "info")
+            return job_redirect(submitted.id, url_for("payer_allocation.index", **request.args))
 
     # для селекторів платника в таблиці
-    payers = Payer.query.order_by(Payer.name).all()
+    payers = reference_cache.all(Payer, order_by="name")
 
     return render_template(
         "payer_allocation/index.html",
@@ -99,14 +104,9 @@ def index():
 
 @bp.route("/sync", methods=["POST"])
 def sync():
-    """Ручне оновлення з планів (upsert активних рядків, збереження payer_id)."""
-    stats = sync_from_plans()
-    flash(
-        f"Оновлено з планів: додано {stats.get('added', 0)}, змінено {stats.get('updated', 0)}, "
-        f"позначено застарілими {stats.get('marked_stale', 0)}. Активних: {stats.get('total_active', 0)}.",
-        "success",
-    )
-    return redirect(url_for("payer_allocation.index"))
+    """Ручне оновлення з планів (upsert активних рядків, збереження payer_id) — фоновою задачею."""
+    submitted = submit_job(SYNC_JOB)
+    return job_redirect(submitted.id, url_for("payer_allocation.index"))
 
 @bp.route("/bulk-assign", methods=["POST"])
 def bulk_assign():
@@ -127,7 +127,7 @@ def bulk_assign():
         flash("Список обраних порожній.", "warning")
         return redirect(url_for("payer_allocation.index"))
 
-    payer = form.payer.data  # QuerySelectField -> об'єкт; SelectField(coerce=int) -> int
+    payer = form.payer.data  # CachedSelectField -> RefRow; SelectField(coerce=int) -> int
     if not payer:
         flash("Оберіть платника.", "warning")
         return redirect(url_for("payer_allocation.index"))
@@ -182,18 +182,26 @@ def set_payer(row_id):
     flash("Змінено платника.", "success")
     return redirect(url_for("payer_allocation.index"))
 
+EXPORT_PDF_JOB = "payer_allocation.export_pdf"
+
 @bp.route("/export_pdf", methods=["GET"])
 def export_pdf():
     """
-    Експорт поточного відфільтрованого списку у PDF.
+    Експорт поточного відфільтрованого списку у PDF — фоновою задачею.
     Очікує ті самі query params, що й index(): company, product, manufacturer, payer (ID).
     """
     # фільтри з query string
-    company_id = request.args.get("company", type=int)
-    product_id = request.args.get("product", type=int)
-    manufacturer_id = request.args.get("manufacturer", type=int)
-    payer_id = request.args.get("payer", type=int)
-
+    params = {
+        "company_id": request.args.get("company", type=int),
+        "product_id": request.args.get("product", type=int),
+        "manufacturer_id": request.args.get("manufacturer", type=int),
+        "payer_id": request.args.get("payer", type=int),
+    }
+    return job_redirect(submit_job(EXPORT_PDF_JOB, params).id, request.referrer)
+
+@job_handler(EXPORT_PDF_JOB)
+def _export_pdf_job(job, company_id=None, product_id=None, manufacturer_id=None, payer_id=None):
+    """PDF розподілу (див. export_pdf) — артефакт задачі."""
     q = (
         PayerAllocation.query
         .filter(PayerAllocation.status == "active")
@@ -287,8 +295,7 @@ def export_pdf():
 
     elements.append(table)
     doc.build(elements)
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name="payer_allocation.pdf", mimetype="application/pdf")
+    job.save_artifact("payer_allocation.pdf", buffer.getvalue(), "application/pdf")
 
 # ----------------------- АУДИТ -----------------------
 
@@ -307,7 +314,7 @@ def audit():
 
     # селект-опції
     fields = Field.query.order_by(Field.name).all()
-    payers = Payer.query.order_by(Payer.name).all()
+    payers = reference_cache.all(Payer, order_by="name")
 
     # Базовий реєстр призначень
     alloc_q = (
@@ -0,0 +1,156 @@
+# modules/purchases/payer_allocation/schema_profile.py
+# -*- coding: utf-8 -*-
+"""
+Профіль схеми для сервісів розподілу: які моделі планів і які колонки/таблиці
+реально є в db.metadata. Визначається ОДИН раз при старті застосунку
+(init_schema_profile у create_app), далі хелпери лише читають готовий об'єкт.
+"""
+
+from __future__ import annotations
+
+import importlib
+import importlib.util
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Sequence, Tuple
+
+from extensions import db
+
+
+# кандидати назв колонок/таблиць (перший наявний виграє)
+NAME_COLS = ("name", "title", "full_name", "caption")
+MANUFACTURER_ID_COLS = ("manufacturer_id", "producer_id", "vendor_id", "maker_id", "brand_id")
+UNIT_ID_COLS = ("unit_id", "uom_id")
+PACKAGE_TEXT_COLS = (
+    "container", "package", "packaging", "package_name", "pack", "pack_name", "package_size", "pack_size", "tara",
+)
+PACKAGE_FK_COLS = ("container_id", "package_id", "pack_id", "tara_id", "packing_id")
+PACKAGE_TABLES = ("containers", "packages", "packs", "taras", "packagings")
+MANUFACTURER_TEXT_COLS = ("manufacturer_name", "producer", "producer_name", "brand", "maker", "vendor")
+MANUFACTURER_TABLES = ("manufacturers", "producers")
+PLAN_APPROVAL_COLS = ("is_approved", "approved_at", "status")
+LABEL_TABLES = ("companies", "products", "units", "payers", "fields") + MANUFACTURER_TABLES
+
+
+@dataclass(frozen=True)
+class SchemaProfile:
+    plan_model: Any
+    treatment_model: Any
+    use_approved: bool
+    plan_approval_cols: Tuple[str, ...]
+
+    # products
+    product_manufacturer_id_col: Optional[Any]
+    product_unit_id_col: Optional[Any]
+    product_package_text_col: Optional[Any]
+    product_package_fk_col: Optional[Any]
+    product_manufacturer_text_col: Optional[Any]
+
+    # довідник тари для FK-варіанту: (Table, name_col)
+    package_table: Optional[Tuple[Any, Any]]
+    # таблиця виробників, з якої беремо назви
+    manufacturer_table: Optional[str]
+
+    # {table_name: name_col} для підстановки назв
+    name_cols: Mapping[str, Any]
+
+    # журнал складу + матеріалізовані залишки (stock_balances)
+    has_stock_ledger: bool
+
+    def describe(self) -> str:
+        def col(c):
+            return c.name if c is not None else "—"
+
+        pkg = col(self.product_package_text_col)
+        if self.product_package_text_col is None and self.product_package_fk_col is not None:
+            pkg_t = self.package_table[0].name if self.package_table else "—"
+            pkg = f"{col(self.product_package_fk_col)}→{pkg_t}"
+        return (
+            f"plans={self.plan_model.__name__}/{self.treatment_model.__name__}"
+            f" approved_by={','.join(self.plan_approval_cols) or '—'}"
+            f" manufacturer_id={col(self.product_manufacturer_id_col)}"
+            f" unit_id={col(self.product_unit_id_col)}"
+            f" package={pkg}"
+            f" manufacturer_text={col(self.product_manufacturer_text_col)}"
+            f" manufacturers={self.manufacturer_table or '—'}"
+            f" stock_ledger={'yes' if self.has_stock_ledger else 'no'}"
+        )
+
+
+def _detect(table, names: Sequence[str]):
+    """table.c.<col> першої наявної назви з 'names' або None."""
+    if table is None:
+        return None
+    for n in names:
+        if n in table.c:
+            return table.c[n]
+    return None
+
+
+def _resolve_plan_models():
+    """(Plan, Treatment, use_approved) — Approved*, якщо такі моделі справді є."""
+    if importlib.util.find_spec("modules.plans.approved_plans.models") is not None:
+        mod = importlib.import_module("modules.plans.approved_plans.models")
+        plan = getattr(mod, "ApprovedPlan", None)
+        treatment = getattr(mod, "ApprovedTreatment", None)
+        if plan is not None and treatment is not None:
+            return plan, treatment, True
+    from modules.plans.models import Plan, Treatment
+    return Plan, Treatment, False
+
+
+def build_schema_profile() -> SchemaProfile:
+    tables = db.metadata.tables
+    plan, treatment, use_approved = _resolve_plan_models()
+    plans_t = plan.__table__
+    products_t = tables.get("products")
+
+    name_cols = {}
+    for tname in LABEL_TABLES:
+        name_c = _detect(tables.get(tname), NAME_COLS)
+        if name_c is not None:
+            name_cols[tname] = name_c
+
+    package_table = None
+    for tname in PACKAGE_TABLES:
+        name_c = _detect(tables.get(tname), NAME_COLS)
+        if name_c is not None:
+            package_table = (tables[tname], name_c)
+            break
+
+    manufacturer_table = next((t for t in MANUFACTURER_TABLES if t in name_cols), None)
+
+    return SchemaProfile(
+        plan_model=plan,
+        treatment_model=treatment,
+        use_approved=use_approved,
+        plan_approval_cols=tuple(c for c in PLAN_APPROVAL_COLS if c in plans_t.c),
+        product_manufacturer_id_col=_detect(products_t, MANUFACTURER_ID_COLS),
+        product_unit_id_col=_detect(products_t, UNIT_ID_COLS),
+        product_package_text_col=_detect(products_t, PACKAGE_TEXT_COLS),
+        product_package_fk_col=_detect(products_t, PACKAGE_FK_COLS),
+        product_manufacturer_text_col=_detect(products_t, MANUFACTURER_TEXT_COLS),
+        package_table=package_table,
+        manufacturer_table=manufacturer_table,
+        name_cols=MappingProxyType(name_cols),
+        has_stock_ledger="stock_transactions" in tables and "stock_balances" in tables,
+    )
+
+
+_profile: Optional[SchemaProfile] = None
+
+
+def init_schema_profile(app) -> SchemaProfile:
+    """Викликається з create_app() після імпорту моделей; пише в лог обраний профіль."""
+    global _profile
+    _profile = build_schema_profile()
+    app.logger.info("payer_allocation schema profile: %s", _profile.describe())
+    return _profile
+
+
+def get_schema_profile() -> SchemaProfile:
+    """Готовий профіль; для скриптів без create_app() визначається ліниво при першому виклику."""
+    global _profile
+    if _profile is None:
+        _profile = build_schema_profile()
+    return _profile
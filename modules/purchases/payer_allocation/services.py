@@ -4,38 +4,30 @@
 Сервіси для підблоку 'Розподіл між платниками', без жорстких імпортів ORM-моделей Field/Product.
 Працює напряму з таблицями через db.metadata.tables['fields'] та ['products'].
 Підтримує Approved* або звичайні Plan/Treatment, консолідацію та зворотну сумісність.
+Які моделі/колонки використовувати — визначає SchemaProfile (schema_profile.py) один раз при старті.
 """
 
 from __future__ import annotations
-import json
 
-import importlib
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-from sqlalchemy import and_, or_, func, case
-from extensions import db
-from .models import PayerAllocation
+from sqlalchemy import String, and_, or_, func, case, cast, bindparam, literal, select, update, delete
+from extensions import db, dialect_insert
+from .models import PayerAllocation, AllocationChange
+from .result_cache import CONSOLIDATION_TABLES, consolidation_cache
+from .schema_profile import get_schema_profile
+from modules.reference.labels import resolve_labels
+from singleflight import copy_rows, single_flight
 
 
 # ----------------------------- утиліти планів/таблиць -----------------------------
 
 def _load_plan_models():
-    """Повертає (Plan, Treatment, use_approved: bool)."""
-    # Approved*
-    try:
-        mod = importlib.import_module("modules.plans.approved_plans.models")
-        Plan = getattr(mod, "ApprovedPlan")
-        Treatment = getattr(mod, "ApprovedTreatment")
-        return Plan, Treatment, True
-    except Exception:
-        pass
-    # Звичайні
-    mod = importlib.import_module("modules.plans.models")
-    Plan = getattr(mod, "Plan")
-    Treatment = getattr(mod, "Treatment")
-    return Plan, Treatment, False
+    """Повертає (Plan, Treatment, use_approved: bool) з профілю схеми."""
+    profile = get_schema_profile()
+    return profile.plan_model, profile.treatment_model, profile.use_approved
 
 
 def _get_table(name: str):
@@ -46,18 +38,6 @@ def _get_table(name: str):
     return tbl
 
 
-def _table_has_col(table, col: str) -> bool:
-    return col in table.c
-
-
-def _detect_col(table, names: List[str]):
-    """Повертає table.c.<col> першої наявної назви з 'names' або None."""
-    for n in names:
-        if _table_has_col(table, n):
-            return getattr(table.c, n)
-    return None
-
-
 # ----------------------------- структури даних -----------------------------
 
 @dataclass(frozen=True)
@@ -79,6 +59,12 @@ class SyncStats:
     marked_stale: int = 0
     total_active: int = 0
 
+    def add(self, stats: dict) -> None:
+        """Додати лічильники іншого синку (партиції); total_active — лише стан таблиці, не сумується."""
+        self.added += stats.get("added", 0)
+        self.updated += stats.get("updated", 0)
+        self.marked_stale += stats.get("marked_stale", 0)
+
     def as_dict(self) -> dict:
         return {
             "added": self.added,
@@ -90,29 +76,82 @@ class SyncStats:
 
 # ----------------------------- побудова запиту до планів (через таблиці) -----------------------------
 
+def _plan_scope_conds(
+    fields_t,
+    treats_t,
+    *,
+    company_id: Optional[int] = None,
+    field_ids: Optional[Sequence[int]] = None,
+    product_ids: Optional[Sequence[int]] = None,
+) -> list:
+    """Умови області (компанія поля / поля / продукти) для запитів до планів."""
+    conds = []
+    if company_id:
+        conds.append(fields_t.c.company_id == company_id)
+    if field_ids:
+        conds.append(fields_t.c.id.in_(list(field_ids)))
+    if product_ids:
+        conds.append(treats_t.c.product_id.in_(list(product_ids)))
+    return conds
+
+
+def _approved_plan_cond(plans_t):
+    """
+    Для звичайних планів — ознака «затверджений» за наявними колонками (OR варіантів)
+    або None, якщо жодної колонки затвердження немає.
+    """
+    approved_variants = []
+    approval_cols = get_schema_profile().plan_approval_cols
+
+    # 1) boolean прапор
+    if "is_approved" in approval_cols:
+        approved_variants.append(plans_t.c.is_approved == True)  # noqa: E712
+
+    # 2) мітка часу затвердження
+    if "approved_at" in approval_cols:
+        approved_variants.append(plans_t.c.approved_at.isnot(None))
+
+    # 3) текстовий статус (case-insensitive), БЕЗ 'готовий/ready'
+    if "status" in approval_cols:
+        status_col = func.lower(plans_t.c.status)
+        approved_variants.append(
+            status_col.in_([
+                "затверджений", "затверджено",
+                "approved", "approve", "approved_ok"
+            ])
+        )
+
+    return or_(*approved_variants) if approved_variants else None
+
+
 def _build_plans_query(
     *,
     only_approved_in_plain: bool = True,
     company_id: Optional[int] = None,
     field_ids: Optional[Sequence[int]] = None,
     product_ids: Optional[Sequence[int]] = None,
+    aggregate: bool = False,
 ):
     """
     Формує запит до (Approved)Plan/Treatment та таблиці fields:
       повертає: field_id, company_id, product_id, qty = fields.area * treatments.rate.
     БЕЗ імпорту ORM-класів Field/Product.
+
+    aggregate=True — GROUP BY (field_id, company_id, product_id) і SUM(qty) у БД:
+    один рядок на ключ розподілу замість рядка на кожну обробку.
     """
     Plan, Treatment, use_approved = _load_plan_models()
     fields_t = _get_table("fields")
     plans_t = Plan.__table__
     treats_t = Treatment.__table__
 
+    qty = fields_t.c.area * treats_t.c.rate
     q = (
         db.session.query(
             fields_t.c.id.label("field_id"),
             fields_t.c.company_id.label("company_id"),
             treats_t.c.product_id.label("product_id"),
-            (fields_t.c.area * treats_t.c.rate).label("qty"),
+            (func.sum(qty) if aggregate else qty).label("qty"),
         )
         .select_from(
             fields_t
@@ -121,49 +160,73 @@ def _build_plans_query(
         )
     )
 
-    conds = []
-    if company_id:
-        conds.append(fields_t.c.company_id == company_id)
-    if field_ids:
-        conds.append(fields_t.c.id.in_(list(field_ids)))
-    if product_ids:
-        conds.append(treats_t.c.product_id.in_(list(product_ids)))
+    conds = _plan_scope_conds(
+        fields_t, treats_t, company_id=company_id, field_ids=field_ids, product_ids=product_ids,
+    )
     if conds:
         q = q.filter(and_(*conds))
 
     # Для звичайних планів — беремо ТІЛЬКИ затверджені
     if not use_approved and only_approved_in_plain:
-        approved_variants = []
-
-        # 1) boolean прапор
-        if _table_has_col(plans_t, "is_approved"):
-            approved_variants.append(plans_t.c.is_approved == True)  # noqa: E712
-
-        # 2) мітка часу затвердження
-        if _table_has_col(plans_t, "approved_at"):
-            approved_variants.append(plans_t.c.approved_at.isnot(None))
-
-        # 3) текстовий статус (case-insensitive), БЕЗ 'готовий/ready'
-        if _table_has_col(plans_t, "status"):
-            status_col = func.lower(plans_t.c.status)
-            approved_variants.append(
-                status_col.in_([
-                    "затверджений", "затверджено",
-                    "approved", "approve", "approved_ok"
-                ])
-            )
-
-        # застосовуємо лише approved-ознаки
-        if approved_variants:
-            q = q.filter(or_(*approved_variants))
+        approved = _approved_plan_cond(plans_t)
+        if approved is not None:
+            q = q.filter(approved)
+
+    if aggregate:
+        q = q.group_by(fields_t.c.id, fields_t.c.company_id, treats_t.c.product_id)
 
     return q
 
 
+def _plan_key_exists(
+    alloc_t,
+    *,
+    only_approved_in_plain: bool = True,
+    company_id: Optional[int] = None,
+    field_ids: Optional[Sequence[int]] = None,
+    product_ids: Optional[Sequence[int]] = None,
+):
+    """
+    Корельований EXISTS: для рядка alloc_t є (затверджений) план/обробка з тим самим
+    (field_id, product_id) у заданій області — ті самі умови, що й у _build_plans_query.
+    """
+    Plan, Treatment, use_approved = _load_plan_models()
+    fields_t = _get_table("fields")
+    plans_t = Plan.__table__
+    treats_t = Treatment.__table__
+
+    conds = [
+        fields_t.c.id == alloc_t.c.field_id,
+        treats_t.c.product_id == alloc_t.c.product_id,
+        *_plan_scope_conds(
+            fields_t, treats_t, company_id=company_id, field_ids=field_ids, product_ids=product_ids,
+        ),
+    ]
+    if not use_approved and only_approved_in_plain:
+        approved = _approved_plan_cond(plans_t)
+        if approved is not None:
+            conds.append(approved)
+
+    return (
+        select(literal(1))
+        .select_from(
+            fields_t
+            .join(plans_t, plans_t.c.field_id == fields_t.c.id)
+            .join(treats_t, treats_t.c.plan_id == plans_t.c.id)
+        )
+        .where(*conds)
+        .exists()
+    )
+
+
 
 # ----------------------------- агрегація -----------------------------
 
 def _aggregate_rows(plan_rows: Iterable) -> Tuple[Dict[AggKey, AggValue], List[int]]:
+    """
+    Рядки планів → {AggKey: AggValue} і список продуктів. Рядки з _build_plans_query(aggregate=True)
+    вже по одному на ключ; детальні (по обробках) — сумуються тут.
+    """
     agg: Dict[AggKey, AggValue] = {}
     product_ids: set = set()
 
@@ -194,9 +257,10 @@ def _load_products_meta(product_ids: Sequence[int]) -> Dict[int, dict]:
     if not product_ids:
         return {}
 
+    profile = get_schema_profile()
     products_t = _get_table("products")
-    manuf_id_c = _detect_col(products_t, ["manufacturer_id", "producer_id", "vendor_id", "maker_id", "brand_id"])
-    unit_id_c  = _detect_col(products_t, ["unit_id", "uom_id"])
+    manuf_id_c = profile.product_manufacturer_id_col
+    unit_id_c  = profile.product_unit_id_col
 
     cols = [products_t.c.id]
     if manuf_id_c is not None:
@@ -218,100 +282,14 @@ def _load_products_meta(product_ids: Sequence[int]) -> Dict[int, dict]:
     return out
 
 
-# ----------------------------- допоміжні хелпери назв/тари -----------------------------
-
-def _name_col(table):
-    """Колонка з назвою: name/title/full_name/caption, якщо є."""
-    return _detect_col(table, ["name", "title", "full_name", "caption"])
-
-
-def _fetch_names(table_name: str, ids: set) -> dict:
-    """Повертає {id: name} з довільної таблиці; безпечно повертає {} якщо таблиці/колонки нема."""
-    if not ids:
-        return {}
-    try:
-        t = _get_table(table_name)
-    except Exception:
-        return {}
-    name_c = _name_col(t)
-    if name_c is None:
-        return {}
-    rows = db.session.query(t.c.id, name_c.label("name")).filter(t.c.id.in_(list(ids))).all()
-    return {int(r.id): r.name for r in rows}
-
-
-def _fetch_product_package(prod_ids: set) -> dict:
-    """
-    {product_id: package_text}. Підтримує:
-      - текстові колонки: container/package/packaging/package_name/pack/pack_name/package_size/pack_size/tara
-      - FK: container_id/package_id/pack_id/tara_id/packing_id із підтягуванням назв
-    """
-    if not prod_ids:
-        return {}
-    try:
-        products_t = _get_table("products")
-    except Exception:
-        return {}
-
-    # 1) текст
-    txt_c = _detect_col(
-        products_t,
-        ["container", "package", "packaging", "package_name", "pack", "pack_name", "package_size", "pack_size", "tara"],
-    )
-    if txt_c is not None:
-        rows = db.session.query(products_t.c.id, txt_c.label("pkg")).filter(products_t.c.id.in_(list(prod_ids))).all()
-        return {int(r.id): (str(r.pkg) if r.pkg is not None else None) for r in rows}
-
-    # 2) FK
-    fk_c = _detect_col(products_t, ["container_id", "package_id", "pack_id", "tara_id", "packing_id"])
-    if fk_c is None:
-        return {}
-
-    rows = db.session.query(products_t.c.id, fk_c.label("pkg_id")).filter(products_t.c.id.in_(list(prod_ids))).all()
-    ids = {int(r.pkg_id) for r in rows if r.pkg_id is not None}
-    if not ids:
-        return {}
-
-    for tbl in ["containers", "packages", "packs", "taras", "packagings"]:
-        try:
-            t = _get_table(tbl)
-            name_c = _name_col(t)
-            if name_c is None:
-                continue
-            name_rows = db.session.query(t.c.id, name_c.label("name")).filter(t.c.id.in_(list(ids))).all()
-            namemap = {int(n.id): n.name for n in name_rows}
-            return {int(r.id): namemap.get(int(r.pkg_id)) for r in rows}
-        except Exception:
-            continue
-
-    return {}
-
-
-def _fetch_product_manufacturer_name(prod_ids: set) -> dict:
-    """
-    {product_id: manufacturer_name} з текстових колонок products (fallback),
-    якщо немає або не використовується FK на таблицю виробників.
-    """
-    if not prod_ids:
-        return {}
-    try:
-        products_t = _get_table("products")
-    except Exception:
-        return {}
-
-    txt_c = _detect_col(products_t, ["manufacturer_name", "producer", "producer_name", "brand", "maker", "vendor"])
-    if txt_c is None:
-        return {}
-
-    rows = db.session.query(products_t.c.id, txt_c.label("mname")).filter(products_t.c.id.in_(list(prod_ids))).all()
-    return {int(r.id): (str(r.mname) if r.mname is not None else None) for r in rows}
-
-
 # ----------------------------- upsert + stale -----------------------------
 
-def _get_existing_map() -> Dict[AggKey, PayerAllocation]:
+def _get_existing_map(field_ids: Optional[Sequence[int]] = None) -> Dict[AggKey, PayerAllocation]:
+    qry = PayerAllocation.query
+    if field_ids:
+        qry = qry.filter(PayerAllocation.field_id.in_(list(field_ids)))
     existing = {}
-    for row in PayerAllocation.query.all():
+    for row in qry.all():
         existing[AggKey(row.field_id, row.product_id)] = row
     return existing
 
@@ -320,8 +298,9 @@ def _upsert_allocations(
     agg_map: Dict[AggKey, AggValue],
     products_meta: Dict[int, dict],
     now: datetime,
+    field_ids: Optional[Sequence[int]] = None,
 ) -> Tuple[int, int, set]:
-    existing = _get_existing_map()
+    existing = _get_existing_map(field_ids)
 
     added = 0
     updated = 0
@@ -360,34 +339,132 @@ def _upsert_allocations(
 
 
 def _mark_stale_scoped(
-    active_keys: set,
     now: datetime,
+    *,
     company_id: Optional[int] = None,
     field_ids: Optional[Sequence[int]] = None,
     product_ids: Optional[Sequence[int]] = None,
+    exclude_company_ids: Optional[Sequence[int]] = None,
+    only_approved_in_plain: bool = True,
 ) -> int:
     """
     Позначає 'stale' лише ті рядки, що входять у задану область фільтрів.
     Якщо фільтри не вказані — працює по всій таблиці (як раніше).
-    Порівняння виконується за ключем (field_id, product_id).
+    exclude_company_ids — пропустити рядки цих компаній (рядки без компанії лишаються в області).
+    Порівняння виконується за ключем (field_id, product_id) прямо в БД:
+    один UPDATE ... WHERE NOT EXISTS (план/обробка з таким ключем), без ORM-об'єктів.
+    Повертає кількість рядків.
     """
-    qry = PayerAllocation.query.filter(PayerAllocation.status != "stale")
+    t = PayerAllocation.__table__
+    stmt = update(t).where(t.c.status != "stale")
     if company_id:
-        qry = qry.filter(PayerAllocation.company_id == company_id)
+        stmt = stmt.where(t.c.company_id == company_id)
     if field_ids:
-        qry = qry.filter(PayerAllocation.field_id.in_(list(field_ids)))
+        stmt = stmt.where(t.c.field_id.in_(list(field_ids)))
     if product_ids:
-        qry = qry.filter(PayerAllocation.product_id.in_(list(product_ids)))
+        stmt = stmt.where(t.c.product_id.in_(list(product_ids)))
+    if exclude_company_ids:
+        stmt = stmt.where(or_(t.c.company_id.is_(None), t.c.company_id.not_in(list(exclude_company_ids))))
+    stmt = stmt.where(~_plan_key_exists(
+        t,
+        only_approved_in_plain=only_approved_in_plain,
+        company_id=company_id,
+        field_ids=field_ids,
+        product_ids=product_ids,
+    ))
+    stmt = stmt.values(status="stale", updated_at=now)
+    return int(db.session.execute(stmt).rowcount or 0)
 
-    marked = 0
-    for row in qry.all():
-        key = AggKey(row.field_id, row.product_id)
-        if key not in active_keys:
-            row.status = "stale"
-            row.updated_at = now
-            marked += 1
-    return marked
 
+# ----------------------------- set-based upsert (ON CONFLICT) -----------------------------
+
+# Розмір пачки для executemany (обмежує пам'ять на параметри)
+_UPSERT_CHUNK = 1000
+
+
+def _upsert_allocations_bulk(
+    agg_map: Dict[AggKey, AggValue],
+    products_meta: Dict[int, dict],
+    now: datetime,
+) -> Tuple[int, int]:
+    """
+    Upsert у БД без ORM-об'єктів: INSERT ... ON CONFLICT (field_id, product_id) DO UPDATE
+    по обмеженню uq_alloc_field_product, пачками через executemany.
+    payer_id/assigned_at/created_at існуючих рядків не чіпаємо.
+
+    Повертає (added, updated): усі зачеплені рядки мають updated_at == now,
+    нові — ще й created_at == now, тож рахуємо одним COUNT-запитом.
+    """
+    if not agg_map:
+        return 0, 0
+
+    t = PayerAllocation.__table__
+    insert = dialect_insert()
+    stmt = insert(t)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[t.c.field_id, t.c.product_id],
+        set_={
+            "company_id": stmt.excluded.company_id,
+            "qty": stmt.excluded.qty,
+            "manufacturer_id": stmt.excluded.manufacturer_id,
+            "unit_id": stmt.excluded.unit_id,
+            "status": "active",
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+    batch: List[dict] = []
+    for key, val in agg_map.items():
+        meta = products_meta.get(key.product_id, {})
+        batch.append({
+            "field_id": key.field_id,
+            "company_id": val.company_id,
+            "product_id": key.product_id,
+            "manufacturer_id": meta.get("manufacturer_id"),
+            "unit_id": meta.get("unit_id"),
+            "qty": val.qty,
+            "status": "active",
+            "created_at": now,
+            "updated_at": now,
+        })
+        if len(batch) >= _UPSERT_CHUNK:
+            db.session.execute(stmt, batch)
+            batch = []
+    if batch:
+        db.session.execute(stmt, batch)
+
+    touched, added = (
+        db.session.query(
+            func.count(t.c.id),
+            func.coalesce(func.sum(case((t.c.created_at == now, 1), else_=0)), 0),
+        )
+        .filter(t.c.updated_at == now)
+        .one()
+    )
+    added = int(added or 0)
+    return added, int(touched or 0) - added
+
+
+def _mark_stale_bulk(
+    now: datetime,
+    company_id: Optional[int] = None,
+    field_ids: Optional[Sequence[int]] = None,
+    product_ids: Optional[Sequence[int]] = None,
+) -> int:
+    """
+    Один UPDATE: у заданій області все, що не зачепив поточний upsert
+    (updated_at != now), стає 'stale'. Повертає кількість рядків.
+    """
+    t = PayerAllocation.__table__
+    stmt = update(t).where(t.c.status != "stale", t.c.updated_at != now)
+    if company_id:
+        stmt = stmt.where(t.c.company_id == company_id)
+    if field_ids:
+        stmt = stmt.where(t.c.field_id.in_(list(field_ids)))
+    if product_ids:
+        stmt = stmt.where(t.c.product_id.in_(list(product_ids)))
+    stmt = stmt.values(status="stale", updated_at=now)
+    return int(db.session.execute(stmt).rowcount or 0)
 
 
 # ----------------------------- публічні API -----------------------------
@@ -399,47 +476,113 @@ def sync_from_plans(
     product_ids: Optional[Sequence[int]] = None,
     only_approved_in_plain: bool = True,
     dry_run: bool = False,
+    bulk: Optional[bool] = None,
 ) -> dict:
     """
     Повна синхронізація payer_allocations із (Approved)Plan/Treatment.
     Працює без імпорту ORM-класів Field/Product.
+
+    bulk=None — set-based upsert (ON CONFLICT), якщо діалект підтримує (SQLite/PostgreSQL);
+    bulk=False — старий шлях через ORM-об'єкти.
+
+    Повний синк (без фільтрів, не dry_run) покриває всі поля, тож у тій самій транзакції
+    вичищає журнал payer_allocation_changes до id, що був на початку синку.
     """
-    # 1) Будуємо запит і тягнемо плани
+    full = not (company_id or field_ids or product_ids)
+    changes_max_id = _changes_max_id() if full and not dry_run else None
+
+    # 1) Будуємо запит і тягнемо плани — вже згруповані в БД, по рядку на (field_id, product_id)
     q = _build_plans_query(
         only_approved_in_plain=only_approved_in_plain,
         company_id=company_id,
         field_ids=field_ids,
         product_ids=product_ids,
+        aggregate=True,
     )
     plan_rows = q.all()
 
-    # 2) Агрегація
+    # 2) Ключі розподілу
     agg_map, pids = _aggregate_rows(plan_rows)
 
     # 3) Метадані продуктів (manufacturer_id, unit_id)
     products_meta = _load_products_meta(pids)
 
-    # 4) Upsert
+    # 4) Upsert + 5) Позначити застарілі
     now = datetime.utcnow()
-    added, updated, active_keys = _upsert_allocations(agg_map, products_meta, now)
+    if bulk is None:
+        bulk = dialect_insert() is not None
 
-    # 5) Позначити застарілі
-    marked_stale = _mark_stale(active_keys, now)
+    if bulk:
+        added, updated = _upsert_allocations_bulk(agg_map, products_meta, now)
+        marked_stale = _mark_stale_bulk(
+            now, company_id=company_id, field_ids=field_ids, product_ids=product_ids,
+        )
+    else:
+        added, updated, _active_keys = _upsert_allocations(agg_map, products_meta, now, field_ids)
+        marked_stale = _mark_stale_scoped(
+            now,
+            company_id=company_id,
+            field_ids=field_ids,
+            product_ids=product_ids,
+            only_approved_in_plain=only_approved_in_plain,
+        )
 
     if dry_run:
         db.session.rollback()
     else:
+        if changes_max_id is not None:
+            clear_changes(changes_max_id)
         db.session.commit()
 
     # 6) Підрахунок активних
     total_active = PayerAllocation.query.filter_by(status="active").count()
 
-    return {
-        "added": added,
-        "updated": updated,
-        "marked_stale": marked_stale,
-        "total_active": total_active,
-    }
+    return SyncStats(
+        added=added,
+        updated=updated,
+        marked_stale=marked_stale,
+        total_active=total_active,
+    ).as_dict()
+
+
+def _changes_max_id() -> Optional[int]:
+    t = AllocationChange.__table__
+    return db.session.query(func.max(t.c.id)).scalar()
+
+
+def clear_changes(max_id: int, *, keep_company_ids: Optional[Sequence[int]] = None) -> int:
+    """
+    Вичищає оброблені записи журналу (id <= max_id) у поточній транзакції; записи, що
+    з'являться паралельно, лишаються на наступний раз. keep_company_ids — не чіпати поля
+    цих компаній (їх не синхронізовано). Повертає кількість рядків.
+    """
+    t = AllocationChange.__table__
+    stmt = delete(t).where(t.c.id <= max_id)
+    if keep_company_ids:
+        fields_t = _get_table("fields")
+        stmt = stmt.where(t.c.field_id.not_in(
+            select(fields_t.c.id).where(fields_t.c.company_id.in_(list(keep_company_ids)))
+        ))
+    return int(db.session.execute(stmt).rowcount or 0)
+
+
+def sync_pending_changes(*, dry_run: bool = False) -> dict:
+    """
+    Дельта-синк: перераховує лише поля з журналу payer_allocation_changes
+    (їх пише change_capture при зміні Plan/Treatment) і вичищає оброблені записи
+    в тій самій транзакції. Без змін — один запит до малого журналу.
+    """
+    t = AllocationChange.__table__
+    max_id = _changes_max_id()
+    if max_id is None:
+        return SyncStats().as_dict()
+
+    field_ids = [
+        int(r.field_id)
+        for r in db.session.query(t.c.field_id).filter(t.c.id <= max_id).distinct()
+    ]
+    clear_changes(max_id)
+    return sync_from_plans(field_ids=field_ids, dry_run=dry_run)
 
 
 def sync_single_field(field_id: int, *, dry_run: bool = False) -> dict:
@@ -451,12 +594,12 @@ def recompute_row_qty(field_id: int, product_id: int, *, commit: bool = True) ->
     """
     Перерахунок qty для конкретної пари (field_id, product_id).
     """
-    q = _build_plans_query(field_ids=[field_id], product_ids=[product_id])
-    rows = q.all()
-    if not rows:
+    q = _build_plans_query(field_ids=[field_id], product_ids=[product_id], aggregate=True)
+    agg = q.first()
+    if agg is None:
         return None
 
-    new_qty = float(sum(float(r.qty or 0.0) for r in rows))
+    new_qty = float(agg.qty or 0.0)
 
     row = PayerAllocation.query.filter_by(field_id=field_id, product_id=product_id).first()
     now = datetime.utcnow()
@@ -466,10 +609,8 @@ def recompute_row_qty(field_id: int, product_id: int, *, commit: bool = True) ->
         row.status = "active"
         row.updated_at = now
     else:
-        # company_id з таблиці fields
-        fields_t = _get_table("fields")
-        comp = db.session.query(fields_t.c.company_id).filter(fields_t.c.id == field_id).first()
-        comp_id = int(comp.company_id) if comp and comp.company_id is not None else None
+        # company_id поля — з того ж агрегованого рядка
+        comp_id = int(agg.company_id) if agg.company_id is not None else None
 
         # метадані продукту
         meta = _load_products_meta([product_id]).get(product_id, {})
@@ -496,6 +637,14 @@ def recompute_row_qty(field_id: int, product_id: int, *, commit: bool = True) ->
 
 # ----------------------------- консолідація та “замовлено” -----------------------------
 
+# статуси «Проплат», які не рахуються як «вже замовлено»
+EXCLUDED_ORDER_STATUSES = ("cancelled", "canceled", "rejected", "void", "deleted", "draft")
+
+# представлення з тією ж консолідацією (scripts/consolidated_view.py create)
+CONSOLIDATED_VIEW = "v_consolidated_remaining"
+CONSOLIDATED_FILTERS = ("company_id", "product_id", "manufacturer_id", "payer_id")
+
+
 def get_already_ordered_map(
     *,
     company_id: Optional[int] = None,
@@ -505,75 +654,252 @@ def get_already_ordered_map(
     """
     {(company_id, product_id, payer_id): already_qty} з «Проплат».
 
-    Джерело: PaymentInbox.items_json — список елементів виду:
-      { "product_id": int, "payer_id": int|null, "qty": float, ... }
+    Джерело: payment_inbox_items (нормалізовані рядки PaymentInbox.items_json) —
+    один GROUP BY по індексу (company_id, product_id, payer_id, status).
 
-    Ігноруємо записи зі статусами з EXCLUDED.
+    Ігноруємо записи зі статусами з EXCLUDED_ORDER_STATUSES.
     """
     # ледачий імпорт, щоб уникнути циклічних залежностей
-    from modules.purchases.payments.models import PaymentInbox  # type: ignore
+    from modules.purchases.payments.models import PaymentInboxItem  # type: ignore
 
-    q = PaymentInbox.query
+    q = (
+        db.session.query(
+            PaymentInboxItem.company_id,
+            PaymentInboxItem.product_id,
+            PaymentInboxItem.payer_id,
+            func.coalesce(func.sum(PaymentInboxItem.qty), 0.0).label("qty"),
+        )
+        .filter(~PaymentInboxItem.status.in_(EXCLUDED_ORDER_STATUSES))
+        .group_by(PaymentInboxItem.company_id, PaymentInboxItem.product_id, PaymentInboxItem.payer_id)
+    )
     if company_id:
-        q = q.filter(PaymentInbox.company_id == company_id)
-
-    EXCLUDED = {"cancelled", "canceled", "rejected", "void", "deleted", "draft"}
-    try:
-        q = q.filter(~PaymentInbox.status.in_(list(EXCLUDED)))
-    except Exception:
-        pass  # якщо немає поля status
-
-    rows = q.all()
-
-    want_products = set(product_ids) if product_ids else None
-    want_payers   = set(payer_ids) if payer_ids else None
-
-    acc: Dict[Tuple[int, int, Optional[int]], float] = {}
-    for inbox in rows:
-        items = getattr(inbox, "items_json", None)
-        if items is None:
-            continue
-        if isinstance(items, str):
-            try:
-                items = json.loads(items)
-            except Exception:
-                continue
-        if not isinstance(items, list):
-            continue
-
-        for it in items:
-            # product_id (підтримує альтернативні ключі)
-            pid = it.get("product_id") or it.get("product") or it.get("productId")
-            try:
-                pid = int(pid)
-            except Exception:
-                continue
-            if want_products and pid not in want_products:
-                continue
-
-            # payer_id (може бути None; підтримує альтернативні ключі)
-            pay = it.get("payer_id") or it.get("payer") or it.get("payerId")
-            try:
-                pay = int(pay) if pay is not None else None
-            except Exception:
-                pay = None
-            if want_payers and pay not in want_payers:
-                continue
-
-            # qty (fallback на requested_qty)
-            qty = it.get("qty", it.get("requested_qty", 0.0))
-            try:
-                qty = float(qty or 0.0)
-            except Exception:
-                qty = 0.0
-
-            key = (inbox.company_id, pid, pay)
-            acc[key] = acc.get(key, 0.0) + qty
-
-    return acc
+        q = q.filter(PaymentInboxItem.company_id == company_id)
+    if product_ids:
+        q = q.filter(PaymentInboxItem.product_id.in_(list(product_ids)))
+    if payer_ids:
+        q = q.filter(PaymentInboxItem.payer_id.in_(list(payer_ids)))
+
+    return {(r.company_id, r.product_id, r.payer_id): float(r.qty or 0.0) for r in q.all()}
+
+
+def _expected_package_expr(products_t):
+    """
+    (вираз тари продукту як trim-текст або '', додаткове приєднання або None) за профілем схеми.
+    """
+    profile = get_schema_profile()
+    txt_c, fk_c = profile.product_package_text_col, profile.product_package_fk_col
+    if txt_c is not None:
+        col = products_t.c[txt_c.name]
+        return func.coalesce(func.trim(cast(col, String)), ""), None
+    if fk_c is not None and profile.package_table is not None:
+        pkg_t, name_c = profile.package_table
+        pkg_t = pkg_t.alias("pkg")
+        return (
+            func.coalesce(func.trim(pkg_t.c[name_c.name]), ""),
+            (pkg_t, pkg_t.c.id == products_t.c[fk_c.name]),
+        )
+    return literal(""), None
 
 
+def _stock_cte(filters: frozenset):
+    """
+    CTE stock: залишок stock_balances по (company_id, product_id, payer_id).
+    Компанія/платник — за *_id балансу, для старих рядків без id — за текстовим снапшотом назви.
+    Рахуємо лише тару, що відповідає тарі продукту (якщо обидві відомі).
+    """
+    sb = _get_table("stock_balances")
+    products_t = _get_table("products")
+    companies_t = _get_table("companies")
+    payers_t = _get_table("payers")
+
+    company_by_name = (
+        select(func.max(companies_t.c.id))
+        .where(companies_t.c.name == func.trim(sb.c.consumer_company_name))
+        .scalar_subquery()
+    )
+    payer_by_name = (
+        select(func.max(payers_t.c.id))
+        .where(payers_t.c.name == func.trim(sb.c.payer_name))
+        .scalar_subquery()
+    )
+    expected_pkg, pkg_join = _expected_package_expr(products_t)
+    pkg = func.coalesce(func.trim(sb.c.package_text), "")
+
+    source = sb.join(products_t, products_t.c.id == sb.c.product_id)
+    if pkg_join is not None:
+        source = source.outerjoin(*pkg_join)
+
+    keyed = (
+        select(
+            func.coalesce(sb.c.consumer_company_id, company_by_name).label("company_id"),
+            sb.c.product_id.label("product_id"),
+            func.coalesce(sb.c.payer_id, payer_by_name).label("payer_id"),
+            sb.c.qty.label("qty"),
+        )
+        .select_from(source)
+        .where(or_(expected_pkg == "", pkg == "", expected_pkg == pkg))
+    )
+    if "product_id" in filters:
+        keyed = keyed.where(sb.c.product_id == bindparam("product_id"))
+    keyed = keyed.cte("stock_rows")
 
+    q = (
+        select(
+            keyed.c.company_id,
+            keyed.c.product_id,
+            keyed.c.payer_id,
+            func.sum(keyed.c.qty).label("qty"),
+        )
+        .group_by(keyed.c.company_id, keyed.c.product_id, keyed.c.payer_id)
+    )
+    if "company_id" in filters:
+        q = q.where(keyed.c.company_id == bindparam("company_id"))
+    if "payer_id" in filters:
+        q = q.where(keyed.c.payer_id == bindparam("payer_id"))
+    return q.cte("stock")
+
+
+def _build_consolidated_select(filters: frozenset, with_labels: bool):
+    from modules.purchases.payments.models import PaymentInboxItem  # type: ignore
+
+    pa = PayerAllocation.__table__
+    pii = PaymentInboxItem.__table__
+
+    alloc = (
+        select(
+            pa.c.company_id, pa.c.product_id, pa.c.manufacturer_id, pa.c.unit_id, pa.c.payer_id,
+            func.sum(pa.c.qty).label("total_qty"),
+        )
+        .where(pa.c.status == "active")
+        .group_by(pa.c.company_id, pa.c.product_id, pa.c.manufacturer_id, pa.c.unit_id, pa.c.payer_id)
+    )
+    ordered = (
+        select(pii.c.company_id, pii.c.product_id, pii.c.payer_id, func.sum(pii.c.qty).label("qty"))
+        .where(pii.c.status.not_in(EXCLUDED_ORDER_STATUSES))
+        .group_by(pii.c.company_id, pii.c.product_id, pii.c.payer_id)
+    )
+    if "company_id" in filters:
+        alloc = alloc.where(pa.c.company_id == bindparam("company_id"))
+        ordered = ordered.where(pii.c.company_id == bindparam("company_id"))
+    if "product_id" in filters:
+        alloc = alloc.where(pa.c.product_id == bindparam("product_id"))
+        ordered = ordered.where(pii.c.product_id == bindparam("product_id"))
+    if "manufacturer_id" in filters:
+        alloc = alloc.where(pa.c.manufacturer_id == bindparam("manufacturer_id"))
+    if "payer_id" in filters:
+        alloc = alloc.where(pa.c.payer_id == bindparam("payer_id"))
+        ordered = ordered.where(pii.c.payer_id == bindparam("payer_id"))
+    alloc = alloc.cte("alloc")
+    ordered = ordered.cte("ordered")
+
+    def _on(cte):
+        return and_(
+            cte.c.company_id == alloc.c.company_id,
+            cte.c.product_id == alloc.c.product_id,
+            cte.c.payer_id.is_not_distinct_from(alloc.c.payer_id),
+        )
+
+    source = alloc.outerjoin(ordered, _on(ordered))
+    total = func.coalesce(alloc.c.total_qty, 0.0)
+    already = func.coalesce(ordered.c.qty, 0.0)
+    if get_schema_profile().has_stock_ledger:
+        stock_cte = _stock_cte(filters)
+        source = source.outerjoin(stock_cte, _on(stock_cte))
+        stock = func.coalesce(stock_cte.c.qty, 0.0)
+    else:
+        stock = literal(0.0)
+    rest = total - already - stock
+
+    columns = [
+        alloc.c.company_id, alloc.c.product_id, alloc.c.manufacturer_id, alloc.c.unit_id, alloc.c.payer_id,
+        total.label("total_qty"),
+        already.label("already_ordered_qty"),
+        stock.label("stock_qty"),
+        case((rest > 0, rest), else_=0.0).label("remaining_qty"),
+    ]
+
+    if with_labels:
+        products_t = _get_table("products")
+        companies_t = _get_table("companies")
+        units_t = _get_table("units")
+        payers_t = _get_table("payers")
+        manufacturers_t = _get_table("manufacturers")
+        expected_pkg, pkg_join = _expected_package_expr(products_t)
+
+        source = (
+            source
+            .outerjoin(companies_t, companies_t.c.id == alloc.c.company_id)
+            .outerjoin(products_t, products_t.c.id == alloc.c.product_id)
+            .outerjoin(units_t, units_t.c.id == alloc.c.unit_id)
+            .outerjoin(payers_t, payers_t.c.id == alloc.c.payer_id)
+            .outerjoin(manufacturers_t, manufacturers_t.c.id == alloc.c.manufacturer_id)
+        )
+        if pkg_join is not None:
+            source = source.outerjoin(*pkg_join)
+
+        man_txt_c = get_schema_profile().product_manufacturer_text_col
+        manufacturer_name = manufacturers_t.c.name
+        if man_txt_c is not None:
+            manufacturer_name = func.coalesce(manufacturers_t.c.name, products_t.c[man_txt_c.name])
+
+        columns += [
+            companies_t.c.name.label("company_name"),
+            products_t.c.name.label("product_name"),
+            units_t.c.name.label("unit_name"),
+            payers_t.c.name.label("payer_name"),
+            manufacturer_name.label("manufacturer_name"),
+            func.nullif(expected_pkg, "").label("package"),
+        ]
+
+    return (
+        select(*columns)
+        .select_from(source)
+        .order_by(alloc.c.company_id, alloc.c.product_id, alloc.c.manufacturer_id, alloc.c.unit_id, alloc.c.payer_id)
+    )
+
+
+# {(фільтри, with_labels): SELECT} — побудова конструкції дорожча за сам запит, тож
+# тримаємо по одній на набір фільтрів (значення — bindparam); скидається зі зміною профілю
+_consolidated_selects: Dict[tuple, object] = {}
+_consolidated_selects_profile = None
+
+
+def consolidated_remaining_select(filters: Iterable[str] = (), *, with_labels: bool = False):
+    """
+    Один SELECT з CTE:
+      alloc   — активні payer_allocations, згруповані по (company, product, manufacturer, unit, payer);
+      ordered — «вже замовлено» з payment_inbox_items по (company, product, payer);
+      stock   — залишок stock_balances по тих самих id (див. _stock_cte).
+    remaining_qty = max(total − already − stock, 0) рахується в SQL.
+    filters — назви фільтрів з CONSOLIDATED_FILTERS; значення передаються при виконанні:
+      db.session.execute(consolidated_remaining_select(["company_id"]), {"company_id": 5}).
+    with_labels=True додає назви довідників і тару (для представлення CONSOLIDATED_VIEW).
+    """
+    global _consolidated_selects_profile
+    filters = frozenset(filters)
+    unknown = filters - set(CONSOLIDATED_FILTERS)
+    if unknown:
+        raise ValueError(f"Невідомі фільтри консолідації: {sorted(unknown)}")
+
+    profile = get_schema_profile()
+    if _consolidated_selects_profile is not profile:
+        _consolidated_selects.clear()
+        _consolidated_selects_profile = profile
+    key = (filters, with_labels)
+    stmt = _consolidated_selects.get(key)
+    if stmt is None:
+        stmt = _consolidated_selects[key] = _build_consolidated_select(filters, with_labels)
+    return stmt
+
+
+def consolidated_view_ddl(dialect) -> Tuple[str, str]:
+    """(DROP, CREATE) для представлення CONSOLIDATED_VIEW під діалект БД."""
+    stmt = consolidated_remaining_select(with_labels=True).order_by(None)
+    sql = stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    return f"DROP VIEW IF EXISTS {CONSOLIDATED_VIEW}", f"CREATE VIEW {CONSOLIDATED_VIEW} AS\n{sql}"
+
+
+@single_flight("payer_allocation.consolidated", tables=CONSOLIDATION_TABLES, share=copy_rows, cross_worker=True)
 def get_consolidated_with_remaining(
     *,
     company_id: Optional[int] = None,
@@ -585,63 +911,34 @@ def get_consolidated_with_remaining(
     Консолідація активних рядків із total_qty, already_ordered_qty, remaining_qty
     + ПІДСТАНОВА НАЗВ: company_name, product_name, manufacturer_name, unit_name, payer_name
     + АЛІАСИ: qty_total, qty_already, qty_remaining.
+    Цифри — одним запитом (consolidated_remaining_select), назви — з кешу довідників.
+    Повторні виклики з тими ж фільтрами без змін у таблицях-джерелах віддаються
+    з consolidation_cache (result_cache.py); однакові одночасні виклики з різних потоків
+    рахуються один раз (singleflight.py).
     """
-    q = (
-        db.session.query(
-            PayerAllocation.company_id,
-            PayerAllocation.product_id,
-            PayerAllocation.manufacturer_id,
-            PayerAllocation.unit_id,
-            PayerAllocation.payer_id,
-            func.sum(PayerAllocation.qty).label("total_qty"),
-        )
-        .filter(PayerAllocation.status == "active")
-        .group_by(
-            PayerAllocation.company_id,
-            PayerAllocation.product_id,
-            PayerAllocation.manufacturer_id,
-            PayerAllocation.unit_id,
-            PayerAllocation.payer_id,
-        )
+    # ті самі правила, що й раніше: 0/None у company/product/manufacturer — без фільтра
+    params = {
+        "company_id": company_id or None,
+        "product_id": product_id or None,
+        "manufacturer_id": manufacturer_id or None,
+        "payer_id": payer_id,
+    }
+    params = {k: v for k, v in params.items() if v is not None}
+    return consolidation_cache.get_or_compute(
+        tuple(sorted(params.items())),
+        lambda: _compute_consolidated_with_remaining(params),
     )
 
-    if company_id:
-        q = q.filter(PayerAllocation.company_id == company_id)
-    if product_id:
-        q = q.filter(PayerAllocation.product_id == product_id)
-    if manufacturer_id:
-        q = q.filter(PayerAllocation.manufacturer_id == manufacturer_id)
-    if payer_id is not None:
-        q = q.filter(PayerAllocation.payer_id == payer_id)
-
-    rows = q.all()
-    if not rows:
-        return []
-
-    # Звузимо множини для підрахунку already_ordered
-    prod_set  = {int(r.product_id) for r in rows}
-    payer_set = {int(r.payer_id) for r in rows if r.payer_id is not None}
-
-    # already_ordered по (company_id, product_id, payer_id)
-    ordered_map = get_already_ordered_map(
-        company_id=company_id,                                   # може бути None → по всіх компаніях
-        product_ids=list(prod_set) if prod_set else None,        # звужуємо до наявних продуктів
-        payer_ids=list(payer_set) if payer_set else None,        # і до наявних платників
-    )
 
-    # stock_map по (company_id, product_id, payer_id)
-    stock_map = _get_stock_map_by_company_product_payer(
-        company_id=company_id,
-        product_ids=list(prod_set) if prod_set else None,
-        payer_ids=list(payer_set) if payer_set else None,
-    )
+def _compute_consolidated_with_remaining(params: dict) -> List[dict]:
+    rows = db.session.execute(consolidated_remaining_select(params), params).all()
 
     result: List[dict] = []
     for r in rows:
         total = float(r.total_qty or 0.0)
-        already = float(ordered_map.get((r.company_id, r.product_id, r.payer_id), 0.0))
-        stock = float(stock_map.get((r.company_id, r.product_id, r.payer_id), 0.0))
-        remaining = max(total - already - stock, 0.0)
+        already = float(r.already_ordered_qty or 0.0)
+        stock = float(r.stock_qty or 0.0)
+        remaining = float(r.remaining_qty or 0.0)
         result.append({
             "company_id": r.company_id,
             "product_id": r.product_id,
@@ -658,37 +955,8 @@ def get_consolidated_with_remaining(
             "stock_qty": stock,
         })
 
-    # Підстановка назв/тари
-    comp_ids  = {row["company_id"]      for row in result if row.get("company_id") is not None}
-    prod_ids  = {row["product_id"]      for row in result if row.get("product_id") is not None}
-    man_ids   = {row["manufacturer_id"] for row in result if row.get("manufacturer_id") is not None}
-    unit_ids  = {row["unit_id"]         for row in result if row.get("unit_id") is not None}
-    payer_ids = {row["payer_id"]        for row in result if row.get("payer_id") is not None}
-
-    cmap   = _fetch_names("companies", comp_ids)
-    pmap   = _fetch_names("products", prod_ids)
-    umap   = _fetch_names("units", unit_ids)
-    paymap = _fetch_names("payers", payer_ids)
-
-    mfg_names = {}
-    if man_ids:
-        mfg_names = _fetch_names("manufacturers", man_ids) or _fetch_names("producers", man_ids)
-
-    prod_mfg_txt = _fetch_product_manufacturer_name(prod_ids)
-    pkgmap       = _fetch_product_package(prod_ids)
-
-    for row in result:
-        row["company_name"] = cmap.get(row.get("company_id"), "—")
-        row["product_name"] = pmap.get(row.get("product_id"), "—")
-        row["unit_name"]    = umap.get(row.get("unit_id"), "—")
-        row["payer_name"]   = paymap.get(row.get("payer_id"), "—") if row.get("payer_id") is not None else "—"
-
-        mid = row.get("manufacturer_id")
-        row["manufacturer_name"] = mfg_names.get(mid) if mid is not None else None
-        if not row["manufacturer_name"]:
-            row["manufacturer_name"] = prod_mfg_txt.get(row.get("product_id")) or "—"
-
-        row["package"] = pkgmap.get(row["product_id"]) or "—"
+    # Підстановка назв/тари — один прохід через кеш довідників
+    resolve_labels(result, package_key="package", default="—")
 
     return result
 
@@ -737,119 +1005,23 @@ def reconcile_allocations_against_plans(
     """
     Звіряє payer_allocations із (Approved)Plan/Treatment і позначає зайві рядки як 'stale'.
     Працює в заданій області (компанія/поля/продукти) — решту не чіпає.
+    Один UPDATE ... WHERE NOT EXISTS у БД (_mark_stale_scoped), рядки в Python не тягнемо.
 
     Повертає кількість позначених 'stale'.
     """
-    # 1) які (field_id, product_id) реально присутні у планах зараз
-    q = _build_plans_query(
-        only_approved_in_plain=only_approved_in_plain,
+    marked = _mark_stale_scoped(
+        datetime.utcnow(),
         company_id=company_id,
         field_ids=field_ids,
         product_ids=product_ids,
+        only_approved_in_plain=only_approved_in_plain,
     )
-    plan_rows = q.all()
-    active_keys = {AggKey(int(r.field_id), int(r.product_id)) for r in plan_rows}
-
-    # 2) пробігаємось лише по релевантних снапшотах і, якщо ключа нема у планах — ставимо 'stale'
-    qry = PayerAllocation.query.filter(PayerAllocation.status != "stale")
-    if company_id:
-        qry = qry.filter(PayerAllocation.company_id == company_id)
-    if field_ids:
-        qry = qry.filter(PayerAllocation.field_id.in_(list(field_ids)))
-    if product_ids:
-        qry = qry.filter(PayerAllocation.product_id.in_(list(product_ids)))
-
-    now = datetime.utcnow()
-    marked = 0
-    for row in qry.all():
-        key = AggKey(row.field_id, row.product_id)
-        if key not in active_keys:
-            row.status = "stale"
-            row.updated_at = now
-            marked += 1
-
     if marked:
         db.session.commit()
     return marked
 
 
-# ↓ Зворотна сумісність: старі виклики _mark_stale(active_keys, now) продовжують працювати
+# ↓ Зворотна сумісність: старі виклики _mark_stale(active_keys, now) продовжують працювати.
+# Активні ключі тепер визначає сам запит до планів у БД, active_keys не використовується.
 def _mark_stale(active_keys: set, now: datetime) -> int:
-    return _mark_stale_scoped(active_keys, now)
-
-
-def _get_stock_map_by_company_product_payer(
-    *,
-    company_id: Optional[int] = None,
-    product_ids: Optional[Sequence[int]] = None,
-    payer_ids: Optional[Sequence[int]] = None,
-) -> Dict[Tuple[int, int, Optional[int]], float]:
-    """
-    {(company_id, product_id, payer_id): stock_qty}
-    Баланс на складі з таблиці stock_transactions, звужений по product_ids/payer_ids/компанії.
-    Фільтруємо також по тарі продукту (беремо з products).
-    """
-    try:
-        st = _get_table("stock_transactions")
-    except Exception:
-        return {}
-
-    want_products = set(int(x) for x in (product_ids or []))
-    if not want_products:
-        return {}
-
-    company_ids = {int(company_id)} if company_id is not None else set()
-    payer_ids_set = set(int(x) for x in (payer_ids or []))
-
-    # id->name та зворотні мапи name->id
-    cmap = _fetch_names("companies", company_ids) if company_ids else {}
-    paymap = _fetch_names("payers", payer_ids_set) if payer_ids_set else {}
-    cname2id = {v: k for k, v in cmap.items()} if cmap else None
-    pname2id = {v: k for k, v in paymap.items()} if paymap else None
-
-    # тара продукту (текст)
-    pkg_by_product = _fetch_product_package(want_products)  # {pid: '10 л' | None}
-
-    qty_case = case((st.c.tx_type == "IN", st.c.qty), else_=-st.c.qty)
-    q = (
-        db.session.query(
-            st.c.product_id,
-            st.c.consumer_company_name,
-            st.c.payer_name,
-            st.c.package_text,
-            func.coalesce(func.sum(qty_case), 0.0).label("balance"),
-        )
-        .filter(st.c.product_id.in_(list(want_products)))
-        .group_by(st.c.product_id, st.c.consumer_company_name, st.c.payer_name, st.c.package_text)
-    )
-
-    if cname2id is not None:
-        q = q.filter(st.c.consumer_company_name.in_(list(cname2id.keys())))
-    if pname2id is not None:
-        q = q.filter(st.c.payer_name.in_(list(pname2id.keys())))
-
-    rows = q.all()
-    acc: Dict[Tuple[int, int, Optional[int]], float] = {}
-    for r in rows:
-        pid = int(r.product_id)
-        consumer_name = (r.consumer_company_name or "").strip() or None
-        payer_name = (r.payer_name or "").strip() or None
-        pkg = (r.package_text or "").strip() or None
-        expected_pkg = (pkg_by_product.get(pid) or "").strip() or None
-
-        # Віднімаємо лише той склад, що відповідає тарі продукту
-        if expected_pkg and pkg and expected_pkg != pkg:
-            continue
-
-        comp_id = cname2id.get(consumer_name) if (cname2id and consumer_name) else None
-        pay_id = pname2id.get(payer_name) if (pname2id and payer_name) else None
-
-        if company_id is not None and comp_id != company_id:
-            continue
-        if payer_ids_set and pay_id not in payer_ids_set:
-            continue
-
-        key = (comp_id if comp_id is not None else None, pid, pay_id if pay_id is not None else None)
-        acc[key] = acc.get(key, 0.0) + float(r.balance or 0.0)
-
-    return acc
+    return _mark_stale_scoped(now)
@@ -20,5 +20,48 @@ class PaymentInbox(db.Model):
     # Зручно мати company для відображення назви
     company = db.relationship("Company", lazy="joined")
 
+    # Нормалізовані рядки (дубль items_json) — для SQL-агрегацій «вже замовлено»
+    lines = db.relationship(
+        "PaymentInboxItem",
+        backref="inbox",
+        cascade="all, delete-orphan",
+        lazy="select",
+    )
+
+    __table_args__ = (
+        # keyset-пагінація журналу «Проплат»
+        db.Index("ix_payment_inbox_created_id", "created_at", "id"),
+    )
+
     def __repr__(self) -> str:
         return f"<PaymentInbox id={self.id} company_id={self.company_id} status={self.status}>"
+
+
+class PaymentInboxItem(db.Model):
+    """
+    Рядок вхідної заявки в окремій таблиці (пишеться разом з items_json).
+    company_id і status продубльовані з PaymentInbox, щоб «вже замовлено»
+    рахувалось одним GROUP BY по індексу без join та розбору JSON.
+    """
+    __tablename__ = "payment_inbox_items"
+
+    id = db.Column(db.Integer, primary_key=True)
+    inbox_id = db.Column(
+        db.Integer, db.ForeignKey("payment_inbox.id", ondelete="CASCADE"), nullable=False, index=True,
+    )
+    line_idx = db.Column(db.Integer, nullable=False)  # 1-based позиція в сирому items_json (не source_line_idx складу)
+
+    company_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    payer_id = db.Column(db.Integer, db.ForeignKey("payers.id"), nullable=True)
+    manufacturer_id = db.Column(db.Integer, db.ForeignKey("manufacturers.id"), nullable=True)
+
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+    status = db.Column(db.String(32), nullable=False, default="submitted")
+
+    __table_args__ = (
+        db.Index("ix_pii_company_product_payer_status", "company_id", "product_id", "payer_id", "status"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<PaymentInboxItem inbox={self.inbox_id} #{self.line_idx} product={self.product_id} qty={self.qty}>"
@@ -1,7 +1,11 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from sqlalchemy.orm import joinedload
 from extensions import db
-from modules.purchases.payments.models import PaymentInbox
+from modules.purchases.payments.models import PaymentInbox, PaymentInboxItem
+from modules.purchases.payments.services import set_inbox_status
+from pagination import decode_cursor, keyset_paginate
+
+PER_PAGE = 200
 
 payments_bp = Blueprint(
     "payments",
@@ -16,13 +20,28 @@ def index():
     «Проплати — вхідні заявки»:
       - у шапці: підприємство (споживач), коротке резюме платників, к-сть рядків, статус, дата;
       - у деталях: Продукт, Тара, Кількість, Виробник, Платник.
+    Keyset-пагінація по (created_at, id); фільтри status/company_id переносяться в курсорі.
     """
-    q = (
-        PaymentInbox.query
-        .options(joinedload(PaymentInbox.company))
-        .order_by(PaymentInbox.created_at.desc(), PaymentInbox.id.desc())
+    cursor = decode_cursor(request.args.get("cursor"), "payments")
+    if cursor is not None:
+        filters = cursor.filters
+    else:
+        filters = {
+            "status": (request.args.get("status") or "").strip() or None,
+            "company_id": request.args.get("company_id", type=int),
+        }
+
+    q = PaymentInbox.query.options(joinedload(PaymentInbox.company))
+    if filters.get("status"):
+        q = q.filter(PaymentInbox.status == filters["status"])
+    if filters.get("company_id"):
+        q = q.filter(PaymentInbox.company_id == filters["company_id"])
+
+    page = keyset_paginate(
+        q, PaymentInbox.created_at, PaymentInbox.id,
+        scope="payments", cursor=cursor, filters=filters, per_page=PER_PAGE,
     )
-    inboxes = q.limit(200).all()
+    inboxes = page.items
 
     for r in inboxes:
         # Назва компанії (споживача)
@@ -76,6 +95,7 @@ def index():
     return render_template(
         "payments/index.html",
         items=inboxes,
+        page=page,
         title="Проплати — вхідні заявки",
         header="💳 Проплати — вхідні заявки",
     )
@@ -92,6 +112,7 @@ def delete(inbox_id: int):
 # ------- Повне очищення таблиці -------
 @payments_bp.post("/clear", endpoint="clear")
 def clear_all():
+    PaymentInboxItem.query.delete(synchronize_session=False)
     deleted = PaymentInbox.query.delete(synchronize_session=False)
     db.session.commit()
     flash(f"Очистка виконана. Видалено заявок: {deleted}.", "success")
@@ -112,7 +133,7 @@ def mark_paid(inbox_id: int):
 
     updated = False
     if hasattr(inbox, "status"):
-        inbox.status = "Оплачено"
+        set_inbox_status(inbox, "Оплачено")
         updated = True
     if hasattr(inbox, "is_paid"):
         inbox.is_paid = True
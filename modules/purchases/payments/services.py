@@ -0,0 +1,107 @@
+# modules/purchases/payments/services.py
+# -*- coding: utf-8 -*-
+"""
+Нормалізовані рядки «Проплат»: items_json → payment_inbox_items.
+items_json лишається джерелом для відображення; таблиця рядків — для SQL-агрегацій.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Iterable, List, Optional
+
+from extensions import db
+from .models import PaymentInbox, PaymentInboxItem
+
+
+def _first(it: dict, *keys):
+    """Перше непорожнє значення з альтернативних написань ключа."""
+    for k in keys:
+        v = it.get(k)
+        if v:
+            return v
+    return None
+
+
+def _as_int(v) -> Optional[int]:
+    try:
+        return int(v) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def build_inbox_lines(items: Iterable, *, company_id: Optional[int], status: str) -> List[PaymentInboxItem]:
+    """
+    Рядки PaymentInboxItem з items_json (ключі product_id/product/productId,
+    payer_id/payer/payerId, qty з fallback на requested_qty). Невалідні рядки пропускаються,
+    line_idx зберігає позицію в сирому items_json (1-based). Це НЕ source_line_idx складу:
+    склад нумерує нормалізований список (normalize_items_list відкидає частину рядків),
+    тож ці два індекси не зіставляються.
+    Старі заявки зберігають items_json текстом — такий рядок спершу розбираємо як JSON.
+    """
+    if isinstance(items, str):
+        try:
+            items = json.loads(items)
+        except ValueError:
+            return []
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        return []
+
+    lines = []
+    for idx, it in enumerate(items, start=1):
+        if not isinstance(it, dict):
+            continue
+        pid = _as_int(_first(it, "product_id", "product", "productId"))
+        if pid is None:
+            continue
+        try:
+            qty = float(it.get("qty", it.get("requested_qty", 0.0)) or 0.0)
+        except (TypeError, ValueError):
+            qty = 0.0
+
+        lines.append(PaymentInboxItem(
+            line_idx=idx,
+            company_id=company_id,
+            product_id=pid,
+            payer_id=_as_int(_first(it, "payer_id", "payer", "payerId")),
+            manufacturer_id=_as_int(it.get("manufacturer_id")),
+            qty=qty,
+            status=status,
+        ))
+    return lines
+
+
+def set_inbox_status(inbox: PaymentInbox, status: str) -> None:
+    """Змінює статус заявки разом з продубльованим статусом її рядків (без commit)."""
+    inbox.status = status
+    PaymentInboxItem.query.filter(PaymentInboxItem.inbox_id == inbox.id).update(
+        {PaymentInboxItem.status: status}, synchronize_session=False,
+    )
+
+
+def backfill_inbox_lines(*, batch_size: int = 500) -> int:
+    """
+    Одноразове заповнення payment_inbox_items з items_json для заявок, що ще не мають рядків.
+    Йде пачками по id з commit після кожної — можна перезапускати. Повертає к-сть рядків.
+    """
+    written = 0
+    last_id = 0
+    while True:
+        batch = (
+            PaymentInbox.query
+            .filter(PaymentInbox.id > last_id, ~PaymentInbox.lines.any())
+            .order_by(PaymentInbox.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for inbox in batch:
+            lines = build_inbox_lines(inbox.items_json, company_id=inbox.company_id, status=inbox.status)
+            inbox.lines = lines
+            written += len(lines)
+        last_id = batch[-1].id
+        db.session.commit()
+    return written
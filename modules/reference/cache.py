@@ -0,0 +1,270 @@
+# modules/reference/cache.py
+# -*- coding: utf-8 -*-
+"""
+Кеш довідників у пам'яті процесу (reference_cache).
+
+Для кожної зареєстрованої таблиці-довідника тримаємо знімок рядків (RefRow — прості
+об'єкти з колонками, не ORM-сутності), мапи id → рядок і name → id. Знімок позначений
+локальною версією таблиці; версія збільшується, коли шина інвалідації (cache_bus) повідомляє
+про зміну таблиці — після commit у цьому процесі або після commit в іншому воркері
+(перевірка на початку запиту). Наступне звернення бачить нову версію і перечитує
+таблицю одним SELECT.
+
+Обхід кешу:
+  * екрани самих довідників (view-функції з modules.reference.*) завжди читають БД;
+  * with reference_cache.bypass(): ... — явно для окремого блоку;
+  * сесія, що вже змінила таблицю і ще не закомітила, читає її з БД (не кешуючи).
+У перших двох випадках прочитаний знімок запам'ятовується у flask.g до кінця запиту
+(блоку bypass) або до нової версії таблиці: кілька полів форми на той самий довідник —
+один SELECT на запит.
+
+Метрики: reference_cache.stats() → {таблиця: hits/misses/bypass/version/rows}.
+Рядки знімка спільні для всіх потоків — їх не можна змінювати.
+"""
+
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import select
+
+from cache_bus import invalidation_bus
+from extensions import db
+
+
+class RefRow(SimpleNamespace):
+    """Знімок рядка довідника (лише читання)."""
+
+    def __repr__(self):
+        return f"<RefRow {getattr(self, 'id', None)} {getattr(self, 'name', '')!r}>"
+
+
+class _Entry:
+    __slots__ = ("version", "rows", "by_id", "by_name", "views")
+
+    def __init__(self, version: int, rows: List[RefRow]):
+        self.version = version
+        self.rows = rows
+        self.by_id = {r.id: r for r in rows}
+        # як і старі {name: id} — при дублікатах лишається останній
+        self.by_name = {r.name: r.id for r in rows if getattr(r, "name", None) is not None}
+        # похідні списки (choices для select-ів), живуть стільки ж, скільки знімок
+        self.views: Dict[tuple, list] = {}
+
+
+class ReferenceCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, type] = {}
+        self._versions: Dict[str, int] = {}
+        self._entries: Dict[str, _Entry] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    # ----------------------------- реєстрація / версії -----------------------------
+
+    def register(self, *models) -> None:
+        for model in models:
+            name = model.__table__.name
+            self._models[name] = model
+            self._versions.setdefault(name, 0)
+            self._stats.setdefault(name, {"hits": 0, "misses": 0, "bypass": 0})
+
+    def tracks(self, table_name: str) -> bool:
+        return table_name in self._models
+
+    def version(self, table_name: str) -> int:
+        return self._versions.get(table_name, 0)
+
+    def bump(self, table_names: Iterable[str]) -> None:
+        """Нова версія таблиць — їх знімки стають недійсними."""
+        with self._lock:
+            for name in table_names:
+                if name in self._models:
+                    self._versions[name] = self._versions.get(name, 0) + 1
+                    self._entries.pop(name, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    # ----------------------------- обхід -----------------------------
+
+    @contextmanager
+    def bypass(self):
+        """Блок, у якому всі читання йдуть у БД повз кеш."""
+        prev = g.get("reference_cache_bypass", False)
+        prev_memo = g.pop("reference_cache_memo", None)
+        g.reference_cache_bypass = True
+        try:
+            yield
+        finally:
+            g.reference_cache_bypass = prev
+            g.reference_cache_memo = prev_memo
+
+    def _bypassed(self, table_name: str) -> bool:
+        if not has_app_context():
+            return True
+        if g.get("reference_cache_bypass", False):
+            return True
+        return table_name in invalidation_bus.dirty_tables(db.session)
+
+    def _bypass_entry(self, model) -> _Entry:
+        """Знімок повз кеш; під bypass() / на екранах довідників — один на запит і версію таблиці."""
+        name = model.__table__.name
+        if not has_app_context() or name in invalidation_bus.dirty_tables(db.session):
+            return _Entry(-1, self._load(model))
+        memo = g.get("reference_cache_memo")
+        if memo is None:
+            memo = g.reference_cache_memo = {}
+        version = self._versions[name]
+        entry = memo.get(name)
+        if entry is None or entry.version != version:
+            entry = memo[name] = _Entry(version, self._load(model))
+        return entry
+
+    # ----------------------------- завантаження -----------------------------
+
+    @staticmethod
+    def _load(model) -> List[RefRow]:
+        t = model.__table__
+        result = db.session.execute(select(t).order_by(*t.primary_key.columns))
+        return [RefRow(**row._mapping) for row in result]
+
+    def _entry(self, model) -> _Entry:
+        name = model.__table__.name
+        stats = self._stats[name]
+        if self._bypassed(name):
+            stats["bypass"] += 1
+            return self._bypass_entry(model)
+
+        version = self._versions[name]
+        entry = self._entries.get(name)
+        if entry is not None and entry.version == version:
+            stats["hits"] += 1
+            return entry
+
+        stats["misses"] += 1
+        entry = _Entry(version, self._load(model))
+        with self._lock:
+            # поки читали, версія могла змінитися — тоді знімок не зберігаємо
+            if self._versions[name] == version:
+                self._entries[name] = entry
+        return entry
+
+    # ----------------------------- читання -----------------------------
+
+    @staticmethod
+    def _sorted(rows, order_by: Optional[str]) -> List[RefRow]:
+        if not order_by:
+            return list(rows)
+        return sorted(rows, key=lambda r: (getattr(r, order_by) is None, getattr(r, order_by) or ""))
+
+    def all(self, model, *, order_by: Optional[str] = None) -> List[RefRow]:
+        """Усі рядки довідника (за id або за вказаною колонкою)."""
+        return self._sorted(self._entry(model).rows, order_by)
+
+    def choices(self, model, *, label: str = "name", order_by: Optional[str] = "name") -> List[Tuple[int, str]]:
+        """[(id, підпис)] для випадаючих списків — будується раз на версію таблиці."""
+        entry = self._entry(model)
+        key = ("choices", label, order_by)
+        out = entry.views.get(key)
+        if out is None:
+            out = [(r.id, "" if getattr(r, label) is None else str(getattr(r, label)))
+                   for r in self._sorted(entry.rows, order_by)]
+            entry.views[key] = out
+        return out
+
+    def get(self, model, row_id) -> Optional[RefRow]:
+        if row_id is None:
+            return None
+        try:
+            return self._entry(model).by_id.get(int(row_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_many(self, model, ids: Iterable) -> Dict[int, RefRow]:
+        by_id = self._entry(model).by_id
+        out = {}
+        for i in ids:
+            if i is not None and int(i) in by_id:
+                out[int(i)] = by_id[int(i)]
+        return out
+
+    def label(self, model, row_id, default=None):
+        row = self.get(model, row_id)
+        if row is None:
+            return default
+        return getattr(row, "name", None) or default
+
+    def name_map(self, model) -> Dict[str, int]:
+        """{назва: id} — спільний словник, не змінювати."""
+        return self._entry(model).by_name
+
+    def id_for_name(self, model, name) -> Optional[int]:
+        if not name:
+            return None
+        return self._entry(model).by_name.get(name)
+
+    def joined(self, model, **relations) -> List[RefRow]:
+        """
+        Рядки з підставленими пов'язаними рядками: joined(Product, manufacturer=Manufacturer)
+        дає row.manufacturer (RefRow або None) за колонкою manufacturer_id.
+        """
+        targets = {attr: self._entry(rel).by_id for attr, rel in relations.items()}
+        out = []
+        for row in self._entry(model).rows:
+            extra = {attr: by_id.get(getattr(row, f"{attr}_id", None)) for attr, by_id in targets.items()}
+            out.append(RefRow(**vars(row), **extra))
+        return out
+
+    # ----------------------------- метрики -----------------------------
+
+    def stats(self) -> Dict[str, dict]:
+        out = {}
+        for name, s in sorted(self._stats.items()):
+            entry = self._entries.get(name)
+            total = s["hits"] + s["misses"]
+            out[name] = {
+                **s,
+                "hit_ratio": round(s["hits"] / total, 3) if total else None,
+                "version": self._versions.get(name, 0),
+                "rows": len(entry.rows) if entry is not None else None,
+            }
+        return out
+
+
+reference_cache = ReferenceCache()
+
+
+# ----------------------------- ініціалізація -----------------------------
+
+def _is_reference_admin_view(app) -> bool:
+    view = app.view_functions.get(request.endpoint) if request.endpoint else None
+    return view is not None and view.__module__.startswith("modules.reference.")
+
+
+def init_reference_cache(app) -> None:
+    """Реєструє довідники і обхід кешу для екранів довідників. Викликається з create_app."""
+    from modules.reference.categories.models import Category
+    from modules.reference.clusters.models import Cluster
+    from modules.reference.companies.models import Company
+    from modules.reference.cultures.models import Culture
+    from modules.reference.groups.models import Group
+    from modules.reference.manufacturers.models import Manufacturer
+    from modules.reference.payers.models import Payer
+    from modules.reference.products.models import Product
+    from modules.reference.treatment_types.models import TreatmentType
+    from modules.reference.units.models import Unit
+
+    models = (Category, Cluster, Company, Culture, Group, Manufacturer, Payer, Product, TreatmentType, Unit)
+    reference_cache.register(*models)
+    invalidation_bus.subscribe([m.__table__.name for m in models], reference_cache.bump)
+
+    @app.before_request
+    def _reference_cache_admin_bypass():
+        if has_request_context() and _is_reference_admin_view(app):
+            g.reference_cache_bypass = True
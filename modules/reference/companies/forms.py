@@ -4,6 +4,8 @@ from wtforms.validators import DataRequired, ValidationError
 from wtforms_sqlalchemy.fields import QuerySelectField
 from sqlalchemy import func
 
+from modules.reference.select_fields import CachedSelectField
+
 from modules.reference.clusters.models import Cluster
 from modules.reference.companies.models import Company
 
@@ -44,17 +46,15 @@ class CompanyForm(FlaskForm):
 
 
 class CompanyFilterForm(FlaskForm):
-    name = QuerySelectField(
+    name = CachedSelectField(
         'Підприємство',
-        query_factory=lambda: Company.query.order_by(Company.name).all(),
-        get_label='name',
+        model=Company,
         allow_blank=True,
         blank_text='— Оберіть підприємство —'
     )
-    cluster = QuerySelectField(
+    cluster = CachedSelectField(
         'Кластер',
-        query_factory=cluster_query,
-        get_label='name',
+        model=Cluster,
         allow_blank=True,
         blank_text='— Оберіть кластер —'
     )
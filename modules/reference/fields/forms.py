@@ -5,6 +5,8 @@ from wtforms import StringField, SubmitField, FloatField
 from wtforms_sqlalchemy.fields import QuerySelectField
 from wtforms.validators import DataRequired
 
+from modules.reference.select_fields import CachedSelectField
+
 from modules.reference.clusters.models import Cluster
 from modules.reference.companies.models import Company
 from modules.reference.cultures.models import Culture  # ✅ Імпорт
@@ -39,22 +41,22 @@ class FieldForm(FlaskForm):
 
 
 class FieldFilterForm(FlaskForm):
-    cluster = QuerySelectField(
+    cluster = CachedSelectField(
         'Кластер',
-        query_factory=lambda: Cluster.query.all(),
-        get_label='name',
+        model=Cluster,
+        order_by=None,
         allow_blank=True
     )
-    company = QuerySelectField(
+    company = CachedSelectField(
         'Підприємство',
-        query_factory=lambda: Company.query.all(),
-        get_label='name',
+        model=Company,
+        order_by=None,
         allow_blank=True
     )
-    culture = QuerySelectField(  # ✅ Нове!
+    culture = CachedSelectField(
         'Культура',
-        query_factory=lambda: Culture.query.all(),
-        get_label='name',
+        model=Culture,
+        order_by=None,
         allow_blank=True
     )
     submit = SubmitField('Фільтрувати')
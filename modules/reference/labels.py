@@ -0,0 +1,187 @@
+# modules/reference/labels.py
+# -*- coding: utf-8 -*-
+"""
+Підстановка назв довідників у рядки результатів (id → назва) за один прохід.
+
+resolve_labels(rows) збирає всі потрібні id з усього набору рядків (компанія, продукт,
+одиниця, платник, виробник), дістає назви з кешу довідників і дописує *_name у кожен рядок;
+за потреби — тару продукту та виробника/одиницю з продукту, якщо в рядку нема їхнього id.
+
+Назви запам'ятовуються на час запиту (label_resolver() живе у flask.g), тож ті самі id,
+що вже розв'язані сервісом, повторно не шукаються. Поза запитом — новий резолвер на виклик.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional
+
+from flask import g, has_request_context
+
+from extensions import db
+from modules.purchases.payer_allocation.schema_profile import get_schema_profile
+from modules.reference.cache import RefRow, reference_cache
+from modules.reference.companies.models import Company
+from modules.reference.manufacturers.models import Manufacturer
+from modules.reference.payers.models import Payer
+from modules.reference.products.models import Product
+from modules.reference.units.models import Unit
+
+# вид → (модель, ключ id у рядку, ключ назви за замовчуванням)
+LABEL_KINDS = {
+    "company": (Company, "company_id", "company_name"),
+    "product": (Product, "product_id", "product_name"),
+    "unit": (Unit, "unit_id", "unit_name"),
+    "payer": (Payer, "payer_id", "payer_name"),
+    "manufacturer": (Manufacturer, "manufacturer_id", "manufacturer_name"),
+}
+ALL_KINDS = tuple(LABEL_KINDS)
+
+
+def _int(v) -> Optional[int]:
+    if v is None or v == "":
+        return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class LabelResolver:
+    """Мемо назв у межах запиту поверх reference_cache."""
+
+    def __init__(self):
+        self._names: Dict[tuple, Optional[str]] = {}
+        self._products: Dict[int, Optional[RefRow]] = {}
+        self._packages: Dict[int, Optional[str]] = {}
+
+    # ----------------------------- пакетні мапи -----------------------------
+
+    def labels(self, kind: str, ids: Iterable) -> Dict[int, Optional[str]]:
+        """{id: назва або None} для одного виду."""
+        ids = {i for i in map(_int, ids) if i is not None}
+        missing = [i for i in ids if (kind, i) not in self._names]
+        if missing:
+            found = reference_cache.get_many(LABEL_KINDS[kind][0], missing)
+            for i in missing:
+                row = found.get(i)
+                self._names[(kind, i)] = (row.name or None) if row is not None else None
+        return {i: self._names[(kind, i)] for i in ids}
+
+    def products(self, ids: Iterable) -> Dict[int, Optional[RefRow]]:
+        ids = {i for i in map(_int, ids) if i is not None}
+        missing = [i for i in ids if i not in self._products]
+        if missing:
+            found = reference_cache.get_many(Product, missing)
+            for i in missing:
+                self._products[i] = found.get(i)
+                if found.get(i) is not None:
+                    self._names[("product", i)] = found[i].name or None
+        return {i: self._products[i] for i in ids}
+
+    def package_labels(self, product_ids: Iterable) -> Dict[int, Optional[str]]:
+        """{product_id: тара} — текстова колонка продукту або назва з довідника тари (профіль схеми)."""
+        products = self.products(product_ids)
+        missing = [pid for pid in products if pid not in self._packages]
+        if missing:
+            profile = get_schema_profile()
+            txt_c, fk_c = profile.product_package_text_col, profile.product_package_fk_col
+            if txt_c is not None:
+                for pid in missing:
+                    val = getattr(products[pid], txt_c.name, None) if products[pid] is not None else None
+                    self._packages[pid] = str(val) if val is not None else None
+            elif fk_c is not None and profile.package_table is not None:
+                pkg_ids = {getattr(products[pid], fk_c.name, None) for pid in missing if products[pid] is not None}
+                pkg_ids.discard(None)
+                t, name_c = profile.package_table
+                names = dict(
+                    db.session.query(t.c.id, name_c).filter(t.c.id.in_(list(pkg_ids))).all()
+                ) if pkg_ids else {}
+                for pid in missing:
+                    pkg_id = getattr(products[pid], fk_c.name, None) if products[pid] is not None else None
+                    self._packages[pid] = names.get(pkg_id)
+            else:
+                for pid in missing:
+                    self._packages[pid] = None
+        return {pid: self._packages[pid] for pid in products}
+
+    def _product_manufacturer_text(self, product: Optional[RefRow]) -> Optional[str]:
+        txt_c = get_schema_profile().product_manufacturer_text_col
+        if product is None or txt_c is None:
+            return None
+        val = getattr(product, txt_c.name, None)
+        return str(val) if val is not None else None
+
+    # ----------------------------- прохід по рядках -----------------------------
+
+    def resolve(self, rows: List[dict], *, kinds: Iterable[str] = ALL_KINDS,
+                keys: Optional[Dict[str, str]] = None, package_key: Optional[str] = None,
+                from_product: Iterable[str] = (), default=None) -> List[dict]:
+        """
+        Дописує назви в рядки (dict) на місці і повертає їх же.
+          kinds        — які види назв заповнювати;
+          keys         — інші ключі назв, напр. {"unit": "unit_text"};
+          package_key  — куди писати тару продукту (None — не писати);
+          from_product — для яких видів ("manufacturer", "unit") брати id з продукту, якщо в рядку порожньо;
+          default      — значення, якщо назву не знайдено (None — лишити рядок як є).
+        Вже заповнені назви не перезаписуються.
+        """
+        if not rows:
+            return rows
+        kinds = tuple(kinds)
+        from_product = tuple(from_product)
+        keys = keys or {}
+
+        product_ids = {_int(r.get("product_id")) for r in rows} - {None}
+        products = self.products(product_ids)
+
+        # id з продукту — до збору id, щоб вони потрапили в той самий пакет
+        for kind in from_product:
+            id_key = LABEL_KINDS[kind][1]
+            for r in rows:
+                if _int(r.get(id_key)) is None:
+                    product = products.get(_int(r.get("product_id")))
+                    pid_val = getattr(product, id_key, None) if product is not None else None
+                    if pid_val is not None:
+                        r[id_key] = pid_val
+
+        maps = {
+            kind: self.labels(kind, (r.get(LABEL_KINDS[kind][1]) for r in rows))
+            for kind in kinds
+        }
+        packages = self.package_labels(product_ids) if package_key else {}
+
+        for r in rows:
+            for kind in kinds:
+                _, id_key, name_key = LABEL_KINDS[kind]
+                key = keys.get(kind, name_key)
+                if r.get(key):
+                    continue
+                val = maps[kind].get(_int(r.get(id_key)))
+                if val is None and kind == "manufacturer":
+                    val = self._product_manufacturer_text(products.get(_int(r.get("product_id"))))
+                if val is not None:
+                    r[key] = val
+                elif default is not None:
+                    r[key] = default
+            if package_key and not r.get(package_key):
+                val = packages.get(_int(r.get("product_id")))
+                if val is not None:
+                    r[package_key] = val
+                elif default is not None:
+                    r[package_key] = default
+        return rows
+
+
+def label_resolver() -> LabelResolver:
+    """Резолвер поточного запиту (поза запитом — новий)."""
+    if not has_request_context():
+        return LabelResolver()
+    resolver = g.get("label_resolver")
+    if resolver is None:
+        resolver = g.label_resolver = LabelResolver()
+    return resolver
+
+
+def resolve_labels(rows: List[dict], **kwargs) -> List[dict]:
+    """label_resolver().resolve(rows, ...) — див. LabelResolver.resolve."""
+    return label_resolver().resolve(rows, **kwargs)
@@ -5,6 +5,8 @@ from wtforms import StringField, SubmitField
 from wtforms.validators import DataRequired
 from wtforms_sqlalchemy.fields import QuerySelectField
 
+from modules.reference.select_fields import CachedSelectField
+
 from modules.reference.categories.models import Category
 from modules.reference.units.models import Unit
 from modules.reference.groups.models import Group
@@ -42,22 +44,22 @@ class ProductForm(FlaskForm):
 
     submit = SubmitField('Зберегти')
 class ProductFilterForm(FlaskForm):
-    category = QuerySelectField(
+    category = CachedSelectField(
         'Категорія',
-        query_factory=lambda: Category.query.all(),
-        get_label='name',
+        model=Category,
+        order_by=None,
         allow_blank=True
     )
-    group = QuerySelectField(
+    group = CachedSelectField(
         'Група',
-        query_factory=lambda: Group.query.all(),
-        get_label='name',
+        model=Group,
+        order_by=None,
         allow_blank=True
     )
-    manufacturer = QuerySelectField(
+    manufacturer = CachedSelectField(
         'Виробник',
-        query_factory=lambda: Manufacturer.query.all(),
-        get_label='name',
+        model=Manufacturer,
+        order_by=None,
         allow_blank=True
     )
     submit = SubmitField('Фільтрувати')
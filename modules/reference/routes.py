@@ -1,7 +1,22 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, jsonify, render_template
+
+from cache_bus import invalidation_bus
+from modules.purchases.payer_allocation.result_cache import consolidation_cache
+from modules.reference.cache import reference_cache
+from singleflight import single_flight_group
 
 bp = Blueprint('reference', __name__, template_folder='templates')
 
 @bp.route('/reference')
 def index():
     return render_template('reference/index.html')
+
+@bp.route('/reference/cache-stats')
+def cache_stats():
+    """Метрики кешу довідників, мемо консолідації, single-flight цього процесу і шини інвалідації."""
+    return jsonify({
+        "tables": reference_cache.stats(),
+        "consolidation": consolidation_cache.stats(),
+        "single_flight": single_flight_group.stats(),
+        "bus": invalidation_bus.stats(),
+    })
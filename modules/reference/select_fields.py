@@ -0,0 +1,87 @@
+# modules/reference/select_fields.py
+# -*- coding: utf-8 -*-
+"""
+CachedSelectField — заміна wtforms_sqlalchemy.QuerySelectField для довідників.
+
+QuerySelectField на кожному створенні форми виконує повний запит з ORDER BY і шукає
+надіслане значення лінійним переглядом списку ORM-сутностей. Тут варіанти беруться
+з кешу довідників (reference_cache.choices — готовий список (id, підпис) на версію
+таблиці), а надісланий id перетворюється на RefRow одним словниковим пошуком.
+
+form.<поле>.data — RefRow (має .id, .name та інші колонки) або None, тож код на кшталт
+`form.company.data.id if form.company.data else None` працює без змін. Присвоїти можна
+RefRow, ORM-об'єкт або id — вибраний пункт визначається за id.
+
+Для форм, що присвоюють .data у relationship (company.cluster = form.cluster.data),
+лишаємо QuerySelectField: RefRow не є ORM-сутністю.
+"""
+
+from __future__ import annotations
+
+from wtforms import widgets
+from wtforms.fields import SelectFieldBase
+from wtforms.validators import ValidationError
+
+from modules.reference.cache import reference_cache
+
+
+def _id_of(value):
+    if value is None:
+        return None
+    return getattr(value, "id", value)
+
+
+class CachedSelectField(SelectFieldBase):
+    widget = widgets.Select()
+
+    def __init__(self, label=None, validators=None, model=None, get_label="name", order_by="name",
+                 allow_blank=False, blank_text="", blank_value="__None", **kwargs):
+        super().__init__(label, validators, **kwargs)
+        if model is None:
+            raise TypeError("CachedSelectField: потрібен model=")
+        self.model = model
+        self.label_attr = get_label
+        self.order_by = order_by
+        self.allow_blank = allow_blank
+        self.blank_text = blank_text
+        self.blank_value = blank_value
+        self._formdata = None
+        self._invalid = False
+
+    # ----------------------------- data -----------------------------
+
+    def _get_data(self):
+        if self._formdata is not None:
+            row = reference_cache.get(self.model, self._formdata)
+            self._invalid = row is None
+            self._set_data(row)
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self._formdata = None
+
+    data = property(_get_data, _set_data)
+
+    def process_formdata(self, valuelist):
+        if valuelist:
+            self._invalid = False
+            if self.allow_blank and valuelist[0] in (self.blank_value, ""):
+                self.data = None
+            else:
+                self._data = None
+                self._formdata = valuelist[0]
+
+    # ----------------------------- рендеринг -----------------------------
+
+    def iter_choices(self):
+        selected = _id_of(self.data)
+        if self.allow_blank:
+            yield (self.blank_value, self.blank_text, selected is None, {})
+        for row_id, label in reference_cache.choices(self.model, label=self.label_attr, order_by=self.order_by):
+            yield (str(row_id), label, row_id == selected, {})
+
+    def pre_validate(self, form):
+        data = self.data
+        if self._invalid or (data is None and not self.allow_blank):
+            raise ValidationError(self.gettext("Not a valid choice"))
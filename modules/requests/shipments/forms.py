@@ -1,27 +1,20 @@
 # modules/requests/shipments/forms.py
 from flask_wtf import FlaskForm
 from wtforms import SubmitField
-from wtforms_sqlalchemy.fields import QuerySelectField
+from modules.reference.select_fields import CachedSelectField
 from modules.reference.companies.models import Company
 from modules.reference.products.models import Product
-from extensions import db
-
-def companies_query():
-    return db.session.query(Company).order_by(Company.name.asc())
-
-def products_query():
-    return db.session.query(Product).order_by(Product.name.asc())
 
 class FilterForm(FlaskForm):
-    company = QuerySelectField(
+    company = CachedSelectField(
         "Підприємство (споживач)",
-        query_factory=companies_query,
+        model=Company,
         allow_blank=True,
         get_label="name"
     )
-    product = QuerySelectField(
+    product = CachedSelectField(
         "Продукт",
-        query_factory=products_query,
+        model=Product,
         allow_blank=True,
         get_label="name"
     )
@@ -20,6 +20,8 @@ class ShipmentRequest(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     created_by = db.Column(db.String(64), nullable=True)
     comment = db.Column(db.String(255), nullable=True)
+    # склад-джерело; обирається при поданні (None — старі заявки, до першого виконання)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=True)
 
     items = relationship(
         "ShipmentRequestItem",
@@ -28,6 +30,11 @@ class ShipmentRequest(db.Model):
         lazy="selectin",
     )
 
+    __table_args__ = (
+        # keyset-пагінація черг складу (status = ... ORDER BY created_at, id)
+        db.Index("ix_shipment_requests_status_created", "status", "created_at", "id"),
+    )
+
     def __repr__(self):
         return f"<ShipmentRequest {self.number} status={self.status}>"
 
@@ -63,3 +70,33 @@ class ShipmentRequestItem(db.Model):
     payer = relationship(Payer, foreign_keys=[payer_id], lazy="joined")
     manufacturer = relationship(Manufacturer, foreign_keys=[manufacturer_id], lazy="joined")
 
+    @property
+    def warehouse_id(self):
+        """Склад позиції = склад заявки (фіксується при поданні; None — старі заявки без складу)."""
+        return self.request.warehouse_id if self.request is not None else None
+
+
+
+class StockReservation(db.Model):
+    """
+    Зарезервовано відкритими заявками (draft/submitted/approved) по ключу залишку
+    (склад, компанія, продукт, платник, одиниця, виробник, тара) — як stock_balances.
+    Ведеться інкрементально (reservations.py): + при створенні позицій, − при виконанні,
+    видаленні та скасуванні заявки. warehouse_id = NULL — резерви старих заявок без складу.
+    """
+    __tablename__ = "stock_reservations"
+
+    id = db.Column(db.Integer, primary_key=True)
+    reserve_key = db.Column(db.String(191), nullable=False, unique=True)  # "|".join(ключ), "" для NULL
+
+    warehouse_id        = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=True)
+
+    consumer_company_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=True)
+    product_id          = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    payer_id            = db.Column(db.Integer, db.ForeignKey("payers.id"), nullable=True)
+    unit_id             = db.Column(db.Integer, db.ForeignKey("units.id"), nullable=True)
+    manufacturer_id     = db.Column(db.Integer, db.ForeignKey("manufacturers.id"), nullable=True)
+    package_value       = db.Column(db.Float, nullable=True)
+
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,291 @@
+# modules/requests/shipments/reservations.py
+# -*- coding: utf-8 -*-
+"""
+Резерви під заявки на відвантаження (stock_reservations).
+
+Резерв ведеться інкрементально по ключу залишку — як у stock_balances, разом зі складом
+(склад, компанія, продукт, платник, одиниця, виробник, тара): + qty_requested при створенні
+позицій, − виконана кількість при виконанні, − невиконаний залишок при видаленні чи
+скасуванні заявки. Склад заявки обирається при поданні, тож «скільки ще можна заявити» —
+залишок саме цього складу мінус його резерви; виконання списує з того самого складу.
+Перевірка читає лише ключі поточної заявки.
+
+Старі заявки, подані ще без складу, тримають резерв під ключем зі складом NULL. Такий резерв
+враховується проти кожного складу (консервативно) і переноситься на склад, коли заявку
+вперше виконують (move_to_warehouse).
+
+submit_new блокує ключі, які перевіряє (lock_reservations): PostgreSQL — SELECT ... FOR UPDATE,
+SQLite — BEGIN IMMEDIATE (один писач на БД). Дві одночасні заявки на той самий
+залишок проходять перевірку по черзі, тож перепродажу не буде.
+
+Перебудова / перевірка з позицій відкритих заявок — scripts/stock_reservations.py.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from extensions import db, dialect_insert
+from modules.warehouse.models import StockBalance
+from modules.warehouse.services import BALANCE_KEY_COLS, available_quantities
+from .models import ShipmentRequest, ShipmentRequestItem, StockReservation
+
+# Які статуси вважаємо «зайняли склад»
+RESERVE_STATUSES = ("draft", "submitted", "approved")
+
+# Резервувати з урахуванням платника (True) або спільно для всіх платників (False)
+RESERVE_BY_PAYER = True
+
+RESERVE_KEY_COLS = BALANCE_KEY_COLS
+ReserveKey = Tuple[Optional[int], Optional[int], int, Optional[int], Optional[int], Optional[int], Optional[float]]
+
+
+# ----------------------------- ключ -----------------------------
+
+def make_reserve_key(
+    warehouse_id, company_id, product_id, payer_id, unit_id, manufacturer_id, package_value,
+) -> ReserveKey:
+    """Нормалізований ключ резерву: id → int, тара → float, порожнє → None."""
+    def _int(v):
+        return None if v is None or v == "" else int(v)
+
+    return (
+        _int(warehouse_id),
+        _int(company_id),
+        _int(product_id),
+        _int(payer_id) if RESERVE_BY_PAYER else None,
+        _int(unit_id),
+        _int(manufacturer_id),
+        None if package_value is None or package_value == "" else float(package_value),
+    )
+
+
+def reserve_key_of(obj) -> ReserveKey:
+    """Ключ резерву з ShipmentRequestItem (склад — із заявки) / рядка stock_balances."""
+    return make_reserve_key(*(getattr(obj, c, None) for c in RESERVE_KEY_COLS))
+
+
+def unplaced_key(key: ReserveKey) -> ReserveKey:
+    """Той самий ключ без складу — резерви старих заявок, поданих до вибору складу."""
+    return (None,) + tuple(key[1:])
+
+
+def _key_str(key: ReserveKey) -> str:
+    return "|".join("" if v is None else str(v) for v in key)
+
+
+# ----------------------------- читання -----------------------------
+
+def _rows_for(keys, *, for_update: bool = False):
+    t = StockReservation.__table__
+    q = select(t).where(t.c.reserve_key.in_(sorted({_key_str(k) for k in keys}))).order_by(t.c.reserve_key)
+    if for_update:
+        q = q.with_for_update()
+    return db.session.execute(q)
+
+
+def reserved_for_keys(keys: Iterable[ReserveKey]) -> Dict[ReserveKey, float]:
+    """{ключ: зарезервовано} без блокування (для попереднього перегляду)."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    return {reserve_key_of(r): float(r.qty or 0.0) for r in _rows_for(keys)}
+
+
+def unplaced_reserved(keys: Iterable[ReserveKey]) -> Dict[ReserveKey, float]:
+    """
+    {ключ: резерв старих заявок без складу на той самий товар}. Без блокування: нових
+    резервів без складу не виникає, тож ця сума може лише зменшитись.
+    """
+    keys = [k for k in keys if k[0] is not None]
+    stored = reserved_for_keys({unplaced_key(k) for k in keys})
+    return {k: stored.get(unplaced_key(k), 0.0) for k in keys}
+
+
+def available_for_keys(keys: Iterable[ReserveKey]) -> Dict[ReserveKey, float]:
+    """{ключ: залишок на складі ключа} — batched запит до stock_balances на кожен склад."""
+    keys = set(keys)
+    if not keys:
+        return {}
+    if RESERVE_BY_PAYER:
+        # ключ резерву = (склад,) + ключ доступності
+        by_warehouse: Dict[Optional[int], set] = {}
+        for k in keys:
+            by_warehouse.setdefault(k[0], set()).add(k[1:])
+        out: Dict[ReserveKey, float] = {}
+        for wid, akeys in by_warehouse.items():
+            if wid is None:  # без складу нічого не доступно
+                out.update({(None,) + ak: 0.0 for ak in akeys})
+                continue
+            out.update({(wid,) + ak: qty for ak, qty in available_quantities(akeys, warehouse_id=wid).items()})
+        return out
+
+    # резерв без платника — залишки всіх платників ключа сумуються
+    sb = StockBalance
+    key_cols = [getattr(sb, c) for c in RESERVE_KEY_COLS]
+    q = (
+        db.session.query(*key_cols, func.coalesce(func.sum(sb.qty), 0.0).label("qty"))
+        .filter(sb.product_id.in_({k[2] for k in keys}))
+        .group_by(*key_cols)
+    )
+    out: Dict[ReserveKey, float] = {k: 0.0 for k in keys}
+    for r in q:
+        key = reserve_key_of(r)
+        if key in keys:
+            out[key] += float(r.qty)
+    return out
+
+
+# ----------------------------- блокування -----------------------------
+
+def _begin_immediate(conn) -> None:
+    """SQLite: взяти блокування запису на початку транзакції (якщо транзакцію ще не розпочато)."""
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _ensure_rows(conn, keys: List[ReserveKey]) -> None:
+    """Нульові рядки для нових ключів — щоб їх можна було заблокувати."""
+    t = StockReservation.__table__
+    now = datetime.utcnow()
+    rows = [
+        {"reserve_key": _key_str(k), "qty": 0.0, "updated_at": now, **dict(zip(RESERVE_KEY_COLS, k))}
+        for k in sorted(set(keys), key=_key_str)
+    ]
+    insert = dialect_insert(conn)
+    if insert is not None:
+        conn.execute(insert(t).on_conflict_do_nothing(index_elements=[t.c.reserve_key]), rows)
+        return
+    existing = {r.reserve_key for r in _rows_for(keys)}
+    missing = [r for r in rows if r["reserve_key"] not in existing]
+    if missing:
+        conn.execute(t.insert(), missing)
+
+
+def lock_reservations(keys: Iterable[ReserveKey]) -> Dict[ReserveKey, float]:
+    """
+    Блокує ключі до кінця транзакції і повертає {ключ: зарезервовано}.
+    Викликати до перших змін у транзакції (на SQLite — до будь-якого INSERT/UPDATE).
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    conn = db.session.connection()
+    if conn.dialect.name == "sqlite":
+        _begin_immediate(conn)
+    _ensure_rows(conn, keys)
+    return {reserve_key_of(r): float(r.qty or 0.0) for r in _rows_for(keys, for_update=True)}
+
+
+# ----------------------------- зміни -----------------------------
+
+def apply_reservation_deltas(deltas: Dict[ReserveKey, float]) -> None:
+    """qty = qty + дельта по кожному ключу (upsert) у поточній транзакції."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    t = StockReservation.__table__
+    now = datetime.utcnow()
+    rows = [
+        {"reserve_key": _key_str(k), "qty": float(v), "updated_at": now, **dict(zip(RESERVE_KEY_COLS, k))}
+        for k, v in sorted(deltas.items(), key=lambda kv: _key_str(kv[0]))
+    ]
+    insert = dialect_insert()
+    if insert is not None:
+        stmt = insert(t)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.reserve_key],
+            set_={"qty": t.c.qty + stmt.excluded.qty, "updated_at": stmt.excluded.updated_at},
+        )
+        db.session.execute(stmt, rows)
+        return
+    for row in rows:
+        res = db.session.execute(
+            update(t).where(t.c.reserve_key == row["reserve_key"])
+            .values(qty=t.c.qty + row["qty"], updated_at=now)
+        )
+        if not res.rowcount:
+            db.session.execute(t.insert(), row)
+
+
+def _remaining(it: ShipmentRequestItem) -> float:
+    return max(0.0, float(it.qty_requested or 0.0) - float(it.qty_executed or 0.0))
+
+
+def reserve_items(items: Iterable[ShipmentRequestItem]) -> None:
+    """+ невиконаний залишок нових позицій."""
+    deltas: Dict[ReserveKey, float] = {}
+    for it in items:
+        key = reserve_key_of(it)
+        deltas[key] = deltas.get(key, 0.0) + _remaining(it)
+    apply_reservation_deltas(deltas)
+
+
+def release_items(items: Iterable[ShipmentRequestItem]) -> None:
+    """− невиконаний залишок позицій (видалення / скасування відкритої заявки)."""
+    deltas: Dict[ReserveKey, float] = {}
+    for it in items:
+        key = reserve_key_of(it)
+        deltas[key] = deltas.get(key, 0.0) - _remaining(it)
+    apply_reservation_deltas(deltas)
+
+
+def move_to_warehouse(items: Iterable[ShipmentRequestItem], warehouse_id: int) -> None:
+    """
+    Стара заявка без складу вперше прив'язується до складу: невиконаний залишок позицій
+    переноситься з резерву «без складу» на цей склад. Викликати до зміни warehouse_id заявки.
+    """
+    deltas: Dict[ReserveKey, float] = {}
+    for it in items:
+        old = unplaced_key(reserve_key_of(it))
+        new = (int(warehouse_id),) + old[1:]
+        qty = _remaining(it)
+        deltas[old] = deltas.get(old, 0.0) - qty
+        deltas[new] = deltas.get(new, 0.0) + qty
+    apply_reservation_deltas(deltas)
+
+
+# ----------------------------- перебудова / перевірка -----------------------------
+
+def _reservations_from_items() -> Dict[ReserveKey, float]:
+    it = ShipmentRequestItem
+    # склад позиції — із заявки
+    key_cols = [ShipmentRequest.warehouse_id.label("warehouse_id")] + [
+        getattr(it, c) for c in RESERVE_KEY_COLS if c != "warehouse_id"
+    ]
+    remaining = func.sum(it.qty_requested - func.coalesce(it.qty_executed, 0.0))
+    q = (
+        db.session.query(*key_cols, remaining.label("qty"))
+        .join(ShipmentRequest, ShipmentRequest.id == it.request_id)
+        .filter(ShipmentRequest.status.in_(RESERVE_STATUSES))
+        .group_by(*key_cols)
+    )
+    out: Dict[ReserveKey, float] = {}
+    for r in q:
+        key = reserve_key_of(r)
+        out[key] = out.get(key, 0.0) + max(0.0, float(r.qty or 0.0))
+    return out
+
+
+def rebuild_reservations() -> int:
+    """Перебудовує stock_reservations з позицій відкритих заявок. Commit всередині."""
+    db.session.execute(StockReservation.__table__.delete())
+    expected = _reservations_from_items()
+    apply_reservation_deltas(expected)
+    db.session.commit()
+    return len(expected)
+
+
+def check_reservations(eps: float = 1e-6) -> List[dict]:
+    """Розбіжності stock_reservations з позиціями відкритих заявок (порожній список — узгоджено)."""
+    expected = _reservations_from_items()
+    stored = {reserve_key_of(r): float(r.qty or 0.0) for r in StockReservation.query}
+    out = []
+    for key in sorted(set(expected) | set(stored), key=_key_str):
+        a, b = expected.get(key, 0.0), stored.get(key, 0.0)
+        if abs(a - b) > eps:
+            out.append({"key": dict(zip(RESERVE_KEY_COLS, key)), "expected": a, "stored": b})
+    return out
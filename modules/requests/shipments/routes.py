@@ -7,7 +7,12 @@ from . import shipments_requests_bp
 from .forms import FilterForm
 from .services import get_stock_balances
 from .models import ShipmentRequest, ShipmentRequestItem
+from .reservations import (
+    available_for_keys, lock_reservations, make_reserve_key, reserve_items, reserved_for_keys,
+    unplaced_reserved,
+)
 from extensions import db
+from modules.warehouse.services import resolve_warehouse_id, warehouse_choices
 
 # Довідники для фолбеків
 from modules.reference.products.models import Product
@@ -15,21 +20,15 @@ from modules.reference.units.models import Unit
 from modules.reference.companies.models import Company
 from modules.reference.payers.models import Payer
 from modules.reference.manufacturers.models import Manufacturer
-
-# 🔧 для агрегацій
-from sqlalchemy import func
-from collections import defaultdict
+from modules.reference.cache import reference_cache
+from modules.reference.labels import resolve_labels
 
 # -------------------- бізнес-налаштування --------------------
 # Округлення до кратності тари під час preview (та, за потреби, на submit):
 # "ceil" | "floor" | "nearest" | "error" (error = не коригуємо, вимагаємо вручну)
 ROUND_TO_PACKAGE_MODE = "ceil"
 
-# Які статуси вважаємо «зайняли склад» при розрахунку вже зарезервованих обсягів
-RESERVE_STATUSES = ("draft", "submitted", "approved")
-
-# Резервувати покомпанійно+продукт+платник (True) або без урахування платника (False)
-RESERVE_BY_PAYER = True
+# Статуси, що резервують залишок, і ключ резерву — у reservations.py
 # -------------------------------------------------------------
 
 # -------------------- helpers --------------------
@@ -110,34 +109,30 @@ def _is_multiple(qty: float, pack: float, eps: float = 1e-9) -> bool:
     return math.isclose(frac, 0.0, abs_tol=eps)
 
 
-def _row_key(company_id, product_id, payer_id):
-    if RESERVE_BY_PAYER:
-        return (company_id or 0, product_id or 0, payer_id or 0)
-    return (company_id or 0, product_id or 0, 0)
+def _reserve_key(r: dict, warehouse_id: int):
+    """Ключ резерву для рядка форми/payload на складі заявки (None — немає продукту)."""
+    if _as_int(r.get("product_id")) is None:
+        return None
+    return make_reserve_key(
+        warehouse_id,
+        _as_int(r.get("company_id")), _as_int(r.get("product_id")), _as_int(r.get("payer_id")),
+        _as_int(r.get("unit_id")), _as_int(r.get("manufacturer_id")), _as_float(r.get("package_value"), default=None),
+    )
 
 
-def _build_reserved_map():
-    """
-    Резерви за вже створеними заявками (draft/submitted/approved), сумарно по ключу.
-    """
-    q = (
-        db.session.query(
-            ShipmentRequestItem.consumer_company_id.label("company_id"),
-            ShipmentRequestItem.product_id.label("product_id"),
-            ShipmentRequestItem.payer_id.label("payer_id"),
-            func.sum(ShipmentRequestItem.qty_requested).label("qty")
-        )
-        .join(ShipmentRequest, ShipmentRequestItem.request_id == ShipmentRequest.id)
-        .filter(ShipmentRequest.status.in_(RESERVE_STATUSES))
-        .group_by(ShipmentRequestItem.consumer_company_id,
-                  ShipmentRequestItem.product_id,
-                  ShipmentRequestItem.payer_id)
-    )
-    reserved = defaultdict(float)
-    for row in q:
-        key = _row_key(row.company_id, row.product_id, row.payer_id)
-        reserved[key] += float(row.qty or 0.0)
-    return reserved
+def _picked_warehouse_id():
+    """Склад заявки з форми: лише активний склад, інакше None."""
+    wid = _as_int(request.form.get("warehouse_id"))
+    if wid is None or resolve_warehouse_id(wid) != wid:
+        return None
+    return wid
+
+
+def _reserved_with_unplaced(reserved_map: dict, keys) -> dict:
+    """+ резерв старих заявок без складу: доки їх не виконали, він займає будь-який склад."""
+    for key, qty in unplaced_reserved(keys).items():
+        reserved_map[key] = reserved_map.get(key, 0.0) + qty
+    return reserved_map
 # -------------------------------------------------
 
 
@@ -159,8 +154,14 @@ def index():
         company_id = _as_int(request.args.get("company_id") or None)
         product_id = _as_int(request.args.get("product_id") or None)
 
+    # заявка подається на один склад — залишки показуємо саме по ньому
+    warehouse_id = resolve_warehouse_id(request.values.get("warehouse_id"), company_id=company_id)
+
     # balances: якщо фільтри порожні — вертаємо ВСІ в наявності
-    balances = get_stock_balances(company_id=company_id, product_id=product_id) or []
+    balances = (
+        get_stock_balances(company_id=company_id, product_id=product_id, warehouse_id=warehouse_id)
+        if warehouse_id is not None else []
+    )
 
     # Уніфікація ключів + поповнення одиниць/тари
     for r in balances:
@@ -185,41 +186,13 @@ def index():
         if r.get("qty_available") is None:
             r["qty_available"] = r.get("qty") or r.get("quantity") or r.get("stock") or 0
 
-    # Потрібно підтягнути одиниці з продукту?
-    prod_ids_need_unit = {
-        _as_int(r["product_id"])
-        for r in balances
-        if (not (r.get("unit_id") or r.get("unit_text"))) and r.get("product_id")
-    }
-    prod_ids_need_unit = {pid for pid in prod_ids_need_unit if pid is not None}
-
-    prod_to_unit = {}
-    unit_id_to_name = {}
-    if prod_ids_need_unit:
-        prods = Product.query.filter(Product.id.in_(prod_ids_need_unit)).all()
-        for p in prods:
-            uid = getattr(p, "unit_id", None)
-            if not uid and getattr(p, "unit", None) and getattr(p.unit, "id", None):
-                uid = p.unit.id
-            if uid:
-                prod_to_unit[p.id] = uid
-
-        unit_ids = set(prod_to_unit.values())
-        if unit_ids:
-            units = Unit.query.filter(Unit.id.in_(unit_ids)).all()
-            unit_id_to_name = {u.id: (u.name or u.short_name or "") for u in units}
+    # Рядкам без одиниці — unit_id і назва з продукту (кеш довідників, один прохід)
+    resolve_labels(
+        [r for r in balances if not (r.get("unit_id") or r.get("unit_text"))],
+        kinds=("unit",), keys={"unit": "unit_text"}, from_product=("unit",),
+    )
 
     for r in balances:
-        if not (r.get("unit_text") or ""):
-            uid = _as_int(r.get("unit_id"))
-            if uid is None:
-                pid = _as_int(r.get("product_id"))
-                if pid in prod_to_unit:
-                    uid = prod_to_unit[pid]
-                    r["unit_id"] = uid
-            if uid and uid in unit_id_to_name:
-                r["unit_text"] = unit_id_to_name[uid] or r.get("unit_text") or ""
-
         if not (r.get("package_text") or ""):
             try:
                 pv = float(r.get("package_value")) if r.get("package_value") not in (None, "") else None
@@ -230,9 +203,9 @@ def index():
 
     # Пробуємо проставити значення у форму (щоб після POST лишилися вибрані)
     if company_id:
-        form.company.data = Company.query.get(company_id)
+        form.company.data = reference_cache.get(Company, company_id)
     if product_id:
-        form.product.data = Product.query.get(product_id)
+        form.product.data = reference_cache.get(Product, product_id)
 
     return render_template(
         "shipments/index.html",
@@ -240,6 +213,8 @@ def index():
         balances=balances,
         company_id=company_id,
         product_id=product_id,
+        warehouse_id=warehouse_id,
+        warehouse_options=warehouse_choices(),
     )
 
 
@@ -254,6 +229,11 @@ def preview_new():
         flash("Не обрано жодної позиції.", "warning")
         return redirect(url_for("shipments_requests.index"))
 
+    warehouse_id = _picked_warehouse_id()
+    if warehouse_id is None:
+        flash("Оберіть склад, з якого відвантажувати.", "warning")
+        return redirect(url_for("shipments_requests.index"))
+
     rows = []
     for idx_str in picked:
         idx = _as_int(idx_str)
@@ -280,50 +260,27 @@ def preview_new():
         }
         rows.append(row)
 
-    # Добудова snapshot-імен із БД за id
-    unit_ids  = { _as_int(r.get("unit_id")) for r in rows if _as_int(r.get("unit_id")) is not None }
-    prod_ids  = { _as_int(r.get("product_id")) for r in rows if _as_int(r.get("product_id")) is not None }
-    comp_ids  = { _as_int(r.get("company_id")) for r in rows if _as_int(r.get("company_id")) is not None }
-    payr_ids  = { _as_int(r.get("payer_id")) for r in rows if _as_int(r.get("payer_id")) is not None }
-    manuf_ids = { _as_int(r.get("manufacturer_id")) for r in rows if _as_int(r.get("manufacturer_id")) is not None }
-
-    units_map = {u.id: (u.name or u.short_name or "") for u in Unit.query.filter(Unit.id.in_(unit_ids)).all()} if unit_ids else {}
-    prods_map = {p.id: (p.name or "") for p in Product.query.filter(Product.id.in_(prod_ids)).all()} if prod_ids else {}
-    comps_map = {c.id: (c.name or "") for c in Company.query.filter(Company.id.in_(comp_ids)).all()} if comp_ids else {}
-    pays_map  = {p.id: (p.name or "") for p in Payer.query.filter(Payer.id.in_(payr_ids)).all()} if payr_ids else {}
-    mans_map  = {m.id: (m.name or "") for m in Manufacturer.query.filter(Manufacturer.id.in_(manuf_ids)).all()} if manuf_ids else {}
+    # Добудова snapshot-імен за id (кеш довідників; надіслані з форми назви не перезаписуються)
+    resolve_labels(rows, keys={"unit": "unit_text"})
 
     for r in rows:
-        if not r["unit_text"]:
-            uid = _as_int(r.get("unit_id"))
-            if uid in units_map: r["unit_text"] = units_map[uid]
-        if not r["product_name"]:
-            pid = _as_int(r.get("product_id"))
-            if pid in prods_map: r["product_name"] = prods_map[pid]
-        if not r["company_name"]:
-            cid = _as_int(r.get("company_id"))
-            if cid in comps_map: r["company_name"] = comps_map[cid]
-        if not r["payer_name"]:
-            pid = _as_int(r.get("payer_id"))
-            if pid in pays_map: r["payer_name"] = pays_map[pid]
-        if not r["manufacturer_name"]:
-            mid = _as_int(r.get("manufacturer_id"))
-            if mid in mans_map: r["manufacturer_name"] = mans_map[mid]
-
         if not r["package_text"]:
             pv = _as_float(r.get("package_value"), default=None)
             if pv and r["unit_text"]:
                 r["package_text"] = f"{pv:g} {r['unit_text']}"
 
-    # Резерви з БД
-    reserved_map = _build_reserved_map()
+    # Резерви й залишки з БД — лише по ключах обраних рядків
+    row_keys = [_reserve_key(r, warehouse_id) for r in rows]
+    wanted = {k for k in row_keys if k is not None}
+    reserved_map = _reserved_with_unplaced(reserved_for_keys(wanted), wanted)
+    available_map = available_for_keys(wanted)
 
     adjusted = []
     warnings = []
 
-    for r in rows:
-        # уніфікація типів
-        qty_av = _as_float(r.get("qty_available"), default=0.0) or 0.0
+    for r, rkey in zip(rows, row_keys):
+        # уніфікація типів; доступність — із stock_balances, а не з форми
+        qty_av = available_map.get(rkey, 0.0)
         qty_req = _as_float(r.get("qty_requested"), default=0.0) or 0.0
         pack    = _as_float(r.get("package_value"), default=0.0) or 0.0
 
@@ -332,7 +289,7 @@ def preview_new():
         payer_id_i   = _as_int(r.get("payer_id"))
 
         # ключ для резервів
-        already_reserved = reserved_map.get(_row_key(company_id_i, product_id_i, payer_id_i), 0.0)
+        already_reserved = reserved_map.get(rkey, 0.0)
         allow = max(0.0, qty_av - already_reserved)
 
         original_qty = qty_req
@@ -398,7 +355,10 @@ def preview_new():
 
     payload = Markup(json.dumps(valid, ensure_ascii=False))
     # Можеш тимчасово передати перший рядок у шаблон для наочного дебагу:
-    return render_template("shipments/preview_new.html", rows=valid, payload=payload, debug_row=(valid[0] if valid else None))
+    return render_template(
+        "shipments/preview_new.html", rows=valid, payload=payload, debug_row=(valid[0] if valid else None),
+        warehouse_id=warehouse_id, warehouse_name=dict(warehouse_choices()).get(warehouse_id, ""),
+    )
 
 
 
@@ -414,27 +374,18 @@ def submit_new():
         flash("Немає даних для створення заявки.", "warning")
         return redirect(url_for("shipments_requests.index"))
 
-    # Кеш name→id для фолбеків
-    products_by_name       = {name: pid for name, pid in db.session.query(Product.name, Product.id).all()}
-    units_by_name          = {name: uid for name, uid in db.session.query(Unit.name, Unit.id).all()}
-    companies_by_name      = {name: cid for name, cid in db.session.query(Company.name, Company.id).all()}
-    payers_by_name         = {name: pid for name, pid in db.session.query(Payer.name, Payer.id).all()}
-    manufacturers_by_name  = {name: mid for name, mid in db.session.query(Manufacturer.name, Manufacturer.id).all()}
-
-    # 1) створюємо заявку
-    req = ShipmentRequest(number="PENDING", status="draft")
-    db.session.add(req)
-    db.session.flush()
-    req.number = f"SR-{datetime.utcnow().year}-{req.id:04d}"
-    db.session.flush()
+    # склад фіксується при поданні: перевірка й резерв — по залишку саме цього складу
+    warehouse_id = _picked_warehouse_id()
+    if warehouse_id is None:
+        flash("Склад заявки не обрано або він неактивний.", "warning")
+        return redirect(url_for("shipments_requests.index"))
 
-    # Карта вже зарезервованих обсягів + локальне накопичення під час створення
-        # --- NEW: name -> id backfill, щоб ключі резервів збігались ---
-    products_by_name       = {name: pid for name, pid in db.session.query(Product.name, Product.id).all()}
-    units_by_name          = {name: uid for name, uid in db.session.query(Unit.name, Unit.id).all()}
-    companies_by_name      = {name: cid for name, cid in db.session.query(Company.name, Company.id).all()}
-    payers_by_name         = {name: pid for name, pid in db.session.query(Payer.name, Payer.id).all()}
-    manufacturers_by_name  = {name: mid for name, mid in db.session.query(Manufacturer.name, Manufacturer.id).all()}
+    # name → id для фолбеків (кеш довідників), щоб ключі резервів збігались
+    products_by_name       = reference_cache.name_map(Product)
+    units_by_name          = reference_cache.name_map(Unit)
+    companies_by_name      = reference_cache.name_map(Company)
+    payers_by_name         = reference_cache.name_map(Payer)
+    manufacturers_by_name  = reference_cache.name_map(Manufacturer)
 
     for r in rows:
         # якщо id порожній, але є назва — підставляємо id з довідника
@@ -453,12 +404,24 @@ def submit_new():
         if _as_int(r.get("manufacturer_id")) is None and (r.get("manufacturer_name") or "").strip():
             mid = manufacturers_by_name.get(r["manufacturer_name"])
             if mid: r["manufacturer_id"] = mid
-    # --- END NEW ---
-    reserved_map = _build_reserved_map()
+
+    # Резерви по ключах цієї заявки блокуються до commit/rollback — паралельний submit
+    # на ті самі ключі чекає, тож обидва не пройдуть перевірку allow одночасно
+    # (до будь-якого INSERT: на SQLite це BEGIN IMMEDIATE)
+    keys = {k for k in (_reserve_key(r, warehouse_id) for r in rows) if k is not None}
+    reserved_map = _reserved_with_unplaced(lock_reservations(keys), keys)
+    available_map = available_for_keys(keys)
     errors = []
 
+    # 1) створюємо заявку
+    req = ShipmentRequest(number="PENDING", status="draft", warehouse_id=warehouse_id)
+    db.session.add(req)
+    db.session.flush()
+    req.number = f"SR-{datetime.utcnow().year}-{req.id:04d}"
+    db.session.flush()
+
     # 2) додаємо позиції
-    added = 0
+    created = []
     for r in rows:
         company_id_i = _as_int(r.get("company_id"))
         product_id_i = _as_int(r.get("product_id"))
@@ -484,8 +447,8 @@ def submit_new():
             continue
 
         # ---- контроль дублювання / перевищення дозволеного ----
-        qty_av = _as_float(r.get("qty_available"), default=0.0) or 0.0
-        key = _row_key(company_id_i, product_id_i, payer_id_i)
+        key = make_reserve_key(warehouse_id, company_id_i, product_id_i, payer_id_i, unit_id_i, manuf_id_i, pack_f)
+        qty_av = available_map.get(key, 0.0)
         already_reserved = reserved_map.get(key, 0.0)
         allow = max(0.0, qty_av - already_reserved)
 
@@ -512,7 +475,7 @@ def submit_new():
         reserved_map[key] = reserved_map.get(key, 0.0) + qty_req
 
         item = ShipmentRequestItem(
-            request_id=req.id,
+            request=req,  # склад позиції (ключ резерву) — із заявки
             consumer_company_id=company_id_i,
             product_id=product_id_i,
             payer_id=payer_id_i,
@@ -529,7 +492,7 @@ def submit_new():
             package_text=r.get("package_text"),
         )
         db.session.add(item)
-        added += 1
+        created.append(item)
 
     # Якщо є помилки — не створюємо частково, відкочуємо
     if errors:
@@ -539,11 +502,12 @@ def submit_new():
         flash("Заявку не створено: виправте попередження і спробуйте ще раз.", "warning")
         return redirect(url_for("shipments_requests.index"))
 
-    if added == 0:
+    if not created:
         db.session.rollback()
         flash("Немає коректних позицій для створення заявки.", "warning")
         return redirect(url_for("shipments_requests.index"))
 
+    reserve_items(created)
     req.status = "submitted"
     db.session.commit()
     flash("Заявку створено та подано на погодження складу.", "success")
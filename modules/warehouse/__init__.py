@@ -8,3 +8,4 @@ warehouse_bp = Blueprint(
 )
 
 from . import routes  # noqa: F401
+from . import ledger_events  # noqa: F401
@@ -0,0 +1,205 @@
+# modules/warehouse/archive.py
+# -*- coding: utf-8 -*-
+"""
+Архівація старих рядків журналу stock_transactions.
+
+Усе з tx_date < cutoff переноситься в stock_transactions_archive, а замість перенесених рядків
+у журналі лишається один рядок-залишок на ключ балансу (source_kind="opening_balance",
+tx_date=cutoff, IN або OUT за знаком). Сума журналу по кожному ключу не змінюється,
+тож stock_balances, доступність і запити «на дату» після cutoff дають ті самі результати.
+
+Робота йде порціями по зростанню id, кожна порція — окрема транзакція (копія в архів,
+видалення, оновлення рядків-залишків). Позиція зберігається в stock_archive_runs,
+тож перерваний запуск продовжується з того ж місця. Чекпоінти з period_end <= cutoff
+видаляються: рядки-залишки вже містять цю історію.
+
+Запити «на дату» раніше cutoff гарячий журнал більше не обслуговує — історія лишається в архіві.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, case, delete, func, insert, literal, or_, select, update
+
+from extensions import db
+from .models import (
+    StockArchiveRun, StockCheckpoint, StockCheckpointPeriod, StockTransaction, StockTransactionArchive,
+)
+from .services import BALANCE_KEY_COLS, SNAPSHOT_COLS, BalanceKey, balance_key, key_of, signed_qty
+
+OPENING_KIND = "opening_balance"
+
+_EPS = 1e-9
+_TEXT_COLS = ("product_name",) + SNAPSHOT_COLS
+_PRODUCT_POS = BALANCE_KEY_COLS.index("product_id")
+
+
+# ----------------------------- запуск -----------------------------
+
+def _start_run(cutoff: datetime, warehouse_id: Optional[int]) -> StockArchiveRun:
+    """Незавершений запуск з тими ж параметрами або новий. Commit всередині."""
+    running = StockArchiveRun.query.filter_by(status="running").first()
+    if running is not None:
+        if running.cutoff != cutoff or running.warehouse_id != warehouse_id:
+            raise ValueError(
+                f"Незавершена архівація #{running.id} (до {running.cutoff:%Y-%m-%d}, "
+                f"склад {running.warehouse_id or 'усі'}) — спершу завершіть її."
+            )
+        return running
+
+    run = StockArchiveRun(cutoff=cutoff, warehouse_id=warehouse_id)
+    db.session.add(run)
+    # чекпоінт на дату <= cutoff разом з рядком-залишком рахував би ту саму історію двічі
+    old_periods = select(StockCheckpointPeriod.id).where(StockCheckpointPeriod.period_end <= cutoff)
+    db.session.execute(delete(StockCheckpoint.__table__).where(StockCheckpoint.period_id.in_(old_periods)))
+    db.session.execute(
+        delete(StockCheckpointPeriod.__table__).where(StockCheckpointPeriod.period_end <= cutoff)
+    )
+    db.session.commit()
+    return run
+
+
+def _opening_values(total: float) -> dict:
+    """Знаковий залишок → (tx_type, qty ≥ 0) для рядка журналу."""
+    return {"tx_type": "IN" if total >= 0 else "OUT", "qty": abs(total)}
+
+
+def _archive_chunk(run: StockArchiveRun, chunk_size: int) -> int:
+    """Переносить одну порцію (до chunk_size рядків) в архів. Commit всередині; 0 — більше нічого."""
+    st = StockTransaction.__table__
+    conds = [st.c.tx_date < run.cutoff, st.c.id > run.last_tx_id]
+    if run.warehouse_id is not None:
+        conds.append(st.c.warehouse_id == run.warehouse_id)
+
+    rows = db.session.execute(
+        select(st.c.id, st.c.tx_type, st.c.qty,
+               *[st.c[c] for c in BALANCE_KEY_COLS], *[st.c[c] for c in _TEXT_COLS])
+        .where(*conds)
+        .order_by(st.c.id.asc())
+        .limit(chunk_size)
+    ).all()
+    if not rows:
+        return 0
+    last_id = rows[-1].id
+
+    net: Dict[BalanceKey, float] = {}
+    texts: Dict[BalanceKey, dict] = {}
+    for r in rows:
+        key = key_of(r)
+        net[key] = net.get(key, 0.0) + signed_qty(r.tx_type, r.qty)
+        texts[key] = {c: getattr(r, c) for c in _TEXT_COLS}  # рядки за зростанням id — лишається найновіший
+
+    # 1) копія в архів і видалення — тим самим діапазоном (умови + id <= last_id)
+    at = StockTransactionArchive.__table__
+    names = [c.name for c in st.columns]
+    chunk = conds + [st.c.id <= last_id]
+    db.session.execute(
+        insert(at).from_select(
+            names + ["archive_run_id", "archived_at"],
+            select(*[st.c[n] for n in names], literal(run.id), literal(datetime.utcnow())).where(*chunk),
+        )
+    )
+    db.session.execute(delete(st).where(*chunk))
+
+    # 2) рядки-залишки цього запуску: додаємо нетто порції (Core — повз ledger_events,
+    #    бо сума по ключу не змінюється і stock_balances лишається правильним)
+    existing = {}
+    for r in db.session.execute(
+        select(st.c.id, st.c.tx_type, st.c.qty, *[st.c[c] for c in BALANCE_KEY_COLS])
+        .where(st.c.source_kind == OPENING_KIND, st.c.source_id == run.id,
+               st.c.product_id.in_({k[_PRODUCT_POS] for k in net}))
+    ):
+        existing[key_of(r)] = (r.id, signed_qty(r.tx_type, r.qty))
+
+    updates, inserts = [], []
+    for key, delta in net.items():
+        if key in existing:
+            row_id, total = existing[key]
+            vals = _opening_values(total + delta)
+            updates.append({"row_id": row_id, "new_type": vals["tx_type"], "new_qty": vals["qty"]})
+        elif abs(delta) > _EPS:
+            row = dict(zip(BALANCE_KEY_COLS, key))
+            row.update(texts[key])
+            row.update(_opening_values(delta))
+            row.update(
+                tx_date=run.cutoff, source_kind=OPENING_KIND, source_id=run.id,
+                note=f"Залишок на {run.cutoff:%Y-%m-%d} (архівація #{run.id})",
+            )
+            inserts.append(row)
+    if updates:
+        db.session.execute(
+            update(st).where(st.c.id == bindparam("row_id"))
+            .values(tx_type=bindparam("new_type"), qty=bindparam("new_qty")),
+            updates,
+        )
+    if inserts:
+        db.session.execute(insert(st), inserts)
+
+    run.last_tx_id = last_id
+    run.moved += len(rows)
+    run.opening_rows += len(inserts)
+    db.session.commit()
+    return len(rows)
+
+
+def archive_transactions(cutoff: datetime, *, warehouse_id: Optional[int] = None,
+                         chunk_size: int = 2000, max_chunks: Optional[int] = None) -> StockArchiveRun:
+    """
+    Архівує журнал до cutoff (один склад або всі). max_chunks обмежує роботу за один виклик —
+    повторний виклик з тими ж параметрами продовжить. Повертає запуск (status="done" — завершено).
+    """
+    run = _start_run(cutoff, warehouse_id)
+    done = 0
+    while max_chunks is None or done < max_chunks:
+        if not _archive_chunk(run, chunk_size):
+            run.status = "done"
+            run.finished_at = datetime.utcnow()
+            db.session.commit()
+            break
+        done += 1
+    return run
+
+
+# ----------------------------- перевірка -----------------------------
+
+def _signed_sums(model, warehouse_id: Optional[int], *conds) -> Dict[BalanceKey, float]:
+    key_cols = [getattr(model, c) for c in BALANCE_KEY_COLS]
+    qty = func.coalesce(func.sum(case((model.tx_type == "IN", model.qty), else_=-model.qty)), 0.0)
+    q = db.session.query(*key_cols, qty.label("qty")).filter(*conds).group_by(*key_cols)
+    if warehouse_id is not None:
+        q = q.filter(model.warehouse_id == warehouse_id)
+    return {key_of(r): float(r.qty) for r in q}
+
+
+def ledger_balances(*, warehouse_id: Optional[int] = None) -> Dict[BalanceKey, float]:
+    """{ключ: залишок} за гарячим журналом (з рядками-залишками)."""
+    return _signed_sums(StockTransaction, warehouse_id)
+
+
+def history_balances(*, warehouse_id: Optional[int] = None) -> Dict[BalanceKey, float]:
+    """{ключ: залишок} за повною історією: архів + журнал без рядків-залишків."""
+    acc: Dict[BalanceKey, float] = {}
+    for model in (StockTransactionArchive, StockTransaction):
+        not_opening = or_(model.source_kind.is_(None), model.source_kind != OPENING_KIND)
+        for key, qty in _signed_sums(model, warehouse_id, not_opening).items():
+            acc[key] = acc.get(key, 0.0) + qty
+    return acc
+
+
+def compare_balances(before: Dict[BalanceKey, float], after: Dict[BalanceKey, float],
+                     eps: float = 1e-6) -> List[dict]:
+    """Розбіжності двох знімків залишків (відсутній ключ = 0)."""
+    out = []
+    for key in sorted(set(before) | set(after), key=balance_key):
+        a, b = before.get(key, 0.0), after.get(key, 0.0)
+        if abs(a - b) > eps:
+            out.append({"key": dict(zip(BALANCE_KEY_COLS, key)), "before": a, "after": b})
+    return out
+
+
+def verify_archive(*, warehouse_id: Optional[int] = None, eps: float = 1e-6) -> List[dict]:
+    """Гарячий журнал проти повної історії (архів + журнал); порожній список — усе узгоджено."""
+    return compare_balances(history_balances(warehouse_id=warehouse_id),
+                            ledger_balances(warehouse_id=warehouse_id), eps)
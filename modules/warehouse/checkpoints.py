@@ -0,0 +1,237 @@
+# modules/warehouse/checkpoints.py
+# -*- coding: utf-8 -*-
+"""
+Чекпоінти залишків складу для запитів «на дату».
+
+Закриття періоду пише закриваючі залишки по кожному ключу балансу (stock_checkpoints).
+Залишок на момент T = останній актуальний чекпоінт з period_end <= T
++ хвіст журналу з tx_date у [period_end, T).
+
+Транзакція заднім числом (tx_date < period_end) позначає всі пізніші періоди is_stale
+(ledger_events.py); refresh_stale_checkpoints()/close_months() їх перераховують.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, case, func, update
+
+from extensions import db
+from .models import StockTransaction, StockCheckpoint, StockCheckpointPeriod
+from .services import BALANCE_KEY_COLS, BalanceKey, key_of
+
+_EPS = 1e-9
+_INSERT_CHUNK = 1000
+
+
+# ----------------------------- хелпери -----------------------------
+
+def _scope_filters(model, warehouse_id: Optional[int], product_id: Optional[int]) -> list:
+    conds = []
+    if warehouse_id is not None:
+        conds.append(model.warehouse_id == warehouse_id)
+    if product_id is not None:
+        conds.append(model.product_id == product_id)
+    return conds
+
+
+def _key_filters(model, key: BalanceKey) -> list:
+    """Фільтр по повному ключу балансу (NULL = NULL)."""
+    conds = []
+    for col, v in zip(BALANCE_KEY_COLS, key):
+        c = getattr(model, col)
+        conds.append(c.is_(None) if v is None else c == v)
+    return conds
+
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _next_month(dt: datetime) -> datetime:
+    return datetime(dt.year + 1, 1, 1) if dt.month == 12 else datetime(dt.year, dt.month + 1, 1)
+
+
+def _latest_period(at: datetime) -> Optional[StockCheckpointPeriod]:
+    """Останній актуальний (не stale) чекпоінт з period_end <= at."""
+    return (
+        StockCheckpointPeriod.query
+        .filter(StockCheckpointPeriod.period_end <= at, StockCheckpointPeriod.is_stale.is_(False))
+        .order_by(StockCheckpointPeriod.period_end.desc())
+        .first()
+    )
+
+
+def _ledger_sums(date_from: Optional[datetime], date_to: datetime, conds: list):
+    """Рух журналу по ключах за [date_from, date_to): (key..., qty_in, qty_out)."""
+    st = StockTransaction
+    key_cols = [getattr(st, c) for c in BALANCE_KEY_COLS]
+    qty_in = func.coalesce(func.sum(case((st.tx_type == "IN", st.qty), else_=0.0)), 0.0).label("qty_in")
+    qty_out = func.coalesce(func.sum(case((st.tx_type == "OUT", st.qty), else_=0.0)), 0.0).label("qty_out")
+
+    q = db.session.query(*key_cols, qty_in, qty_out).filter(st.tx_date < date_to, *conds)
+    if date_from is not None:
+        q = q.filter(st.tx_date >= date_from)
+    return q.group_by(*key_cols)
+
+
+# ----------------------------- запити «на дату» -----------------------------
+
+def balances_at(at: datetime, *, warehouse_id: Optional[int] = None,
+                product_id: Optional[int] = None) -> Dict[BalanceKey, float]:
+    """{ключ балансу: залишок} на момент at (транзакції з tx_date < at), лише ненульові."""
+    period = _latest_period(at)
+    acc: Dict[BalanceKey, float] = {}
+
+    if period is not None:
+        rows = (
+            StockCheckpoint.query
+            .filter(StockCheckpoint.period_id == period.id,
+                    *_scope_filters(StockCheckpoint, warehouse_id, product_id))
+        )
+        for r in rows:
+            acc[key_of(r)] = float(r.qty)
+
+    date_from = period.period_end if period is not None else None
+    conds = _scope_filters(StockTransaction, warehouse_id, product_id)
+    for r in _ledger_sums(date_from, at, conds):
+        key = key_of(r)
+        acc[key] = acc.get(key, 0.0) + float(r.qty_in) - float(r.qty_out)
+
+    return {k: v for k, v in acc.items() if abs(v) > _EPS}
+
+
+def balance_at(key: BalanceKey, at: datetime) -> float:
+    """Залишок одного ключа на момент at; хвіст — точковий скан по ix_st_tx_balance_key."""
+    period = _latest_period(at)
+    base = 0.0
+    if period is not None:
+        base = (
+            db.session.query(func.coalesce(func.sum(StockCheckpoint.qty), 0.0))
+            .filter(StockCheckpoint.period_id == period.id, *_key_filters(StockCheckpoint, key))
+            .scalar()
+        ) or 0.0
+
+    st = StockTransaction
+    q = (
+        db.session.query(func.coalesce(func.sum(case((st.tx_type == "IN", st.qty), else_=-st.qty)), 0.0))
+        .filter(*_key_filters(st, key), st.tx_date < at)
+    )
+    if period is not None:
+        q = q.filter(st.tx_date >= period.period_end)
+    return float(base) + float(q.scalar() or 0.0)
+
+
+def stock_movements(date_from: datetime, date_to: datetime, *, warehouse_id: Optional[int] = None,
+                    product_id: Optional[int] = None) -> List[dict]:
+    """
+    Оборотка за [date_from, date_to) по ключах балансу:
+    [{<ключ>, "opening", "qty_in", "qty_out", "closing"}].
+    """
+    opening = balances_at(date_from, warehouse_id=warehouse_id, product_id=product_id)
+    moves = {}
+    conds = _scope_filters(StockTransaction, warehouse_id, product_id)
+    for r in _ledger_sums(date_from, date_to, conds):
+        moves[key_of(r)] = (float(r.qty_in), float(r.qty_out))
+
+    out = []
+    for key in set(opening) | set(moves):
+        op = opening.get(key, 0.0)
+        qty_in, qty_out = moves.get(key, (0.0, 0.0))
+        row = dict(zip(BALANCE_KEY_COLS, key))
+        row.update(opening=op, qty_in=qty_in, qty_out=qty_out, closing=op + qty_in - qty_out)
+        out.append(row)
+    out.sort(key=lambda r: tuple((r[c] is not None, r[c] or 0) for c in BALANCE_KEY_COLS))
+    return out
+
+
+# ----------------------------- закриття / перерахунок -----------------------------
+
+def close_period(period_end: datetime) -> StockCheckpointPeriod:
+    """
+    Закриває (або перераховує) період: пише залишки на period_end по всіх ключах.
+    База — попередній актуальний чекпоінт + хвіст журналу. Commit всередині.
+    """
+    period = StockCheckpointPeriod.query.filter_by(period_end=period_end).first()
+    if period is None:
+        period = StockCheckpointPeriod(period_end=period_end)
+        db.session.add(period)
+    # поки перераховуємо — власний (старий) чекпоінт не може бути базою
+    period.is_stale = True
+    db.session.flush()
+
+    balances = balances_at(period_end)
+
+    db.session.query(StockCheckpoint).filter(StockCheckpoint.period_id == period.id).delete(
+        synchronize_session=False
+    )
+    rows = []
+    for key, qty in balances.items():
+        row = dict(zip(BALANCE_KEY_COLS, key))
+        row.update(period_id=period.id, qty=qty)
+        rows.append(row)
+    for i in range(0, len(rows), _INSERT_CHUNK):
+        db.session.execute(StockCheckpoint.__table__.insert(), rows[i:i + _INSERT_CHUNK])
+
+    period.is_stale = False
+    period.closed_at = datetime.utcnow()
+    db.session.commit()
+    return period
+
+
+def close_months(until: Optional[datetime] = None) -> List[datetime]:
+    """
+    Місячні чекпоінти (period_end = 1-ше число місяця) від першої транзакції до until,
+    плюс перерахунок усіх stale. Кожен період комітиться окремо — можна перезапускати.
+    Повертає список закритих/перерахованих period_end.
+    """
+    first = db.session.query(func.min(StockTransaction.tx_date)).scalar()
+    if first is None:
+        return refresh_stale_checkpoints()
+    until = until or datetime.utcnow()
+
+    valid = {
+        pe for (pe,) in db.session.query(StockCheckpointPeriod.period_end)
+        .filter(StockCheckpointPeriod.is_stale.is_(False))
+    }
+    stale = {
+        pe for (pe,) in db.session.query(StockCheckpointPeriod.period_end)
+        .filter(StockCheckpointPeriod.is_stale.is_(True))
+    }
+
+    todo = set(stale)
+    pe = _next_month(_month_start(first))
+    while pe <= until:
+        if pe not in valid:
+            todo.add(pe)
+        pe = _next_month(pe)
+
+    done = []
+    for pe in sorted(todo):
+        close_period(pe)
+        done.append(pe)
+    return done
+
+
+def refresh_stale_checkpoints() -> List[datetime]:
+    """Перераховує всі stale-періоди в порядку period_end."""
+    stale = [
+        pe for (pe,) in db.session.query(StockCheckpointPeriod.period_end)
+        .filter(StockCheckpointPeriod.is_stale.is_(True))
+        .order_by(StockCheckpointPeriod.period_end.asc())
+    ]
+    for pe in stale:
+        close_period(pe)
+    return stale
+
+
+def invalidate_checkpoints(conn, since: datetime) -> None:
+    """Позначає stale всі періоди, закриті після since (виклик з after_flush, та сама транзакція)."""
+    t = StockCheckpointPeriod.__table__
+    conn.execute(
+        update(t)
+        .where(and_(t.c.period_end > since, t.c.is_stale.is_(False)))
+        .values(is_stale=True)
+    )
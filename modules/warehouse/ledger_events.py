@@ -0,0 +1,81 @@
+# modules/warehouse/ledger_events.py
+# -*- coding: utf-8 -*-
+"""
+Підтримка stock_balances разом з журналом.
+
+Слухаємо flush ORM-сесії: кожен новий / видалений / змінений StockTransaction
+дає дельту по ключу балансу, і всі дельти flush-у застосовуються одним upsert-ом
+у тій самій транзакції (services.apply_balance_deltas).
+
+Та сама подія позначає застарілими чекпоінти періодів, у які потрапила транзакція
+заднім числом (checkpoints.invalidate_checkpoints).
+
+Масові query.delete()/update() по stock_transactions повз ORM сюди не потрапляють —
+такі місця мають самі чистити/перераховувати stock_balances (див. stock_clear).
+"""
+
+from __future__ import annotations
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .checkpoints import invalidate_checkpoints
+from .models import StockTransaction
+from .services import BALANCE_KEY_COLS, SNAPSHOT_COLS, add_delta, apply_balance_deltas, key_of, make_key, signed_qty
+
+
+# Поля, від яких залежить дельта. active_history=True змушує ORM підвантажити старе значення
+# навіть для expired-атрибута (після commit) — інакше history.deleted буде порожнім.
+_TRACKED_COLS = BALANCE_KEY_COLS + ("qty", "tx_type", "tx_date")
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+for _col in _TRACKED_COLS:
+    event.listen(getattr(StockTransaction, _col), "set", _keep_old_value, active_history=True, retval=True)
+
+
+def _previous(obj, attr: str):
+    """Значення атрибута до зміни в поточному flush."""
+    hist = inspect(obj).attrs[attr].history
+    if hist.deleted:
+        return hist.deleted[0]
+    return getattr(obj, attr)
+
+
+def _snapshots(obj) -> dict:
+    return {c: getattr(obj, c, None) for c in SNAPSHOT_COLS}
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_ledger_deltas(session, flush_context):
+    deltas = {}
+    tx_dates = []
+
+    for obj in session.new:
+        if isinstance(obj, StockTransaction):
+            add_delta(deltas, key_of(obj), signed_qty(obj.tx_type, obj.qty), _snapshots(obj))
+            tx_dates.append(obj.tx_date)
+
+    for obj in session.deleted:
+        if isinstance(obj, StockTransaction):
+            add_delta(deltas, key_of(obj), -signed_qty(obj.tx_type, obj.qty))
+            tx_dates.append(obj.tx_date)
+
+    for obj in session.dirty:
+        if not isinstance(obj, StockTransaction) or not session.is_modified(obj):
+            continue
+        old_key = make_key(_previous(obj, c) for c in BALANCE_KEY_COLS)
+        old_qty = signed_qty(_previous(obj, "tx_type"), _previous(obj, "qty"))
+        add_delta(deltas, old_key, -old_qty)
+        add_delta(deltas, key_of(obj), signed_qty(obj.tx_type, obj.qty), _snapshots(obj))
+        tx_dates += [_previous(obj, "tx_date"), obj.tx_date]
+
+    if deltas:
+        apply_balance_deltas(session.connection(), deltas)
+
+    tx_dates = [d for d in tx_dates if d is not None]
+    if tx_dates:
+        invalidate_checkpoints(session.connection(), min(tx_dates))
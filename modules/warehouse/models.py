@@ -7,6 +7,7 @@ from modules.reference.units.models import Unit
 from modules.reference.companies.models import Company
 from modules.reference.payers.models import Payer
 from modules.reference.manufacturers.models import Manufacturer
+from modules.reference.warehouses.models import Warehouse
 
 
 class StockTransaction(db.Model):
@@ -24,7 +25,7 @@ class StockTransaction(db.Model):
     note            = db.Column(db.String(255), nullable=True)
     source_kind     = db.Column(db.String(50), nullable=True)
     source_id       = db.Column(db.Integer, nullable=True)
-    warehouse_id    = db.Column(db.Integer, nullable=False)
+    warehouse_id    = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=False)
     source_line_idx = db.Column(db.Integer, nullable=True)
 
     # текстові снапшоти (вже існують у БД)
@@ -49,14 +50,189 @@ class StockTransaction(db.Model):
     manufacturer     = relationship(Manufacturer, lazy="joined")
 
     __table_args__ = (
-        Index("ix_st_tx_product", "product_id"),
-        Index("ix_st_tx_company", "consumer_company_id"),
-        Index("ix_st_tx_payer", "payer_id"),
-        Index("ix_st_tx_unit", "unit_id"),
-        Index("ix_st_tx_manufacturer", "manufacturer_id"),
+        # усі індекси журналу починаються з warehouse_id — великий склад не заважає малим
+        Index("ix_st_tx_product", "warehouse_id", "product_id"),
+        Index("ix_st_tx_company", "warehouse_id", "consumer_company_id"),
+        Index("ix_st_tx_payer", "warehouse_id", "payer_id"),
+        Index("ix_st_tx_unit", "warehouse_id", "unit_id"),
+        Index("ix_st_tx_manufacturer", "warehouse_id", "manufacturer_id"),
         Index("ix_st_tx_balance_key",
-              "consumer_company_id", "product_id", "payer_id",
+              "warehouse_id", "consumer_company_id", "product_id", "payer_id",
               "unit_id", "manufacturer_id", "package_value"),
+        Index("ix_st_tx_warehouse_date", "warehouse_id", "tx_date"),
+        Index("ix_st_tx_type_date_id", "warehouse_id", "tx_type", "tx_date", "id"),  # keyset-історія надходжень
         CheckConstraint("qty >= 0", name="ck_st_tx_qty_nonneg"),
         CheckConstraint("tx_type in ('IN','OUT')", name="ck_st_tx_type"),
     )
+
+
+class StockBalance(db.Model):
+    """
+    Матеріалізований залишок по ключу балансу складу.
+    Оновлюється в тій самій транзакції, що й кожен IN/OUT у stock_transactions
+    (див. ledger_events.py); перебудова з журналу — scripts/stock_balances.py.
+    """
+    __tablename__ = "stock_balances"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # NULL-безпечний рядковий ключ (services.balance_key) — унікальний, для ON CONFLICT
+    balance_key = db.Column(db.String(191), nullable=False, unique=True)
+
+    warehouse_id        = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=False)
+    consumer_company_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=True)
+    product_id          = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    payer_id            = db.Column(db.Integer, db.ForeignKey("payers.id"), nullable=True)
+    unit_id             = db.Column(db.Integer, db.ForeignKey("units.id"), nullable=False)
+    manufacturer_id     = db.Column(db.Integer, db.ForeignKey("manufacturers.id"), nullable=True)
+    package_value       = db.Column(db.Float, nullable=True)
+
+    qty = db.Column(db.Float, nullable=False, default=0.0)  # IN − OUT
+
+    # останні текстові снапшоти з журналу (fallback для рядків без *_id)
+    consumer_company_name = db.Column(db.Text, nullable=True)
+    payer_name            = db.Column(db.Text, nullable=True)
+    unit_text             = db.Column(db.Text, nullable=True)
+    manufacturer_name     = db.Column(db.Text, nullable=True)
+    package_text          = db.Column(db.Text, nullable=True)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_sb_balance_key",
+              "warehouse_id", "consumer_company_id", "product_id", "payer_id",
+              "unit_id", "manufacturer_id", "package_value"),
+        Index("ix_sb_warehouse_product", "warehouse_id", "product_id"),
+    )
+
+
+class StockLastReceipt(db.Model):
+    """
+    Вказівник на останнє надходження (IN) по (склад, продукт) + його текстові снапшоти.
+    Оновлюється в warehouse.receive (services.record_last_receipts); сторінка залишків
+    і її фільтри читають знімок звідси замість window-функції по журналу.
+    """
+    __tablename__ = "stock_last_receipts"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    warehouse_id = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=False)
+    product_id   = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+
+    tx_id   = db.Column(db.Integer, nullable=False)   # stock_transactions.id (без FK — журнал архівується)
+    tx_date = db.Column(db.DateTime, nullable=False)
+
+    product_name          = db.Column(db.Text, nullable=True)
+    unit_text             = db.Column(db.Text, nullable=True)
+    consumer_company_name = db.Column(db.Text, nullable=True)
+    payer_name            = db.Column(db.Text, nullable=True)
+    package_text          = db.Column(db.Text, nullable=True)
+    manufacturer_name     = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("warehouse_id", "product_id", name="uq_slr_warehouse_product"),
+        Index("ix_slr_warehouse_consumer", "warehouse_id", "consumer_company_name"),
+    )
+
+
+class StockCheckpointPeriod(db.Model):
+    """
+    Закритий період: залишки на момент period_end (усі транзакції з tx_date < period_end).
+    is_stale=True — у період потрапила заднім числом транзакція, чекпоінт треба перерахувати
+    (див. checkpoints.py); до перерахунку запити його ігнорують.
+    """
+    __tablename__ = "stock_checkpoint_periods"
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_end = db.Column(db.DateTime, nullable=False, unique=True)
+    is_stale   = db.Column(db.Boolean, nullable=False, default=False)
+    closed_at  = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class StockCheckpoint(db.Model):
+    """Закриваючий залишок періоду по ключу балансу (лише ненульові)."""
+    __tablename__ = "stock_checkpoints"
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_id = db.Column(
+        db.Integer, db.ForeignKey("stock_checkpoint_periods.id", ondelete="CASCADE"), nullable=False
+    )
+
+    warehouse_id        = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=False)
+    consumer_company_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=True)
+    product_id          = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    payer_id            = db.Column(db.Integer, db.ForeignKey("payers.id"), nullable=True)
+    unit_id             = db.Column(db.Integer, db.ForeignKey("units.id"), nullable=False)
+    manufacturer_id     = db.Column(db.Integer, db.ForeignKey("manufacturers.id"), nullable=True)
+    package_value       = db.Column(db.Float, nullable=True)
+
+    qty = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_scp_period_key",
+              "period_id", "warehouse_id", "consumer_company_id", "product_id",
+              "payer_id", "unit_id", "manufacturer_id", "package_value"),
+    )
+
+
+class StockTransactionArchive(db.Model):
+    """
+    Архів старих рядків stock_transactions (ті самі колонки й id, без FK і обмежень).
+    Замість архівованих рядків у журналі лишається по одному рядку-залишку
+    (source_kind="opening_balance") на ключ балансу — див. archive.py.
+    """
+    __tablename__ = "stock_transactions_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # id з stock_transactions
+
+    product_id = db.Column(db.Integer, nullable=False)
+    unit_id    = db.Column(db.Integer, nullable=False)
+    qty        = db.Column(db.Float, nullable=False)
+    tx_type    = db.Column(db.String(10), nullable=False)
+    tx_date    = db.Column(db.DateTime, nullable=False)
+
+    note            = db.Column(db.String(255), nullable=True)
+    source_kind     = db.Column(db.String(50), nullable=True)
+    source_id       = db.Column(db.Integer, nullable=True)
+    warehouse_id    = db.Column(db.Integer, nullable=False)
+    source_line_idx = db.Column(db.Integer, nullable=True)
+
+    product_name           = db.Column(db.Text, nullable=True)
+    unit_text              = db.Column(db.Text, nullable=True)
+    consumer_company_name  = db.Column(db.Text, nullable=True)
+    payer_name             = db.Column(db.Text, nullable=True)
+    package_text           = db.Column(db.Text, nullable=True)
+    manufacturer_name      = db.Column(db.Text, nullable=True)
+
+    consumer_company_id = db.Column(db.Integer, nullable=True)
+    payer_id            = db.Column(db.Integer, nullable=True)
+    manufacturer_id     = db.Column(db.Integer, nullable=True)
+    package_value       = db.Column(db.Float, nullable=True)
+
+    archive_run_id = db.Column(db.Integer, db.ForeignKey("stock_archive_runs.id"), nullable=False)
+    archived_at    = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_sta_warehouse_date", "warehouse_id", "tx_date"),
+        Index("ix_sta_source", "source_kind", "source_id"),  # оприбутковано по заявці (receiving.py)
+    )
+
+
+class StockArchiveRun(db.Model):
+    """
+    Запуск архівації: усе з tx_date < cutoff (одного складу або всіх) переноситься в архів
+    порціями по зростанню id; last_tx_id — позиція для продовження після збою.
+    """
+    __tablename__ = "stock_archive_runs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    cutoff       = db.Column(db.DateTime, nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey("warehouses.id"), nullable=True)  # None — усі склади
+    status       = db.Column(db.String(16), nullable=False, default="running")  # running / done
+
+    last_tx_id   = db.Column(db.Integer, nullable=False, default=0)
+    moved        = db.Column(db.Integer, nullable=False, default=0)   # рядків перенесено в архів
+    opening_rows = db.Column(db.Integer, nullable=False, default=0)   # рядків-залишків створено
+
+    started_at  = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,329 @@
+# modules/warehouse/receiving.py
+# -*- coding: utf-8 -*-
+"""
+Оприбуткування за оплаченими заявками «Проплат».
+
+bulk_receive() приймає рядки з багатьох заявок одразу (форма «Масове приймання» і JSON API):
+залишки перевіряються одним агрегатом, довідники — одним запитом на таблицю,
+усі IN пишуться одним executemany в одній транзакції. Оскільки вставка йде повз ORM,
+stock_balances / stock_last_receipts / чекпоінти оновлюються тут же явно.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import joinedload
+
+from extensions import db
+from modules.purchases.payments.models import PaymentInbox
+from modules.reference.manufacturers.models import Manufacturer
+from modules.reference.payers.models import Payer
+from modules.reference.products.models import Product
+from modules.reference.units.models import Unit
+from .checkpoints import invalidate_checkpoints
+from .models import StockTransaction, StockTransactionArchive
+from .services import (
+    SNAPSHOT_COLS, add_delta, apply_balance_deltas, key_of, record_last_receipts, resolve_warehouse_id,
+)
+
+_EPS = 1e-9
+
+
+# ---------- ХЕЛПЕРИ ----------
+
+def is_paid(inbox: PaymentInbox) -> bool:
+    if hasattr(inbox, "status") and (inbox.status or "").lower() == "оплачено":
+        return True
+    if hasattr(inbox, "is_paid") and bool(inbox.is_paid):
+        return True
+    return False
+
+
+def normalize_items_list(items_json):
+    if isinstance(items_json, dict):
+        rows = [items_json]
+    elif isinstance(items_json, list):
+        rows = items_json
+    else:
+        rows = []
+
+    out = []
+    for it in rows:
+        if not isinstance(it, dict):
+            continue
+        product_id        = it.get("product_id")
+        product_name      = it.get("product_name") or (f"#{product_id}" if product_id else "—")
+        package           = it.get("package") or "—"
+        manufacturer_name = it.get("manufacturer_name") or "—"
+        payer_name        = it.get("payer_name") or "—"
+
+        qty = it.get("qty")
+        try:
+            qty = float(qty) if qty is not None else None
+        except Exception:
+            qty = None
+
+        if product_id and qty and qty > 0:
+            out.append({
+                "product_id": int(product_id),
+                "product_name": product_name,
+                "package": package,
+                "manufacturer_name": manufacturer_name,
+                "payer_name": payer_name,
+                "qty": float(qty),
+            })
+    return out
+
+
+def unit_text(u: Unit) -> str:
+    return (
+        getattr(u, "short_name", None)
+        or getattr(u, "symbol", None)
+        or getattr(u, "name", None)
+        or ""
+    )
+
+
+def _named(v: Optional[str]) -> bool:
+    return bool(v) and v != "—"
+
+
+def received_totals(inbox_ids: Iterable[int], by: str) -> Dict[Tuple[int, int], float]:
+    """
+    {(inbox_id, <by>): оприбутковано} по заявках «Проплат», by = "source_line_idx" | "product_id".
+    Один GROUP BY по журналу + один по архіву (архівовані IN теж рахуються як прийняті).
+    """
+    inbox_ids = list(inbox_ids)
+    if not inbox_ids:
+        return {}
+    out: Dict[Tuple[int, int], float] = {}
+    for model in (StockTransaction, StockTransactionArchive):
+        col = getattr(model, by)
+        pairs = (
+            db.session.query(model.source_id, col, func.coalesce(func.sum(model.qty), 0.0))
+            .filter(
+                model.source_kind == "payment_inbox",
+                model.source_id.in_(inbox_ids),
+                model.tx_type == "IN",
+            )
+            .group_by(model.source_id, col)
+        )
+        for sid, val, total in pairs:
+            if val is None:
+                continue
+            k = (int(sid), int(val))
+            out[k] = out.get(k, 0.0) + float(total or 0.0)
+    return out
+
+
+def _received_by_inbox_line(inbox_ids: Iterable[int]) -> Dict[Tuple[int, int], float]:
+    """{(inbox_id, line_idx): оприбутковано} по всіх заявках."""
+    return received_totals(inbox_ids, "source_line_idx")
+
+
+def _name_map(model, names: set) -> Dict[str, int]:
+    if not names:
+        return {}
+    return dict(db.session.query(model.name, model.id).filter(model.name.in_(list(names))).all())
+
+
+# ---------- МАСОВЕ ПРИЙМАННЯ ----------
+
+@dataclass(frozen=True)
+class ReceiveLine:
+    inbox_id: int
+    line_idx: int   # 1-based позиція в нормалізованому items_json (як source_line_idx)
+    qty: float
+
+
+def parse_receive_lines(payload) -> Tuple[List[ReceiveLine], List[str]]:
+    """Рядки з JSON: {"lines": [{"inbox_id", "line_idx", "qty"}, ...]} або просто список."""
+    raw = payload.get("lines") if isinstance(payload, dict) else payload
+    if not isinstance(raw, list):
+        return [], ["Очікується список рядків 'lines'."]
+
+    lines, errors = [], []
+    for n, it in enumerate(raw, start=1):
+        try:
+            lines.append(ReceiveLine(int(it["inbox_id"]), int(it["line_idx"]), float(it["qty"])))
+        except (KeyError, TypeError, ValueError):
+            errors.append(f"Рядок {n}: потрібні inbox_id, line_idx, qty.")
+    return lines, errors
+
+
+def pending_receipt_lines(*, limit: int = 200) -> List[dict]:
+    """
+    Незакриті позиції оплачених заявок (останні limit заявок) для форми масового приймання.
+    Фіксована кількість запитів: заявки, назви продуктів/одиниць, один агрегат оприбуткованого.
+    """
+    inboxes = (
+        PaymentInbox.query.options(joinedload(PaymentInbox.company))
+        .order_by(PaymentInbox.created_at.desc(), PaymentInbox.id.desc())
+        .limit(limit)
+        .all()
+    )
+    paid = [(inbox, normalize_items_list(inbox.items_json)) for inbox in inboxes if is_paid(inbox)]
+    paid = [(inbox, items) for inbox, items in paid if items]
+
+    pids = {it["product_id"] for _, items in paid for it in items}
+    units = {
+        pid: unit_text(u)
+        for pid, u in db.session.query(Product.id, Unit).join(Unit, Unit.id == Product.unit_id)
+        .filter(Product.id.in_(pids)).all()
+    } if pids else {}
+    received = _received_by_inbox_line(inbox.id for inbox, _ in paid)
+
+    out = []
+    for inbox, items in paid:
+        for idx, it in enumerate(items, start=1):
+            rec = received.get((inbox.id, idx), 0.0)
+            remaining = max(0.0, it["qty"] - rec)
+            if remaining <= _EPS:
+                continue
+            out.append({
+                "inbox": inbox,
+                "company_name": inbox.company.name if getattr(inbox, "company", None) else "—",
+                "idx": idx,
+                "product_name": it["product_name"],
+                "package": it["package"],
+                "manufacturer_name": it["manufacturer_name"],
+                "payer_name": it["payer_name"],
+                "unit_text": units.get(it["product_id"], ""),
+                "ordered": it["qty"],
+                "received": rec,
+                "remaining": remaining,
+            })
+    return out
+
+
+def bulk_receive(lines: List[ReceiveLine], *, warehouse_id: int) -> Tuple[int, List[str]]:
+    """
+    Оприбутковує рядки з багатьох заявок на склад warehouse_id в одній транзакції.
+    Все або нічого: за будь-якої помилки нічого не пишеться. Повертає (к-сть IN, помилки).
+    """
+    lines = [ln for ln in lines if ln.qty != 0]
+    if not lines:
+        return 0, ["Немає рядків для оприбуткування."]
+    if warehouse_id is None or resolve_warehouse_id(warehouse_id) != warehouse_id:
+        return 0, [f"Склад #{warehouse_id} не знайдений або неактивний."]
+
+    errors: List[str] = []
+    inbox_ids = sorted({ln.inbox_id for ln in lines})
+    inboxes = {
+        i.id: i for i in
+        PaymentInbox.query.options(joinedload(PaymentInbox.company)).filter(PaymentInbox.id.in_(inbox_ids))
+    }
+
+    # 1) структурна перевірка + сумування повторів одного рядка
+    items_by_inbox: Dict[int, list] = {}
+    wanted: Dict[Tuple[int, int], float] = {}
+    for ln in lines:
+        inbox = inboxes.get(ln.inbox_id)
+        if inbox is None:
+            errors.append(f"Заявку #{ln.inbox_id} не знайдено.")
+            continue
+        if not is_paid(inbox):
+            errors.append(f"Заявка #{ln.inbox_id}: приймання дозволено лише після статусу «Оплачено».")
+            continue
+        items = items_by_inbox.setdefault(ln.inbox_id, normalize_items_list(inbox.items_json))
+        if not 1 <= ln.line_idx <= len(items):
+            errors.append(f"Заявка #{ln.inbox_id}: позиції #{ln.line_idx} немає.")
+            continue
+        if ln.qty < 0:
+            errors.append(f"Заявка #{ln.inbox_id}, позиція #{ln.line_idx}: кількість не може бути від’ємною.")
+            continue
+        key = (ln.inbox_id, ln.line_idx)
+        wanted[key] = wanted.get(key, 0.0) + ln.qty
+    if errors:
+        return 0, errors
+
+    # 2) залишки — один агрегат по всіх заявках
+    received = _received_by_inbox_line(inbox_ids)
+    for (inbox_id, idx), qty in wanted.items():
+        it = items_by_inbox[inbox_id][idx - 1]
+        remaining = max(0.0, it["qty"] - received.get((inbox_id, idx), 0.0))
+        if qty - remaining > _EPS:
+            errors.append(
+                f"Перевищення заборонене: заявка #{inbox_id}, {it['product_name']} — максимум {remaining:.3f}."
+            )
+    if errors:
+        return 0, errors
+
+    # 3) довідники — по одному запиту на таблицю
+    picked = [(inbox_id, idx, items_by_inbox[inbox_id][idx - 1]) for inbox_id, idx in wanted]
+    payer_map = _name_map(Payer, {it["payer_name"] for _, _, it in picked if _named(it["payer_name"])})
+    manufacturer_map = _name_map(
+        Manufacturer, {it["manufacturer_name"] for _, _, it in picked if _named(it["manufacturer_name"])}
+    )
+    pids = {it["product_id"] for _, _, it in picked}
+    prod_map = {
+        p.id: (p, u) for p, u in
+        db.session.query(Product, Unit).join(Unit, Unit.id == Product.unit_id).filter(Product.id.in_(pids))
+    }
+
+    now = datetime.utcnow()
+    rows = []
+    for inbox_id, idx, it in picked:
+        inbox = inboxes[inbox_id]
+        p, u = prod_map.get(it["product_id"], (None, None))
+        if p is None:
+            errors.append(f"Заявка #{inbox_id}: продукт #{it['product_id']} не знайдений у довіднику.")
+            continue
+        payer_id = payer_map.get(it["payer_name"]) if _named(it["payer_name"]) else None
+        manufacturer_id = manufacturer_map.get(it["manufacturer_name"]) if _named(it["manufacturer_name"]) else None
+        # 🔴 Жорстка перевірка — як в одиночному прийманні
+        if _named(it["payer_name"]) and payer_id is None:
+            errors.append(f"Платник «{it['payer_name']}» не знайдений у довіднику.")
+            continue
+        if _named(it["manufacturer_name"]) and manufacturer_id is None:
+            errors.append(f"Виробник «{it['manufacturer_name']}» не знайдений у довіднику.")
+            continue
+
+        rows.append({
+            "product_id": p.id,
+            "unit_id": p.unit_id,
+            "qty": wanted[(inbox_id, idx)],
+            "tx_type": "IN",
+            "tx_date": now,
+            "warehouse_id": warehouse_id,
+            "source_kind": "payment_inbox",
+            "source_id": inbox_id,
+            "source_line_idx": idx,
+            "consumer_company_id": inbox.company_id,
+            "payer_id": payer_id,
+            "manufacturer_id": manufacturer_id,
+            "package_value": None,
+            "product_name": it["product_name"] if it["product_name"] != f"#{p.id}" else p.name,
+            "unit_text": unit_text(u),
+            "consumer_company_name": inbox.company.name if getattr(inbox, "company", None) else "—",
+            "payer_name": it["payer_name"],
+            "package_text": it["package"],
+            "manufacturer_name": it["manufacturer_name"],
+            "note": f"PaymentInbox #{inbox_id}, line #{idx}",
+        })
+    if errors:
+        return 0, errors
+
+    # 4) один executemany + похідні таблиці в тій самій транзакції
+    t = StockTransaction.__table__
+    # (source_id, source_line_idx) унікальні в межах пакета — по них зіставляємо повернені id,
+    # без sort_by_parameter_order (інакше SQLite вставляє по рядку)
+    result = db.session.execute(insert(t).returning(t.c.id, t.c.source_id, t.c.source_line_idx), rows)
+    new_ids = {(r.source_id, r.source_line_idx): r.id for r in result}
+    txs = [SimpleNamespace(id=new_ids[(row["source_id"], row["source_line_idx"])], **row) for row in rows]
+
+    deltas = {}
+    for tx in txs:
+        add_delta(deltas, key_of(tx), tx.qty, {c: getattr(tx, c) for c in SNAPSHOT_COLS})
+    conn = db.session.connection()
+    apply_balance_deltas(conn, deltas)
+    invalidate_checkpoints(conn, now)
+    record_last_receipts(txs)
+
+    db.session.commit()
+    return len(txs), []
@@ -1,69 +1,46 @@
 from datetime import datetime
 from flask import render_template, request, redirect, url_for, flash
-from sqlalchemy import func, case
+from sqlalchemy.orm import noload
 from extensions import db
+from pagination import decode_cursor, keyset_paginate
 from . import warehouse_requests_bp
 from modules.requests.shipments.models import ShipmentRequest, ShipmentRequestItem
+from modules.requests.shipments.reservations import (
+    RESERVE_STATUSES, apply_reservation_deltas, move_to_warehouse, release_items, reserve_key_of,
+)
 from modules.warehouse.models import StockTransaction
+from modules.warehouse.services import (
+    availability_key_of, available_quantities, resolve_warehouse_id, warehouse_choices,
+)
 
-# Допоміжний розрахунок доступного залишку для конкретного item'а
-def _available_for_item(it: ShipmentRequestItem) -> float:
-    signed_qty = func.sum(
-        case(
-            (StockTransaction.tx_type == "IN",  StockTransaction.qty),
-            (StockTransaction.tx_type == "OUT", -StockTransaction.qty),
-            else_=0.0
-        )
-    )
+QUEUE_PER_PAGE = 100
+
+def _queue_page(status: str, param: str):
+    """Сторінка черги заявок зі статусом status (від найстаріших), курсор у параметрі param."""
+    scope = f"warehouse_requests:{status}"
     q = (
-        db.session.query(signed_qty)
-        .filter(StockTransaction.product_id == it.product_id)
-        .filter(StockTransaction.unit_id == it.unit_id)
+        ShipmentRequest.query
+        .options(noload(ShipmentRequest.items))  # у списку позиції не показуються
+        .filter(ShipmentRequest.status == status)
+    )
+    return keyset_paginate(
+        q, ShipmentRequest.created_at, ShipmentRequest.id,
+        scope=scope, cursor=decode_cursor(request.args.get(param), scope),
+        filters={}, per_page=QUEUE_PER_PAGE, descending=False, param=param,
     )
-    # фільтруємо за ключем балансу (дозволяємо NULL = NULL)
-    if it.consumer_company_id is not None:
-        q = q.filter(StockTransaction.consumer_company_id == it.consumer_company_id)
-    else:
-        q = q.filter(StockTransaction.consumer_company_id.is_(None))
-
-    if it.payer_id is not None:
-        q = q.filter(StockTransaction.payer_id == it.payer_id)
-    else:
-        q = q.filter(StockTransaction.payer_id.is_(None))
-
-    if it.manufacturer_id is not None:
-        q = q.filter(StockTransaction.manufacturer_id == it.manufacturer_id)
-    else:
-        q = q.filter(StockTransaction.manufacturer_id.is_(None))
-
-    if it.package_value is not None:
-        q = q.filter(StockTransaction.package_value == it.package_value)
-    else:
-        q = q.filter(StockTransaction.package_value.is_(None))
 
-    val = q.scalar() or 0.0
-    return float(val)
 
 @warehouse_requests_bp.route("/warehouse/requests")
 def list_submitted():
-    to_approve = (
-        ShipmentRequest.query
-        .filter_by(status="submitted")
-        .order_by(ShipmentRequest.created_at.asc())
-        .all()
-    )
-
-    to_execute = (
-        ShipmentRequest.query
-        .filter_by(status="approved")
-        .order_by(ShipmentRequest.created_at.asc())
-        .all()
-    )
+    approve_page = _queue_page("submitted", "approve_cursor")
+    execute_page = _queue_page("approved", "execute_cursor")
 
     return render_template(
         "warehouse_requests/list.html",
-        to_approve=to_approve,
-        to_execute=to_execute,
+        to_approve=approve_page.items,
+        to_execute=execute_page.items,
+        approve_page=approve_page,
+        execute_page=execute_page,
     )
 @warehouse_requests_bp.route("/warehouse/requests/<int:request_id>")
 def view(request_id):
@@ -88,8 +65,20 @@ def execute(request_id):
         # дозволимо виконати одразу після submitted (якщо ще не натиснули approve)
         flash("Заявка має бути у статусі submitted або approved.", "warning")
 
+    # склад-джерело: обирається при поданні (старі заявки без складу — при першому виконанні)
+    if req.warehouse_id is not None:
+        wid = req.warehouse_id
+    else:
+        wid = resolve_warehouse_id(request.values.get("warehouse_id", type=int))
+    if wid is None:
+        flash("Не створено жодного активного складу.", "danger")
+        return redirect(url_for("warehouse_requests.view", request_id=req.id))
+
     if request.method == "POST":
         any_done = False
+        released = {}  # виконане знімається з резерву
+        # доступність усіх позицій одним запитом; далі зменшуємо локально в міру виконання
+        available = available_quantities([availability_key_of(it) for it in req.items], warehouse_id=wid)
         # проходимо по всіх items та шукаємо у формі поля qty_to_execute[item_id]
         for it in req.items:
             key = f"qty_to_execute[{it.id}]"
@@ -108,13 +97,14 @@ def execute(request_id):
                 qty = remain  # м'яка корекція
 
             # додаткова перевірка доступного залишку на складі
-            available_now = _available_for_item(it)
+            akey = availability_key_of(it)
+            available_now = available.get(akey, 0.0)
             if qty > available_now:
                 qty = max(0.0, available_now)
             if qty <= 0:
                 continue
+            available[akey] = available_now - qty
 
-            # ⚠️ тимчасово використовуємо warehouse_id=1 (за потреби підставиш актуальний)
             st = StockTransaction(
                 product_id=it.product_id,
                 unit_id=it.unit_id,
@@ -124,7 +114,7 @@ def execute(request_id):
                 note=f"Shipment request #{req.number}",
                 source_kind="shipment_request",
                 source_id=req.id,
-                warehouse_id=1,  # TODO: обрати зі складу, якщо в тебе є модуль складів
+                warehouse_id=wid,
                 consumer_company_id=it.consumer_company_id,
                 payer_id=it.payer_id,
                 manufacturer_id=it.manufacturer_id,
@@ -132,10 +122,18 @@ def execute(request_id):
             )
             db.session.add(st)
 
+            if req.status in RESERVE_STATUSES:
+                rkey = reserve_key_of(it)
+                released[rkey] = released.get(rkey, 0.0) - qty
             it.qty_executed = (it.qty_executed or 0.0) + qty
             any_done = True
 
         if any_done:
+            apply_reservation_deltas(released)
+            if req.warehouse_id is None and req.status in RESERVE_STATUSES:
+                # стара заявка, подана без складу: решта резерву переходить на склад виконання
+                move_to_warehouse(req.items, wid)
+            req.warehouse_id = wid
             # якщо щось виконали — ставимо щонайменше approved (або executed, якщо все закрито)
             if req.status == "submitted":
                 req.status = "approved"
@@ -148,19 +146,23 @@ def execute(request_id):
         else:
             flash("Немає позицій для виконання або кількість нульова.", "warning")
 
-        return redirect(url_for("warehouse_requests.execute", request_id=req.id))
+        return redirect(url_for("warehouse_requests.execute", request_id=req.id, warehouse_id=wid))
 
     # GET: показ форми виконання з підказками
+    available = available_quantities([availability_key_of(it) for it in req.items], warehouse_id=wid)
     rows = []
     for it in req.items:
         remain = max(0.0, (it.qty_requested - it.qty_executed))
-        avail = _available_for_item(it)
+        avail = available.get(availability_key_of(it), 0.0)
         rows.append({
             "item": it,
             "remain": remain,
             "available": avail,
         })
-    return render_template("warehouse_requests/execute.html", req=req, rows=rows)
+    return render_template(
+        "warehouse_requests/execute.html", req=req, rows=rows,
+        warehouse_id=wid, warehouse_options=warehouse_choices(),
+    )
 @warehouse_requests_bp.route("/warehouse/requests/<int:request_id>/delete", methods=["POST"])
 def delete(request_id):
     req = ShipmentRequest.query.get_or_404(request_id)
@@ -174,6 +176,9 @@ def delete(request_id):
         flash("Видалення дозволене лише для заявок у статусі submitted/approved.", "warning")
         return redirect(url_for("warehouse_requests.list_submitted"))
 
+    # невиконаний залишок позицій звільняє резерв
+    release_items(req.items)
+
     # 1) спочатку видаляємо items
     ShipmentRequestItem.query.filter_by(request_id=req.id).delete(synchronize_session=False)
 
@@ -186,3 +191,17 @@ def delete(request_id):
     return redirect(url_for("warehouse_requests.list_submitted"))
 
 
+@warehouse_requests_bp.route("/warehouse/requests/<int:request_id>/cancel", methods=["POST"])
+def cancel(request_id):
+    req = ShipmentRequest.query.get_or_404(request_id)
+    if req.status not in RESERVE_STATUSES:
+        flash("Скасувати можна лише відкриту заявку (draft/submitted/approved).", "warning")
+        return redirect(url_for("warehouse_requests.view", request_id=req.id))
+
+    # виконане лишається в журналі; невиконаний залишок звільняє резерв
+    release_items(req.items)
+    req.status = "cancelled"
+    db.session.commit()
+
+    flash(f"Заявку {req.number} скасовано.", "success")
+    return redirect(url_for("warehouse_requests.list_submitted"))
@@ -1,9 +1,21 @@
-from flask import render_template, request, redirect, url_for, flash
-from sqlalchemy import func, case, and_
+from flask import render_template, request, redirect, url_for, flash, jsonify
+from sqlalchemy import func, and_
 from sqlalchemy.orm import joinedload
 from extensions import db
 from . import warehouse_bp
-from .models import StockTransaction
+from .models import StockTransaction, StockTransactionArchive, StockBalance, StockCheckpoint, StockLastReceipt
+from .services import record_last_receipts, resolve_warehouse_id, warehouse_choices
+from .receiving import (
+    ReceiveLine,
+    bulk_receive,
+    parse_receive_lines,
+    pending_receipt_lines,
+    received_totals,
+    is_paid as _is_paid,
+    normalize_items_list as _normalize_items_list,
+    unit_text as _unit_text,
+)
+from pagination import decode_cursor, keyset_paginate
 
 # Моделі
 from modules.purchases.payments.models import PaymentInbox
@@ -14,52 +26,10 @@ from modules.reference.manufacturers.models import Manufacturer
 
 
 
-# ---------- ХЕЛПЕРИ ----------
-
-def _is_paid(inbox: PaymentInbox) -> bool:
-    if hasattr(inbox, "status") and (inbox.status or "").lower() == "оплачено":
-        return True
-    if hasattr(inbox, "is_paid") and bool(inbox.is_paid):
-        return True
-    return False
-
+HISTORY_PER_PAGE = 500
 
-def _normalize_items_list(items_json):
-    # ... без змін ...
-    if isinstance(items_json, dict):
-        rows = [items_json]
-    elif isinstance(items_json, list):
-        rows = items_json
-    else:
-        rows = []
-
-    out = []
-    for it in rows:
-        if not isinstance(it, dict):
-            continue
-        product_id        = it.get("product_id")
-        product_name      = it.get("product_name") or (f"#{product_id}" if product_id else "—")
-        package           = it.get("package") or "—"
-        manufacturer_name = it.get("manufacturer_name") or "—"
-        payer_name        = it.get("payer_name") or "—"
-
-        qty = it.get("qty")
-        try:
-            qty = float(qty) if qty is not None else None
-        except Exception:
-            qty = None
-
-        if product_id and qty and qty > 0:
-            out.append({
-                "product_id": int(product_id),
-                "product_name": product_name,
-                "package": package,
-                "manufacturer_name": manufacturer_name,
-                "payer_name": payer_name,
-                "qty": float(qty),
-            })
-    return out
 
+# ---------- ХЕЛПЕРИ ----------
 
 def _group_ordered_by_product(rows):
     # ... без змін ...
@@ -70,53 +40,13 @@ def _group_ordered_by_product(rows):
     return agg
 
 
-def _received_by_product(inbox_id: int, product_ids: list[int]) -> dict[int, float]:
-    # ... без змін ...
-    if not product_ids:
-        return {}
-    pairs = (
-        db.session.query(
-            StockTransaction.product_id,
-            func.coalesce(func.sum(StockTransaction.qty), 0.0)
-        )
-        .filter(
-            StockTransaction.source_kind == "payment_inbox",
-            StockTransaction.source_id == inbox_id,
-            StockTransaction.tx_type == "IN",
-            StockTransaction.product_id.in_(product_ids)
-        )
-        .group_by(StockTransaction.product_id)
-        .all()
-    )
-    return {pid: float(total) for pid, total in pairs}
+def _received_by_inbox_product(inbox_ids: list[int]) -> dict[tuple[int, int], float]:
+    """{(inbox_id, product_id): оприбутковано} одним GROUP BY для всієї сторінки журналу (+ архів)."""
+    return received_totals(inbox_ids, "product_id")
 
 
 def _received_by_line(inbox_id: int) -> dict[int, float]:
-    # ... без змін ...
-    pairs = (
-        db.session.query(
-            StockTransaction.source_line_idx,
-            func.coalesce(func.sum(StockTransaction.qty), 0.0)
-        )
-        .filter(
-            StockTransaction.source_kind == "payment_inbox",
-            StockTransaction.source_id == inbox_id,
-            StockTransaction.tx_type == "IN",
-        )
-        .group_by(StockTransaction.source_line_idx)
-        .all()
-    )
-    return {int(idx): float(total or 0.0) for idx, total in pairs}
-
-
-def _unit_text(u: Unit) -> str:
-    # ... без змін ...
-    return (
-        getattr(u, "short_name", None)
-        or getattr(u, "symbol", None)
-        or getattr(u, "name", None)
-        or ""
-    )
+    return {idx: total for (_, idx), total in received_totals([inbox_id], "source_line_idx").items()}
 
 
 # ---------- РОУТИ КАРКАСУ ----------
@@ -134,105 +64,69 @@ def stock_index():
     - consumer: за споживачем (текст останнього IN по продукту)
     Показуються позиції з додатним балансом (> 0).
     """
-    wid = request.args.get("warehouse_id", type=int) or 1
+    wid = resolve_warehouse_id(request.args.get("warehouse_id", type=int))
     product_id = request.args.get("product_id", type=int)
     consumer = (request.args.get("consumer") or "").strip() or None
 
-    # баланс: IN = +qty, OUT = -qty
-    balance_expr = func.coalesce(
-        func.sum(
-            case(
-                (StockTransaction.tx_type == "IN", StockTransaction.qty),
-                else_=-StockTransaction.qty,
-            )
-        ),
-        0.0,
-    ).label("balance")
-
-    # підзапит: останній IN по кожному продукту (знімок для відображення/фільтра)
-    last_in = (
+    # баланс по продукту — з матеріалізованих stock_balances (IN − OUT вже пораховано)
+    bal = (
         db.session.query(
-            StockTransaction.product_id.label("product_id"),
-            StockTransaction.tx_date.label("tx_date"),
-            StockTransaction.product_name.label("product_name"),
-            StockTransaction.unit_text.label("unit_text"),
-            StockTransaction.consumer_company_name.label("consumer_company_name"),
-            StockTransaction.payer_name.label("payer_name"),
-            StockTransaction.package_text.label("package_text"),
-            StockTransaction.manufacturer_name.label("manufacturer_name"),
-            func.row_number().over(
-                partition_by=StockTransaction.product_id,
-                order_by=[StockTransaction.tx_date.desc(), StockTransaction.id.desc()],
-            ).label("rn"),
+            StockBalance.product_id.label("product_id"),
+            func.coalesce(func.sum(StockBalance.qty), 0.0).label("balance"),
         )
-        .filter(
-            StockTransaction.warehouse_id == wid,
-            StockTransaction.tx_type == "IN",
-        )
-        .subquery("last_in")
+        .filter(StockBalance.warehouse_id == wid)
+        .group_by(StockBalance.product_id)
+        .subquery("bal")
     )
 
-    # основний запит: агрегація балансу + join знімка останнього IN
+    # знімок останнього IN по продукту — вказівник stock_last_receipts
+    last_in = StockLastReceipt
+
+    # основний запит: баланс + join знімка останнього IN
     query = (
         db.session.query(
             Product,
             Unit,
-            balance_expr,
-            last_in.c.tx_date,
-            last_in.c.consumer_company_name,
-            last_in.c.payer_name,
-            last_in.c.package_text,
-            last_in.c.manufacturer_name,
-            last_in.c.product_name.label("product_name_snapshot"),
-            last_in.c.unit_text.label("unit_text_snapshot"),
+            bal.c.balance,
+            last_in.tx_date,
+            last_in.consumer_company_name,
+            last_in.payer_name,
+            last_in.package_text,
+            last_in.manufacturer_name,
+            last_in.product_name.label("product_name_snapshot"),
+            last_in.unit_text.label("unit_text_snapshot"),
         )
-        .join(StockTransaction, StockTransaction.product_id == Product.id)
+        .join(bal, bal.c.product_id == Product.id)
         .join(Unit, Unit.id == Product.unit_id)
-        .outerjoin(last_in, and_(last_in.c.product_id == Product.id, last_in.c.rn == 1))
-        .filter(StockTransaction.warehouse_id == wid)
+        .outerjoin(last_in, and_(last_in.product_id == Product.id, last_in.warehouse_id == wid))
+        .filter(bal.c.balance > 1e-12)  # тільки додатні залишки
     )
 
     # застосувати фільтри
     if product_id:
         query = query.filter(Product.id == product_id)
     if consumer:
-        query = query.filter(last_in.c.consumer_company_name == consumer)
+        query = query.filter(last_in.consumer_company_name == consumer)
 
-    query = (
-        query.group_by(
-            Product.id,
-            Unit.id,
-            last_in.c.tx_date,
-            last_in.c.consumer_company_name,
-            last_in.c.payer_name,
-            last_in.c.package_text,
-            last_in.c.manufacturer_name,
-            last_in.c.product_name,
-            last_in.c.unit_text,
-        )
-        .having(balance_expr > 1e-12)  # тільки додатні залишки
-        .order_by(Product.name.asc())
-    )
+    query = query.order_by(Product.name.asc())
 
-    # селект-опції
+    # селект-опції — з того ж вказівника
     product_opts = (
         db.session.query(Product.id, Product.name)
-        .join(StockTransaction, StockTransaction.product_id == Product.id)
-        .filter(StockTransaction.warehouse_id == wid)
-        .group_by(Product.id, Product.name)   # 🔧 важливо для Postgres
+        .join(last_in, last_in.product_id == Product.id)
+        .filter(last_in.warehouse_id == wid)
         .order_by(Product.name.asc())
         .all()
     )
     consumer_opts = (
-        db.session.query(StockTransaction.consumer_company_name)
+        db.session.query(last_in.consumer_company_name)
         .filter(
-            StockTransaction.warehouse_id == wid,
-            StockTransaction.tx_type == "IN",
-            StockTransaction.consumer_company_name.isnot(None),
-            StockTransaction.consumer_company_name != "",
+            last_in.warehouse_id == wid,
+            last_in.consumer_company_name.isnot(None),
+            last_in.consumer_company_name != "",
         )
         .distinct()
-        .order_by(StockTransaction.consumer_company_name.asc())
+        .order_by(last_in.consumer_company_name.asc())
         .all()
     )
     consumer_opts = [c[0] for c in consumer_opts]
@@ -286,6 +180,7 @@ def stock_index():
         product_id=product_id,
         consumer=consumer,
         warehouse_id=wid,
+        warehouse_options=warehouse_choices(),
     )
 
 
@@ -303,7 +198,10 @@ def stock_out_placeholder():
 
 @warehouse_bp.route("/in-journal")
 def in_journal():
-    # ... без змін повністю ...
+    """
+    Фіксована кількість запитів на сторінку незалежно від кількості заявок:
+    заявки, назви продуктів (batched), оприбутковано (один GROUP BY), історія.
+    """
     inboxes = (
         PaymentInbox.query.options(joinedload(PaymentInbox.company))
         .order_by(PaymentInbox.created_at.desc(), PaymentInbox.id.desc())
@@ -311,34 +209,41 @@ def in_journal():
         .all()
     )
 
-    pending = []
+    # 1) оплачені заявки з валідними позиціями — без звернень до БД
+    paid = []
     for inbox in inboxes:
         if not _is_paid(inbox):
             continue
-
         items = _normalize_items_list(getattr(inbox, "items_json", None))
-        if not items:
-            continue
+        if items:
+            paid.append((inbox, items))
 
-        ordered_map = _group_ordered_by_product(items)
-        product_ids = list(ordered_map.keys())
+    # 2) один batched lookup назв продуктів (для позицій без product_name у items_json)
+    unnamed_ids = {
+        it["product_id"] for _, items in paid for it in items
+        if it["product_name"] == f"#{it['product_id']}"
+    }
+    product_names = dict(
+        db.session.query(Product.id, Product.name).filter(Product.id.in_(unnamed_ids)).all()
+    ) if unnamed_ids else {}
 
-        prod_rows = (
-            db.session.query(Product, Unit)
-            .join(Unit, Unit.id == Product.unit_id)
-            .filter(Product.id.in_(product_ids))
-            .all()
-        )
-        prod_map = {p.id: (p, u) for p, u in prod_rows}
+    # 3) один GROUP BY (source_id, product_id) по оприбуткуваннях усіх заявок сторінки
+    received_all = _received_by_inbox_product([inbox.id for inbox, _ in paid])
 
-        received_map = _received_by_product(inbox.id, product_ids)
+    pending = []
+    for inbox, items in paid:
+        for it in items:
+            if it["product_id"] in product_names and it["product_name"] == f"#{it['product_id']}":
+                it["product_name"] = product_names[it["product_id"]]
+
+        ordered_map = _group_ordered_by_product(items)
 
         total_ordered = total_received = 0.0
         any_received_gt0 = False
         any_remaining_gt0 = False
 
         for pid, ordered in ordered_map.items():
-            rec = received_map.get(pid, 0.0)
+            rec = received_all.get((inbox.id, pid), 0.0)
             remaining = max(0.0, ordered - rec)
 
             total_ordered += ordered
@@ -371,27 +276,48 @@ def in_journal():
             "items": items,
         })
 
-    history_raw = (
-        db.session.query(StockTransaction, Product, Unit)
+    # 4) історія — лише потрібні колонки, без eager-join'ів; keyset-пагінація по (tx_date, id)
+    history_q = (
+        db.session.query(
+            StockTransaction.id,
+            StockTransaction.tx_date,
+            StockTransaction.qty,
+            StockTransaction.source_kind,
+            StockTransaction.source_id,
+            Product.name.label("product_name"),
+            Unit.name.label("unit_name"),
+        )
         .join(Product, Product.id == StockTransaction.product_id)
         .join(Unit, Unit.id == StockTransaction.unit_id)
         .filter(StockTransaction.tx_type == "IN")
-        .order_by(StockTransaction.tx_date.desc(), StockTransaction.id.desc())
-        .limit(500)
-        .all()
+    )
+    # склад — з курсора (щоб «далі» не змінювало вибірку), інакше з URL / за замовчуванням
+    cursor = decode_cursor(request.args.get("history_cursor"), "in_journal_history")
+    if cursor is not None:
+        history_wid = cursor.filters.get("warehouse_id")
+    else:
+        history_wid = resolve_warehouse_id(request.args.get("warehouse_id", type=int))
+    history_q = history_q.filter(StockTransaction.warehouse_id == history_wid)
+    history_page = keyset_paginate(
+        history_q, StockTransaction.tx_date, StockTransaction.id,
+        scope="in_journal_history", cursor=cursor,
+        filters={"warehouse_id": history_wid}, per_page=HISTORY_PER_PAGE, param="history_cursor",
     )
     history = []
-    for st, p, u in history_raw:
+    for r in history_page.items:
         history.append({
-            "tx_date": st.tx_date,
-            "product_name": p.name,
-            "qty": st.qty,
-            "unit_text": _unit_text(u),
-            "source_kind": st.source_kind,
-            "source_id": st.source_id,
+            "tx_date": r.tx_date,
+            "product_name": r.product_name,
+            "qty": r.qty,
+            "unit_text": r.unit_name or "",
+            "source_kind": r.source_kind,
+            "source_id": r.source_id,
         })
 
-    return render_template("warehouse/in_journal.html", pending=pending, history=history)
+    return render_template(
+        "warehouse/in_journal.html", pending=pending, history=history, history_page=history_page,
+        warehouse_id=history_wid, warehouse_options=warehouse_choices(),
+    )
 
 
 # ---------- ПРИЙМАННЯ (ОПРИБУТКУВАННЯ) ПО КОЖНІЙ ПОЗИЦІЇ ----------
@@ -451,6 +377,7 @@ def receive(inbox_id: int):
     prod_map = {p.id: (p, u) for p, u in prod_rows}
 
     received_per_line = _received_by_line(inbox_id)
+    wid = resolve_warehouse_id(request.values.get("warehouse_id", type=int), company_id=consumer_company_id)
 
     rows = []
     for idx, it in enumerate(items, start=1):
@@ -480,8 +407,13 @@ def receive(inbox_id: int):
         flash("Усі позиції цієї заявки вже оприбутковані.", "info")
         return redirect(url_for("warehouse.in_journal"))
 
+    ctx = dict(inbox=inbox, rows=rows, warehouse_id=wid, warehouse_options=warehouse_choices())
+
     if request.method == "POST":
-        created = 0
+        if wid is None or wid != request.form.get("warehouse_id", type=int):
+            flash("Оберіть активний склад для приймання.", "danger")
+            return render_template("warehouse/receive_form.html", **ctx)
+        created_txs = []
         consumer_name = getattr(getattr(inbox, "company", None), "name", None) or "—"
 
         for r in rows:
@@ -494,15 +426,15 @@ def receive(inbox_id: int):
                 receive_now = float(raw_val.replace(",", "."))
             except ValueError:
                 flash(f"Невірне число для позиції #{r['idx']}.", "danger")
-                return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+                return render_template("warehouse/receive_form.html", **ctx)
 
             if receive_now < 0:
                 flash(f"Кількість не може бути від’ємною (позиція #{r['idx']}).", "danger")
-                return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+                return render_template("warehouse/receive_form.html", **ctx)
 
             if receive_now - r["remaining"] > 1e-9:
                 flash(f"Перевищення заборонене: {r['product'].name} — максимум {r['remaining']:.3f}.", "danger")
-                return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+                return render_template("warehouse/receive_form.html", **ctx)
 
             if receive_now > 0:
                 payer_name = r["payer_name"]
@@ -514,18 +446,18 @@ def receive(inbox_id: int):
                 # 🔴 Жорстка перевірка — щоб не було "NULL-кошика" і плутанини в бухгалтерії
                 if payer_name and payer_name != "—" and payer_id is None:
                     flash(f"Платник «{payer_name}» не знайдений у довіднику.", "danger")
-                    return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+                    return render_template("warehouse/receive_form.html", **ctx)
 
                 if manufacturer_name and manufacturer_name != "—" and manufacturer_id is None:
                     flash(f"Виробник «{manufacturer_name}» не знайдений у довіднику.", "danger")
-                    return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+                    return render_template("warehouse/receive_form.html", **ctx)
 
                 st = StockTransaction(
                     product_id=r["product"].id,
                     unit_id=r["product"].unit_id,
                     qty=receive_now,
                     tx_type="IN",
-                    warehouse_id=1,
+                    warehouse_id=wid,
 
                     source_kind="payment_inbox",
                     source_id=inbox_id,
@@ -548,29 +480,102 @@ def receive(inbox_id: int):
                     note=f"PaymentInbox #{inbox_id}, line #{r['idx']}",
                 )
                 db.session.add(st)
-                created += 1
+                created_txs.append(st)
 
+        created = len(created_txs)
         if created == 0:
             flash("Немає рядків для оприбуткування.", "warning")
-            return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+            return render_template("warehouse/receive_form.html", **ctx)
 
+        db.session.flush()
+        record_last_receipts(created_txs)
         db.session.commit()
         flash(f"Оприбуткувань створено: {created}.", "success")
         return redirect(url_for("warehouse.in_journal"))
 
-    return render_template("warehouse/receive_form.html", inbox=inbox, rows=rows)
+    return render_template("warehouse/receive_form.html", **ctx)
+
+
+
+# ---------- МАСОВЕ ПРИЙМАННЯ (багато заявок за раз) ----------
+
+@warehouse_bp.route("/receive/bulk", methods=["GET", "POST"], endpoint="receive_bulk")
+def receive_bulk():
+    """Одна форма з незакритими позиціями всіх оплачених заявок; порожні поля пропускаються."""
+    rows = pending_receipt_lines()
+    options = warehouse_choices()
+
+    if request.method == "POST":
+        wid = request.form.get("warehouse_id", type=int)
+        lines = []
+        for r in rows:
+            raw_val = (request.form.get(f"receive_now_{r['inbox'].id}_{r['idx']}") or "").strip()
+            if raw_val == "":
+                continue
+            try:
+                qty = float(raw_val.replace(",", "."))
+            except ValueError:
+                flash(f"Невірне число: заявка #{r['inbox'].id}, позиція #{r['idx']}.", "danger")
+                return render_template(
+                    "warehouse/receive_bulk.html", rows=rows, form=request.form,
+                    warehouse_id=wid, warehouse_options=options,
+                )
+            lines.append(ReceiveLine(r["inbox"].id, r["idx"], qty))
+
+        created, errors = bulk_receive(lines, warehouse_id=wid)
+        if errors:
+            for msg in errors:
+                flash(msg, "danger" if lines else "warning")
+            return render_template(
+                "warehouse/receive_bulk.html", rows=rows, form=request.form,
+                warehouse_id=wid, warehouse_options=options,
+            )
+
+        flash(f"Оприбуткувань створено: {created}.", "success")
+        return redirect(url_for("warehouse.in_journal"))
+
+    return render_template(
+        "warehouse/receive_bulk.html", rows=rows, form={},
+        warehouse_id=resolve_warehouse_id(request.args.get("warehouse_id", type=int)), warehouse_options=options,
+    )
+
 
+@warehouse_bp.post("/api/receive/bulk", endpoint="api_receive_bulk")
+def api_receive_bulk():
+    """
+    JSON: {"warehouse_id": 1, "lines": [{"inbox_id": 1, "line_idx": 1, "qty": 10.0}, ...]}
+    200 {"created": n} або 400 {"errors": [...]} (нічого не записано).
+    """
+    payload = request.get_json(silent=True)
+    lines, errors = parse_receive_lines(payload)
+    if not errors:
+        raw_wid = payload.get("warehouse_id") if isinstance(payload, dict) else None
+        wid = raw_wid if isinstance(raw_wid, int) and not isinstance(raw_wid, bool) else None
+        created, errors = bulk_receive(lines, warehouse_id=wid)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    return jsonify({"created": created})
 
 
 @warehouse_bp.post("/stock/clear", endpoint="stock_clear")
 def stock_clear():
-    """Очистити всі транзакції (IN/OUT) центрального складу та скинути залишок у нуль."""
-    wid = request.form.get("warehouse_id", type=int) or 1
+    """Очистити всі транзакції (IN/OUT) обраного складу та скинути залишок у нуль."""
+    wid = request.form.get("warehouse_id", type=int)
+    if wid is None:
+        flash("Не вказано склад для очищення.", "danger")
+        return redirect(url_for("warehouse.stock_index"))
     deleted = (
         db.session.query(StockTransaction)
         .filter(StockTransaction.warehouse_id == wid)
         .delete(synchronize_session=False)
     )
+    # масовий delete йде повз ORM-події — залишки, чекпоінти й вказівники складу чистимо тут же
+    db.session.query(StockBalance).filter(StockBalance.warehouse_id == wid).delete(synchronize_session=False)
+    db.session.query(StockCheckpoint).filter(StockCheckpoint.warehouse_id == wid).delete(synchronize_session=False)
+    db.session.query(StockLastReceipt).filter(StockLastReceipt.warehouse_id == wid).delete(synchronize_session=False)
+    db.session.query(StockTransactionArchive).filter(StockTransactionArchive.warehouse_id == wid).delete(
+        synchronize_session=False
+    )
     db.session.commit()
     flash(f"Очищено транзакцій складу #{wid}: {deleted}.", "success")
-    return redirect(url_for("warehouse.stock_index"))
+    return redirect(url_for("warehouse.stock_index", warehouse_id=wid))
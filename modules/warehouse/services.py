@@ -0,0 +1,382 @@
+# modules/warehouse/services.py
+# -*- coding: utf-8 -*-
+"""
+Матеріалізовані залишки складу (stock_balances):
+ключ балансу, застосування дельт з журналу, перебудова з журналу та перевірка узгодженості.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, cast, column, func, or_, select, text, update, values
+
+from extensions import db, dialect_insert
+from modules.reference.companies.models import Company
+from modules.reference.warehouses.models import Warehouse
+from .models import StockTransaction, StockBalance, StockLastReceipt
+
+# Ключ балансу (порядок важливий — з нього будується balance_key)
+BALANCE_KEY_COLS = (
+    "warehouse_id", "consumer_company_id", "product_id",
+    "payer_id", "unit_id", "manufacturer_id", "package_value",
+)
+
+# Текстові снапшоти, які переносимо з журналу в баланс
+SNAPSHOT_COLS = ("consumer_company_name", "payer_name", "unit_text", "manufacturer_name", "package_text")
+
+BalanceKey = Tuple[Optional[int], Optional[int], Optional[int], Optional[int], Optional[int], Optional[int], Optional[float]]
+
+# Ключ доступності — ключ балансу без складу (склад задається окремо або сумуємо по всіх)
+AVAILABILITY_KEY_COLS = BALANCE_KEY_COLS[1:]
+AvailabilityKey = Tuple[Optional[int], Optional[int], Optional[int], Optional[int], Optional[int], Optional[float]]
+
+# Снапшоти останнього надходження (stock_last_receipts)
+LAST_RECEIPT_COLS = ("product_name",) + SNAPSHOT_COLS
+
+_INSERT_CHUNK = 1000
+
+
+# ----------------------------- склади -----------------------------
+
+def warehouse_choices() -> List[Tuple[int, str]]:
+    """[(id, "Компанія · Склад")] активних складів для select у формах складу."""
+    rows = (
+        db.session.query(Warehouse.id, Warehouse.name, Company.name)
+        .join(Company, Company.id == Warehouse.company_id)
+        .filter(Warehouse.is_active.is_(True))
+        .order_by(Company.name.asc(), Warehouse.name.asc())
+        .all()
+    )
+    return [(wid, f"{cname} · {wname}") for wid, wname, cname in rows]
+
+
+def resolve_warehouse_id(raw=None, *, company_id: Optional[int] = None) -> Optional[int]:
+    """
+    Склад для операції: переданий id, якщо такий активний склад є; інакше перший активний
+    склад компанії company_id; інакше перший активний склад взагалі; None — складів немає.
+    """
+    try:
+        wid = int(raw) if raw not in (None, "") else None
+    except (TypeError, ValueError):
+        wid = None
+
+    active = Warehouse.query.filter(Warehouse.is_active.is_(True))
+    if wid is not None and active.filter(Warehouse.id == wid).first() is not None:
+        return wid
+    if company_id is not None:
+        own = active.filter(Warehouse.company_id == company_id).order_by(Warehouse.id.asc()).first()
+        if own is not None:
+            return own.id
+    first = active.order_by(Warehouse.id.asc()).first()
+    return first.id if first is not None else None
+
+
+# ----------------------------- ключ балансу -----------------------------
+
+def make_key(values: Iterable) -> BalanceKey:
+    """Нормалізує значення ключа: id → int, package_value → float, порожнє → None."""
+    out = []
+    for col, v in zip(BALANCE_KEY_COLS, values):
+        if v is None or v == "":
+            out.append(None)
+        elif col == "package_value":
+            out.append(float(v))
+        else:
+            out.append(int(v))
+    return tuple(out)
+
+
+def key_of(obj) -> BalanceKey:
+    """Ключ балансу з StockTransaction/рядка запиту/будь-якого об'єкта з відповідними атрибутами."""
+    return make_key(getattr(obj, c, None) for c in BALANCE_KEY_COLS)
+
+
+def balance_key(key: BalanceKey) -> str:
+    """NULL-безпечне рядкове представлення ключа (унікальне в stock_balances)."""
+    return "|".join("" if v is None else str(v) for v in key)
+
+
+def signed_qty(tx_type: Optional[str], qty) -> float:
+    """IN = +qty, OUT = −qty."""
+    q = float(qty or 0.0)
+    return q if tx_type == "IN" else -q
+
+
+def add_delta(deltas: Dict[BalanceKey, dict], key: BalanceKey, qty: float, snapshots: Optional[dict] = None) -> None:
+    """Накопичує дельту по ключу; непорожні снапшоти перезаписують попередні."""
+    d = deltas.setdefault(key, {"qty": 0.0})
+    d["qty"] += qty
+    for col, v in (snapshots or {}).items():
+        if v:
+            d[col] = v
+
+
+def apply_balance_deltas(conn, deltas: Dict[BalanceKey, dict]) -> None:
+    """
+    Застосовує накопичені дельти до stock_balances на переданому з'єднанні (тій самій транзакції):
+    INSERT ... ON CONFLICT (balance_key) DO UPDATE SET qty = qty + excluded.qty
+    для SQLite/PostgreSQL; для інших діалектів — UPDATE, а якщо рядка нема — INSERT.
+    """
+    if not deltas:
+        return
+
+    t = StockBalance.__table__
+    now = datetime.utcnow()
+    rows = []
+    for key, d in deltas.items():
+        row = {"balance_key": balance_key(key), "qty": float(d["qty"]), "updated_at": now}
+        row.update(zip(BALANCE_KEY_COLS, key))
+        for col in SNAPSHOT_COLS:
+            row[col] = d.get(col)
+        rows.append(row)
+
+    insert = dialect_insert(conn)
+    if insert is not None:
+        stmt = insert(t)
+        set_ = {
+            "qty": t.c.qty + stmt.excluded.qty,
+            "updated_at": stmt.excluded.updated_at,
+        }
+        for col in SNAPSHOT_COLS:
+            set_[col] = func.coalesce(stmt.excluded[col], t.c[col])
+        stmt = stmt.on_conflict_do_update(index_elements=[t.c.balance_key], set_=set_)
+        for i in range(0, len(rows), _INSERT_CHUNK):
+            conn.execute(stmt, rows[i:i + _INSERT_CHUNK])
+        return
+
+    for row in rows:
+        values = {"qty": t.c.qty + row["qty"], "updated_at": now}
+        values.update({col: func.coalesce(row[col], t.c[col]) for col in SNAPSHOT_COLS})
+        res = conn.execute(update(t).where(t.c.balance_key == row["balance_key"]).values(**values))
+        if not res.rowcount:
+            conn.execute(t.insert(), row)
+
+
+# ----------------------------- перебудова / перевірка -----------------------------
+
+def _ledger_aggregate(warehouse_id: Optional[int] = None):
+    """Агрегат журналу: один рядок на ключ балансу + MAX снапшотів."""
+    key_cols = [getattr(StockTransaction, c) for c in BALANCE_KEY_COLS]
+    qty = func.coalesce(func.sum(
+        case((StockTransaction.tx_type == "IN", StockTransaction.qty), else_=-StockTransaction.qty)
+    ), 0.0).label("qty")
+    snaps = [func.max(getattr(StockTransaction, c)).label(c) for c in SNAPSHOT_COLS]
+
+    q = db.session.query(*key_cols, qty, *snaps).group_by(*key_cols)
+    if warehouse_id is not None:
+        q = q.filter(StockTransaction.warehouse_id == warehouse_id)
+    return q
+
+
+def rebuild_stock_balances(*, warehouse_id: Optional[int] = None) -> int:
+    """
+    Перебудовує stock_balances з журналу stock_transactions (усі склади або один).
+    Виконується в одній транзакції; повертає кількість ключів.
+    """
+    t = StockBalance.__table__
+    delete_q = t.delete()
+    if warehouse_id is not None:
+        delete_q = delete_q.where(t.c.warehouse_id == warehouse_id)
+    db.session.execute(delete_q)
+
+    now = datetime.utcnow()
+    written = 0
+    batch = []
+    for r in _ledger_aggregate(warehouse_id).yield_per(_INSERT_CHUNK):
+        key = key_of(r)
+        row = {"balance_key": balance_key(key), "qty": float(r.qty or 0.0), "updated_at": now}
+        row.update(zip(BALANCE_KEY_COLS, key))
+        row.update({col: getattr(r, col) for col in SNAPSHOT_COLS})
+        batch.append(row)
+        if len(batch) >= _INSERT_CHUNK:
+            db.session.execute(t.insert(), batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(t.insert(), batch)
+        written += len(batch)
+
+    db.session.commit()
+    return written
+
+
+def check_stock_balances(*, warehouse_id: Optional[int] = None, eps: float = 1e-6) -> List[dict]:
+    """
+    Порівнює stock_balances з агрегатом журналу.
+    Повертає розбіжності: [{"key": ..., "ledger": qty, "stored": qty}], порожній список — усе узгоджено.
+    Відсутній рядок рівнозначний нульовому залишку (після видалення транзакцій лишаються ключі з qty=0).
+    """
+    ledger = {key_of(r): float(r.qty or 0.0) for r in _ledger_aggregate(warehouse_id)}
+
+    q = db.session.query(StockBalance)
+    if warehouse_id is not None:
+        q = q.filter(StockBalance.warehouse_id == warehouse_id)
+    stored = {key_of(b): float(b.qty or 0.0) for b in q}
+
+    out = []
+    for key in sorted(set(ledger) | set(stored), key=balance_key):
+        a, b = ledger.get(key, 0.0), stored.get(key, 0.0)
+        if abs(a - b) > eps:
+            out.append({"key": dict(zip(BALANCE_KEY_COLS, key)), "ledger": a, "stored": b})
+    return out
+
+
+# ----------------------------- останнє надходження -----------------------------
+
+def _last_receipt_row(st) -> dict:
+    row = {
+        "warehouse_id": st.warehouse_id,
+        "product_id": st.product_id,
+        "tx_id": st.id,
+        "tx_date": st.tx_date,
+    }
+    row.update({col: getattr(st, col) for col in LAST_RECEIPT_COLS})
+    return row
+
+
+def record_last_receipts(txs: Iterable[StockTransaction]) -> None:
+    """
+    Оновлює вказівник «останнє надходження» по (склад, продукт) для IN-транзакцій.
+    Викликати після flush (потрібні id/tx_date). Старіша транзакція (заднім числом)
+    вказівник не перезаписує — порядок як у колишньому ORDER BY tx_date DESC, id DESC.
+    """
+    latest: Dict[tuple, dict] = {}
+    for st in txs:
+        if st.tx_type != "IN":
+            continue
+        row = _last_receipt_row(st)
+        k = (row["warehouse_id"], row["product_id"])
+        prev = latest.get(k)
+        if prev is None or (row["tx_date"], row["tx_id"]) > (prev["tx_date"], prev["tx_id"]):
+            latest[k] = row
+    if not latest:
+        return
+
+    t = StockLastReceipt.__table__
+    rows = list(latest.values())
+    insert = dialect_insert()
+    if insert is not None:
+        stmt = insert(t)
+        newer = or_(
+            t.c.tx_date < stmt.excluded.tx_date,
+            and_(t.c.tx_date == stmt.excluded.tx_date, t.c.tx_id < stmt.excluded.tx_id),
+        )
+        set_ = {col: stmt.excluded[col] for col in ("tx_id", "tx_date") + LAST_RECEIPT_COLS}
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.warehouse_id, t.c.product_id], set_=set_, where=newer,
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        cur = StockLastReceipt.query.filter_by(warehouse_id=row["warehouse_id"], product_id=row["product_id"]).first()
+        if cur is None:
+            db.session.add(StockLastReceipt(**row))
+        elif (cur.tx_date, cur.tx_id) < (row["tx_date"], row["tx_id"]):
+            for col, v in row.items():
+                setattr(cur, col, v)
+
+
+def rebuild_last_receipts(*, warehouse_id: Optional[int] = None) -> int:
+    """Перебудовує stock_last_receipts з журналу (останній IN по складу/продукту). Commit всередині."""
+    st = StockTransaction
+    ranked = (
+        db.session.query(
+            st.id.label("tx_id"),
+            st.tx_date.label("tx_date"),
+            st.warehouse_id.label("warehouse_id"),
+            st.product_id.label("product_id"),
+            *[getattr(st, col).label(col) for col in LAST_RECEIPT_COLS],
+            func.row_number().over(
+                partition_by=(st.warehouse_id, st.product_id),
+                order_by=[st.tx_date.desc(), st.id.desc()],
+            ).label("rn"),
+        )
+        .filter(st.tx_type == "IN")
+    )
+    if warehouse_id is not None:
+        ranked = ranked.filter(st.warehouse_id == warehouse_id)
+    ranked = ranked.subquery("ranked")
+
+    t = StockLastReceipt.__table__
+    delete_q = t.delete()
+    if warehouse_id is not None:
+        delete_q = delete_q.where(t.c.warehouse_id == warehouse_id)
+    db.session.execute(delete_q)
+
+    cols = ("warehouse_id", "product_id", "tx_id", "tx_date") + LAST_RECEIPT_COLS
+    rows = [
+        {col: getattr(r, col) for col in cols}
+        for r in db.session.query(*[ranked.c[col] for col in cols]).filter(ranked.c.rn == 1)
+    ]
+    for i in range(0, len(rows), _INSERT_CHUNK):
+        db.session.execute(t.insert(), rows[i:i + _INSERT_CHUNK])
+    db.session.commit()
+    return len(rows)
+
+
+# ----------------------------- доступність -----------------------------
+
+_KEYS_CHUNK = 1000  # ключів на запит (6 параметрів на ключ — у межах ліміту SQLite)
+
+
+def availability_key_of(obj) -> AvailabilityKey:
+    """Ключ доступності з позиції заявки / рядка з колонками ключа."""
+    return make_key((None,) + tuple(getattr(obj, c, None) for c in AVAILABILITY_KEY_COLS))[1:]
+
+
+def _keys_relation(keys: List[AvailabilityKey], dialect_name: str):
+    """Список ключів як VALUES-relation з колонками AVAILABILITY_KEY_COLS."""
+    if dialect_name == "postgresql":
+        cols = [column(c, StockBalance.__table__.c[c].type) for c in AVAILABILITY_KEY_COLS]
+        return values(*cols, name="keys").data(keys)
+
+    # SQLite не підтримує «AS keys (a, b, ...)» — колонки VALUES звуться column1..N
+    params, rows = {}, []
+    for i, key in enumerate(keys):
+        names = []
+        for j, v in enumerate(key):
+            params[f"k{i}_{j}"] = v
+            names.append(f":k{i}_{j}")
+        rows.append("(" + ", ".join(names) + ")")
+    select_list = ", ".join(f"column{j + 1} AS {c}" for j, c in enumerate(AVAILABILITY_KEY_COLS))
+    sql = text(f"SELECT {select_list} FROM (VALUES {', '.join(rows)})").bindparams(**params)
+    return sql.columns(*[column(c, StockBalance.__table__.c[c].type) for c in AVAILABILITY_KEY_COLS]).subquery("keys")
+
+
+def available_quantities(keys: Iterable[AvailabilityKey], *,
+                         warehouse_id: Optional[int] = None) -> Dict[AvailabilityKey, float]:
+    """
+    {ключ: залишок} для списку ключів одним запитом (на кожні _KEYS_CHUNK ключів):
+    keys LEFT JOIN stock_balances по ключу з NULL = NULL (IS NOT DISTINCT FROM; у SQLite — IS).
+    warehouse_id — залишок одного складу, None — сума по всіх складах. Невідомий ключ → 0.
+    """
+    keys = list(dict.fromkeys(keys))
+    out: Dict[AvailabilityKey, float] = {k: 0.0 for k in keys}
+    if not keys:
+        return out
+
+    sb = StockBalance
+    dialect_name = db.session.get_bind().dialect.name
+    for i in range(0, len(keys), _KEYS_CHUNK):
+        k = _keys_relation(keys[i:i + _KEYS_CHUNK], dialect_name)
+        # product_id NOT NULL — звичайна рівність (hash join / індекс), решта — NULL-безпечно
+        on = [sb.product_id == k.c.product_id]
+        for c in AVAILABILITY_KEY_COLS:
+            if c != "product_id":
+                col = getattr(sb, c)
+                on.append(col.is_not_distinct_from(cast(k.c[c], col.type)))
+        if warehouse_id is not None:
+            on.append(sb.warehouse_id == warehouse_id)
+
+        key_cols = [k.c[c] for c in AVAILABILITY_KEY_COLS]
+        q = (
+            select(*key_cols, func.coalesce(func.sum(sb.qty), 0.0).label("qty"))
+            .select_from(k.outerjoin(sb, and_(*on)))
+            .group_by(*key_cols)
+        )
+        for r in db.session.execute(q):
+            out[availability_key_of(r)] = float(r.qty or 0.0)
+    return out
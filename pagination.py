@@ -0,0 +1,98 @@
+# pagination.py
+# -*- coding: utf-8 -*-
+"""
+Keyset (cursor) пагінація для журналів: сторінка = WHERE (ts, id) < (курсор) ORDER BY ts, id LIMIT n.
+Вартість сторінки не залежить від глибини, на відміну від OFFSET.
+
+Курсор — непрозорий підписаний токен (SECRET_KEY): позиція останнього рядка + фільтри,
+з якими його отримано. Перехід «далі» зберігає фільтри, навіть якщо їх нема в URL.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from flask import current_app, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import tuple_
+
+
+@dataclass(frozen=True)
+class Cursor:
+    ts: datetime
+    id: int
+    filters: Dict[str, Any]
+
+
+@dataclass
+class KeysetPage:
+    items: List[Any]
+    next_cursor: Optional[str]
+    is_first: bool
+    filters: Dict[str, Any] = field(default_factory=dict)
+    param: str = "cursor"
+
+    def _url(self, args: dict) -> str:
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    def next_url(self) -> Optional[str]:
+        """URL наступної сторінки (інші параметри запиту, зокрема курсори сусідніх списків, зберігаються)."""
+        if not self.next_cursor:
+            return None
+        args = request.args.to_dict()
+        args[self.param] = self.next_cursor
+        return self._url(args)
+
+    def first_url(self) -> str:
+        """URL першої сторінки з тими ж фільтрами."""
+        args = request.args.to_dict()
+        args.pop(self.param, None)
+        args.update({k: v for k, v in self.filters.items() if v is not None})
+        return self._url(args)
+
+
+def _serializer(scope: str) -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt=f"keyset:{scope}")
+
+
+def encode_cursor(scope: str, ts: datetime, row_id: int, filters: Dict[str, Any]) -> str:
+    return _serializer(scope).dumps({"t": ts.isoformat(), "i": int(row_id), "f": filters})
+
+
+def decode_cursor(token: Optional[str], scope: str) -> Optional[Cursor]:
+    """Cursor з токена або None (порожній/підроблений/чужий токен → перша сторінка)."""
+    if not token:
+        return None
+    try:
+        data = _serializer(scope).loads(token)
+        return Cursor(ts=datetime.fromisoformat(data["t"]), id=int(data["i"]), filters=dict(data.get("f") or {}))
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+def keyset_paginate(query, ts_col, id_col, *, scope: str, cursor: Optional[Cursor], filters: Dict[str, Any],
+                    per_page: int, descending: bool = True, param: str = "cursor") -> KeysetPage:
+    """
+    Одна сторінка query (фільтри вже застосовані) у порядку (ts_col, id_col).
+    Потрібен індекс, що закінчується на (ts_col, id_col) після колонок рівності з фільтрів.
+    """
+    key = tuple_(ts_col, id_col)
+    if cursor is not None:
+        pos = tuple_(cursor.ts, cursor.id)
+        query = query.filter(key < pos if descending else key > pos)
+    if descending:
+        query = query.order_by(ts_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(ts_col.asc(), id_col.asc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(scope, getattr(last, ts_col.key), getattr(last, id_col.key), filters)
+    return KeysetPage(items=rows, next_cursor=next_cursor, is_first=cursor is None, filters=filters, param=param)
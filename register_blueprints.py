@@ -33,6 +33,9 @@ def register_blueprints(app):
     from modules.requests.shipments import shipments_requests_bp
 
     from modules.plans.summary import summary_bp
+
+    # Фонові задачі
+    from modules.jobs import jobs_bp
     
 
     app.register_blueprint(reference_bp)
@@ -70,4 +73,6 @@ def register_blueprints(app):
     app.register_blueprint(warehouses_bp)
     app.register_blueprint(warehouse_requests_bp)
 
-    app.register_blueprint(summary_bp)
\ No newline at end of file
+    app.register_blueprint(summary_bp)
+
+    app.register_blueprint(jobs_bp)
@@ -0,0 +1,21 @@
+import os
+import sys
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app          # create_all() створить payment_inbox_items
+from modules.purchases.payments.services import backfill_inbox_lines
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        written = backfill_inbox_lines()
+        print(f"Done. Backfilled payment_inbox_items rows: {written}")
+
+if __name__ == "__main__":
+    main()
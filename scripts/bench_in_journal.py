@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# бенчмарк працює на окремій тимчасовій SQLite-базі, робочу БД не чіпає
+_DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_in_journal.db")
+os.environ.pop("RENDER_DATABASE_URL", None)
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+
+# --- імпорти вже після додання BASE_DIR ---
+import time
+from sqlalchemy import event
+from app import create_app
+from extensions import db
+from modules.purchases.payments.models import PaymentInbox
+from modules.reference.clusters.models import Cluster
+from modules.reference.companies.models import Company
+from modules.reference.products.models import Product
+from modules.reference.units.models import Unit
+from modules.warehouse.models import StockTransaction
+
+# к-сть оплачених заявок на кожному кроці (сторінка журналу бере до 200 останніх)
+SIZES = (10, 50, 200)
+PRODUCTS_PER_INBOX = 5
+
+
+def _seed(app, total):
+    with app.app_context():
+        if Unit.query.first() is None:
+            unit = Unit(name="л")
+            db.session.add(unit)
+            cluster = Cluster(name="Bench")
+            db.session.add(cluster)
+            db.session.flush()
+            db.session.add(Company(name="Bench Co", cluster_id=cluster.id))
+            db.session.flush()
+            for i in range(20):
+                db.session.add(Product(name=f"Bench P{i}", unit_id=unit.id))
+            db.session.flush()
+        company = Company.query.first()
+        products = Product.query.order_by(Product.id).all()
+
+        have = PaymentInbox.query.count()
+        for n in range(have, total):
+            items = [
+                {"product_id": products[(n + k) % len(products)].id, "qty": 10}
+                for k in range(PRODUCTS_PER_INBOX)
+            ]
+            inbox = PaymentInbox(company_id=company.id, status="Оплачено", items_json=items)
+            db.session.add(inbox)
+            db.session.flush()
+            # частково оприбуткована перша позиція
+            db.session.add(StockTransaction(
+                product_id=items[0]["product_id"], unit_id=products[0].unit_id, qty=3, tx_type="IN",
+                warehouse_id=1, source_kind="payment_inbox", source_id=inbox.id, source_line_idx=1,
+            ))
+        db.session.commit()
+
+
+def main():
+    app = create_app()
+    client = app.test_client()
+
+    counter = {"n": 0}
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *a, **kw: counter.__setitem__("n", counter["n"] + 1))
+
+    print(f"{'inboxes':>8} {'queries':>8} {'ms':>8}")
+    for size in SIZES:
+        _seed(app, size)
+        counter["n"] = 0
+        t0 = time.perf_counter()
+        resp = client.get("/warehouse/in-journal")
+        ms = (time.perf_counter() - t0) * 1000
+        assert resp.status_code == 200, resp.status_code
+        print(f"{size:>8} {counter['n']:>8} {ms:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import sys
+import argparse
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+import time
+from sqlalchemy import event, func, text
+from app import create_app
+from extensions import db
+from modules.purchases.payer_allocation.models import PayerAllocation
+from modules.purchases.payer_allocation.schema_profile import get_schema_profile
+from modules.purchases.payer_allocation.services import (
+    CONSOLIDATED_VIEW,
+    _compute_consolidated_with_remaining,
+    consolidated_view_ddl,
+    get_already_ordered_map,
+    get_consolidated_with_remaining,
+)
+from modules.reference.labels import label_resolver, resolve_labels
+
+# create — (пере)створити представлення v_consolidated_remaining (консолідація + залишок + назви)
+# drop   — прибрати представлення
+# check  — звірити get_consolidated_with_remaining з попереднім розрахунком у Python
+#          (три запити + склад за назвами), код виходу 1 при розбіжностях
+# bench  — час і к-сть запитів: попередній розрахунок vs один SQL з CTE (обидва без кешу результатів)
+#
+# Відома різниця з попереднім розрахунком: склад тепер зіставляється за id компанії/платника
+# (з fallback на назву), тож віднімається і без фільтра компанії, і для рядків без платника.
+
+
+# ----------------------------- попередній розрахунок (для check/bench) -----------------------------
+
+def _legacy_stock_map(*, company_id=None, product_ids=None, payer_ids=None):
+    if not get_schema_profile().has_stock_ledger:
+        return {}
+    st = db.metadata.tables["stock_balances"]
+
+    want_products = set(int(x) for x in (product_ids or []))
+    if not want_products:
+        return {}
+
+    company_ids = {int(company_id)} if company_id is not None else set()
+    payer_ids_set = set(int(x) for x in (payer_ids or []))
+
+    labels = label_resolver()
+    cmap = {k: v for k, v in labels.labels("company", company_ids).items() if v is not None}
+    paymap = {k: v for k, v in labels.labels("payer", payer_ids_set).items() if v is not None}
+    cname2id = {v: k for k, v in cmap.items()} if cmap else None
+    pname2id = {v: k for k, v in paymap.items()} if paymap else None
+    pkg_by_product = labels.package_labels(want_products)
+
+    q = (
+        db.session.query(
+            st.c.product_id, st.c.consumer_company_name, st.c.payer_name, st.c.package_text,
+            func.coalesce(func.sum(st.c.qty), 0.0).label("balance"),
+        )
+        .filter(st.c.product_id.in_(list(want_products)))
+        .group_by(st.c.product_id, st.c.consumer_company_name, st.c.payer_name, st.c.package_text)
+    )
+    if cname2id is not None:
+        q = q.filter(st.c.consumer_company_name.in_(list(cname2id.keys())))
+    if pname2id is not None:
+        q = q.filter(st.c.payer_name.in_(list(pname2id.keys())))
+
+    acc = {}
+    for r in q.all():
+        pid = int(r.product_id)
+        consumer_name = (r.consumer_company_name or "").strip() or None
+        payer_name = (r.payer_name or "").strip() or None
+        pkg = (r.package_text or "").strip() or None
+        expected_pkg = (pkg_by_product.get(pid) or "").strip() or None
+        if expected_pkg and pkg and expected_pkg != pkg:
+            continue
+        comp_id = cname2id.get(consumer_name) if (cname2id and consumer_name) else None
+        pay_id = pname2id.get(payer_name) if (pname2id and payer_name) else None
+        if company_id is not None and comp_id != company_id:
+            continue
+        if payer_ids_set and pay_id not in payer_ids_set:
+            continue
+        key = (comp_id, pid, pay_id)
+        acc[key] = acc.get(key, 0.0) + float(r.balance or 0.0)
+    return acc
+
+
+def _legacy_consolidated(*, company_id=None):
+    q = (
+        db.session.query(
+            PayerAllocation.company_id, PayerAllocation.product_id, PayerAllocation.manufacturer_id,
+            PayerAllocation.unit_id, PayerAllocation.payer_id,
+            func.sum(PayerAllocation.qty).label("total_qty"),
+        )
+        .filter(PayerAllocation.status == "active")
+        .group_by(
+            PayerAllocation.company_id, PayerAllocation.product_id, PayerAllocation.manufacturer_id,
+            PayerAllocation.unit_id, PayerAllocation.payer_id,
+        )
+    )
+    if company_id:
+        q = q.filter(PayerAllocation.company_id == company_id)
+    rows = q.all()
+    if not rows:
+        return []
+
+    prod_set = {int(r.product_id) for r in rows}
+    payer_set = {int(r.payer_id) for r in rows if r.payer_id is not None}
+    ordered_map = get_already_ordered_map(
+        company_id=company_id, product_ids=list(prod_set), payer_ids=list(payer_set) or None,
+    )
+    stock_map = _legacy_stock_map(
+        company_id=company_id, product_ids=list(prod_set), payer_ids=list(payer_set) or None,
+    )
+
+    result = []
+    for r in rows:
+        total = float(r.total_qty or 0.0)
+        already = float(ordered_map.get((r.company_id, r.product_id, r.payer_id), 0.0))
+        stock = float(stock_map.get((r.company_id, r.product_id, r.payer_id), 0.0))
+        result.append({
+            "company_id": r.company_id, "product_id": r.product_id, "manufacturer_id": r.manufacturer_id,
+            "unit_id": r.unit_id, "payer_id": r.payer_id,
+            "total_qty": total, "already_ordered_qty": already, "stock_qty": stock,
+            "remaining_qty": max(total - already - stock, 0.0),
+        })
+    resolve_labels(result, package_key="package", default="—")
+    return result
+
+
+# ----------------------------- дії -----------------------------
+
+def _key(r):
+    return (r["company_id"], r["product_id"], r["manufacturer_id"], r["unit_id"], r["payer_id"])
+
+
+def _check(company_ids):
+    mismatches = 0
+    for company_id in company_ids:
+        old = {_key(r): r for r in _legacy_consolidated(company_id=company_id)}
+        new = {_key(r): r for r in get_consolidated_with_remaining(company_id=company_id)}
+        for key in sorted(old.keys() | new.keys(), key=str):
+            a, b = old.get(key), new.get(key)
+            if a is None or b is None:
+                print(f"company={company_id} {key}: legacy={'-' if a is None else 'row'} sql={'-' if b is None else 'row'}")
+                mismatches += 1
+                continue
+            for col in ("total_qty", "already_ordered_qty", "stock_qty", "remaining_qty"):
+                if abs(a[col] - b[col]) > 1e-6:
+                    print(f"company={company_id} {key}: {col} legacy={a[col]} sql={b[col]}")
+                    mismatches += 1
+    return mismatches
+
+
+def _sql_uncached(*, company_id=None):
+    # повний розрахунок щоразу: get_consolidated_with_remaining з другого виклику віддає з кешу
+    return _compute_consolidated_with_remaining({"company_id": company_id} if company_id else {})
+
+
+def _bench(company_ids, repeat):
+    counter = {"n": 0}
+
+    def _count(*_a, **_kw):
+        counter["n"] += 1
+
+    event.listen(db.engine, "before_cursor_execute", _count)
+    print(f"{'company':>8} {'impl':>7} {'rows':>6} {'queries':>8} {'ms':>8}")
+    for company_id in company_ids:
+        for name, fn in (("legacy", _legacy_consolidated), ("sql", _sql_uncached)):
+            fn(company_id=company_id)  # прогрів кешу довідників
+            counter["n"] = 0
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                rows = fn(company_id=company_id)
+            ms = (time.perf_counter() - t0) * 1000 / repeat
+            print(f"{str(company_id or 'all'):>8} {name:>7} {len(rows):>6} {counter['n'] // repeat:>8} {ms:>8.1f}")
+    event.remove(db.engine, "before_cursor_execute", _count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Консолідація розподілу із залишком (CTE / представлення)")
+    parser.add_argument("action", choices=("create", "drop", "check", "bench"))
+    parser.add_argument("--company-id", type=int, action="append", default=None,
+                        help="компанія для check/bench (можна кілька разів); за замовчуванням — усі окремо")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.action in ("create", "drop"):
+            drop_sql, create_sql = consolidated_view_ddl(db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(drop_sql))
+                if args.action == "create":
+                    conn.execute(text(create_sql))
+            print(f"Done. View {CONSOLIDATED_VIEW}: {'created' if args.action == 'create' else 'dropped'}")
+            return 0
+
+        company_ids = args.company_id or [
+            cid for (cid,) in db.session.query(PayerAllocation.company_id).distinct().order_by(PayerAllocation.company_id)
+        ]
+        # назви — через резолвер контексту запиту, як на сторінках
+        with app.test_request_context():
+            if args.action == "check":
+                mismatches = _check(company_ids)
+                print(f"Done. Mismatches: {mismatches}")
+                return 1 if mismatches else 0
+            _bench([None, *company_ids], args.repeat)
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
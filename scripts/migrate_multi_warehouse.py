@@ -0,0 +1,147 @@
+"""
+Перехід складського журналу на кілька складів (warehouse_id → warehouses.id).
+
+    python scripts/migrate_multi_warehouse.py --company-id 3
+
+1) shipment_requests.warehouse_id (склад-джерело відвантаження), якщо відсутня;
+2) рядки stock_* з warehouse_id, якого немає у warehouses (історично «1» без довідника),
+   переносяться на склад «Центральний склад» компанії --company-id (створюється за потреби);
+   після цього stock_balances / stock_last_receipts перебудовуються, чекпоінти стають stale;
+3) індекси журналу, що мають тепер інший склад колонок (усі починаються з warehouse_id),
+   перестворюються;
+4) PostgreSQL: FOREIGN KEY warehouse_id → warehouses.id (SQLite не вміє ADD CONSTRAINT —
+   там FK діє лише для таблиць, створених db.create_all()).
+"""
+import argparse
+import os
+import sys
+from sqlalchemy import text, inspect
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app
+from extensions import db
+from modules.reference.warehouses.models import Warehouse
+from modules.warehouse.models import (
+    StockTransaction, StockBalance, StockLastReceipt, StockCheckpoint, StockCheckpointPeriod,
+)
+from modules.warehouse.services import rebuild_last_receipts, rebuild_stock_balances
+
+LEGACY_NAME = "Центральний склад"
+
+# таблиці з warehouse_id, що посилаються на warehouses
+STOCK_TABLES = [StockTransaction, StockBalance, StockLastReceipt, StockCheckpoint]
+
+
+def _orphan_ids(model) -> set:
+    t = model.__table__.name
+    rows = db.session.execute(text(
+        f"SELECT DISTINCT warehouse_id FROM {t} "
+        f"WHERE warehouse_id IS NOT NULL AND warehouse_id NOT IN (SELECT id FROM warehouses)"
+    ))
+    return {r[0] for r in rows}
+
+
+def _legacy_warehouse(company_id: int) -> Warehouse:
+    wh = Warehouse.query.filter_by(company_id=company_id, name=LEGACY_NAME).first()
+    if wh is None:
+        wh = Warehouse(company_id=company_id, name=LEGACY_NAME, is_active=True)
+        db.session.add(wh)
+        db.session.flush()
+    return wh
+
+
+def _recreate_changed_indexes(insp) -> list:
+    changed = []
+    for model in STOCK_TABLES:
+        table = model.__table__
+        existing = {ix["name"]: ix["column_names"] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            cols = [c.name for c in index.columns]
+            if existing.get(index.name) == cols:
+                continue
+            if index.name in existing:
+                index.drop(db.engine)
+            index.create(db.engine)
+            changed.append(index.name)
+    return changed
+
+
+def _add_foreign_keys(insp) -> list:
+    added = []
+    for model in STOCK_TABLES + [None]:
+        t = model.__table__.name if model is not None else "shipment_requests"
+        has_fk = any(
+            fk["referred_table"] == "warehouses" and fk["constrained_columns"] == ["warehouse_id"]
+            for fk in insp.get_foreign_keys(t)
+        )
+        if not has_fk:
+            name = f"fk_{t}_warehouse_id"
+            db.session.execute(text(
+                f"ALTER TABLE {t} ADD CONSTRAINT {name} FOREIGN KEY (warehouse_id) REFERENCES warehouses (id)"
+            ))
+            added.append(name)
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Міграція журналу складу на довідник складів.")
+    parser.add_argument("--company-id", type=int,
+                        help="компанія-власник складу для записів без існуючого warehouse_id")
+    args = parser.parse_args()
+
+    app = create_app()  # create_all() створить нові таблиці
+    with app.app_context():
+        insp = inspect(db.engine)
+
+        # 1) склад-джерело у заявках на відвантаження
+        columns = {c["name"] for c in insp.get_columns("shipment_requests")}
+        if "warehouse_id" not in columns:
+            db.session.execute(text("ALTER TABLE shipment_requests ADD COLUMN warehouse_id INTEGER"))
+            print("Added column: shipment_requests.warehouse_id")
+
+        # 2) записи без існуючого складу → «Центральний склад»
+        orphans = set()
+        for model in STOCK_TABLES:
+            orphans |= _orphan_ids(model)
+        if orphans:
+            if args.company_id is None:
+                db.session.rollback()
+                sys.exit(f"Знайдено warehouse_id без складу: {sorted(orphans)}. Вкажіть --company-id.")
+            wh = _legacy_warehouse(args.company_id)
+            ids = ", ".join(str(i) for i in sorted(orphans))
+            for model in (StockTransaction, StockCheckpoint):
+                db.session.execute(text(
+                    f"UPDATE {model.__table__.name} SET warehouse_id = :wid WHERE warehouse_id IN ({ids})"
+                ), {"wid": wh.id})
+            # кілька старих id могли злитися в один склад — похідні таблиці перебудовуємо
+            db.session.query(StockCheckpointPeriod).update({"is_stale": True}, synchronize_session=False)
+            db.session.commit()
+            balances = rebuild_stock_balances()
+            pointers = rebuild_last_receipts()
+            print(f"Moved warehouse_id {sorted(orphans)} → #{wh.id} «{LEGACY_NAME}»; "
+                  f"rebuilt {balances} balances, {pointers} last receipts; checkpoints marked stale.")
+        db.session.commit()
+
+        # 3) індекси, що тепер починаються з warehouse_id
+        insp = inspect(db.engine)
+        changed = _recreate_changed_indexes(insp)
+        print(f"Recreated indexes: {changed or 'none (already up-to-date)'}")
+
+        # 4) FK — лише там, де діалект це підтримує
+        if db.engine.dialect.name == "postgresql":
+            added = _add_foreign_keys(insp)
+            db.session.commit()
+            print(f"Added foreign keys: {added or 'none (already up-to-date)'}")
+        else:
+            print("Foreign keys: skipped (ALTER TABLE ADD CONSTRAINT не підтримується цим діалектом).")
+
+        print("Done. Далі: python scripts/stock_checkpoints.py refresh")
+
+
+if __name__ == "__main__":
+    main()
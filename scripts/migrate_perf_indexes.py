@@ -0,0 +1,42 @@
+import os
+import sys
+from sqlalchemy import text, inspect
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app
+from extensions import db
+
+# індекси, які db.create_all() не додає до вже існуючих таблиць
+# (назва індексу, таблиця, колонки)
+INDEXES = [
+    ("ix_plans_field_id", "plans", "field_id"),
+    ("ix_treatments_plan_id", "treatments", "plan_id"),
+    ("ix_st_tx_warehouse_date", "stock_transactions", "warehouse_id, tx_date"),
+    ("ix_st_tx_type_date_id", "stock_transactions", "warehouse_id, tx_type, tx_date, id"),
+    ("ix_payment_inbox_created_id", "payment_inbox", "created_at, id"),
+    ("ix_shipment_requests_status_created", "shipment_requests", "status, created_at, id"),
+]
+
+def main():
+    app = create_app()  # create_all() створить нові таблиці
+    with app.app_context():
+        insp = inspect(db.engine)
+        tables = set(insp.get_table_names())
+        added = []
+        for name, table, cols in INDEXES:
+            if table not in tables:
+                continue
+            existing = {ix["name"] for ix in insp.get_indexes(table)}
+            if name not in existing:
+                db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})'))
+                added.append(name)
+        db.session.commit()
+        print(f"Done. Added indexes: {added or 'none (already up-to-date)'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import argparse
+from datetime import datetime
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app
+from modules.warehouse.archive import archive_transactions, compare_balances, ledger_balances, verify_archive
+from modules.warehouse.models import StockArchiveRun
+from modules.warehouse.services import check_stock_balances
+
+# run --before    — перенести журнал до дати в stock_transactions_archive (порціями; перерваний запуск
+#                   продовжується повторним викликом з тими ж параметрами); --verify порівнює залишки до/після
+# verify          — повна історія (архів + журнал) проти гарячого журналу та stock_balances
+# status          — останні запуски
+
+def main():
+    parser = argparse.ArgumentParser(description="Архівація журналу складу")
+    parser.add_argument("action", choices=("run", "verify", "status"))
+    parser.add_argument("--before", type=datetime.fromisoformat, help="cutoff для run (ISO, напр. 2024-01-01)")
+    parser.add_argument("--warehouse-id", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--max-chunks", type=int, default=None, help="обмежити роботу за один запуск")
+    parser.add_argument("--verify", action="store_true", help="для run: порівняти залишки до/після")
+    args = parser.parse_args()
+
+    app = create_app()  # create_all() створить таблиці архіву
+    with app.app_context():
+        if args.action == "status":
+            for r in StockArchiveRun.query.order_by(StockArchiveRun.id.desc()).limit(10):
+                print(f"#{r.id} cutoff={r.cutoff:%Y-%m-%d} warehouse={r.warehouse_id or 'all'} {r.status} "
+                      f"moved={r.moved} opening_rows={r.opening_rows} last_tx_id={r.last_tx_id}")
+            return
+
+        if args.action == "verify":
+            diffs = verify_archive(warehouse_id=args.warehouse_id)
+            diffs += [{"key": d["key"], "before": d["ledger"], "after": d["stored"]}
+                      for d in check_stock_balances(warehouse_id=args.warehouse_id)]
+            for d in diffs[:50]:
+                print(d)
+            print(f"Mismatches: {len(diffs)}")
+            sys.exit(1 if diffs else 0)
+
+        if args.before is None:
+            parser.error("run потребує --before")
+        before = ledger_balances(warehouse_id=args.warehouse_id) if args.verify else None
+        try:
+            run = archive_transactions(args.before, warehouse_id=args.warehouse_id,
+                                       chunk_size=args.chunk_size, max_chunks=args.max_chunks)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"Run #{run.id}: {run.status}, moved={run.moved}, opening_rows={run.opening_rows}")
+        if before is not None:
+            diffs = compare_balances(before, ledger_balances(warehouse_id=args.warehouse_id))
+            for d in diffs[:50]:
+                print(d)
+            print(f"Verify: {len(diffs)} mismatches")
+            sys.exit(1 if diffs else 0)
+
+if __name__ == "__main__":
+    main()
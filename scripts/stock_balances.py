@@ -0,0 +1,39 @@
+import os
+import sys
+import argparse
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app
+from modules.warehouse.services import rebuild_stock_balances, rebuild_last_receipts, check_stock_balances
+
+# rebuild — перерахувати stock_balances і stock_last_receipts з журналу stock_transactions
+#           (перший запуск на існуючій БД і після масових змін журналу повз ORM)
+# check   — звірити stock_balances з журналом, код виходу 1 при розбіжностях
+
+def main():
+    parser = argparse.ArgumentParser(description="Матеріалізовані залишки складу (stock_balances)")
+    parser.add_argument("action", choices=("rebuild", "check"))
+    parser.add_argument("--warehouse-id", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app()  # create_all() створить stock_balances
+    with app.app_context():
+        if args.action == "rebuild":
+            written = rebuild_stock_balances(warehouse_id=args.warehouse_id)
+            pointers = rebuild_last_receipts(warehouse_id=args.warehouse_id)
+            print(f"Done. Balance keys written: {written}, last receipts: {pointers}")
+            return 0
+
+        diffs = check_stock_balances(warehouse_id=args.warehouse_id)
+        for d in diffs:
+            print(f"{d['key']}: ledger={d['ledger']} stored={d['stored']}")
+        print(f"Done. Mismatches: {len(diffs)}")
+        return 1 if diffs else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
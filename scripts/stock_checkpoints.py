@@ -0,0 +1,40 @@
+import os
+import sys
+import argparse
+from datetime import datetime
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app
+from modules.warehouse.checkpoints import close_months, close_period, refresh_stale_checkpoints
+
+# close-months — місячні чекпоінти до поточної дати + перерахунок застарілих (запускати з cron раз на місяць)
+# close --at    — чекпоінт на довільний момент (на вимогу)
+# refresh       — лише перерахувати чекпоінти, зачеплені транзакціями заднім числом
+
+def main():
+    parser = argparse.ArgumentParser(description="Чекпоінти залишків складу")
+    parser.add_argument("action", choices=("close-months", "close", "refresh"))
+    parser.add_argument("--at", type=datetime.fromisoformat, help="period_end для close (ISO, напр. 2025-01-01)")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    app = create_app()  # create_all() створить таблиці чекпоінтів
+    with app.app_context():
+        if args.action == "close":
+            if args.at is None:
+                parser.error("close потребує --at")
+            close_period(args.at)
+            done = [args.at]
+        elif args.action == "close-months":
+            done = close_months(args.until)
+        else:
+            done = refresh_stale_checkpoints()
+        print(f"Done. Checkpoints written: {[d.isoformat() for d in done] or 'none'}")
+
+if __name__ == "__main__":
+    main()
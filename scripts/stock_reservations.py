@@ -0,0 +1,44 @@
+import os
+import sys
+import argparse
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from sqlalchemy import inspect, text
+
+from app import create_app
+from extensions import db
+from modules.requests.shipments.reservations import check_reservations, rebuild_reservations
+
+# rebuild — перерахувати stock_reservations з позицій відкритих заявок (перший запуск на існуючій БД,
+#           а також після переходу на резерв по складах: додає колонку warehouse_id і перебудовує ключі)
+# check   — звірити stock_reservations з позиціями, код виходу 1 при розбіжностях
+
+def main():
+    parser = argparse.ArgumentParser(description="Резерви під заявки на відвантаження (stock_reservations)")
+    parser.add_argument("action", choices=("rebuild", "check"))
+    args = parser.parse_args()
+
+    app = create_app()  # create_all() створить stock_reservations
+    with app.app_context():
+        if args.action == "rebuild":
+            columns = {c["name"] for c in inspect(db.engine).get_columns("stock_reservations")}
+            if "warehouse_id" not in columns:
+                db.session.execute(text("ALTER TABLE stock_reservations ADD COLUMN warehouse_id INTEGER"))
+                print("Added column: stock_reservations.warehouse_id")
+            written = rebuild_reservations()
+            print(f"Done. Reservation keys written: {written}")
+            return 0
+
+        diffs = check_reservations()
+        for d in diffs:
+            print(f"{d['key']}: expected={d['expected']} stored={d['stored']}")
+        print(f"Done. Mismatches: {len(diffs)}")
+        return 1 if diffs else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
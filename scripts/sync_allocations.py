@@ -0,0 +1,46 @@
+import os
+import sys
+import argparse
+import json
+
+# --- зробити видимим корінь проєкту для імпортів ---
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # ../
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# --- імпорти вже після додання BASE_DIR ---
+from app import create_app
+from modules.purchases.payer_allocation.parallel_sync import PARTITION_BY, sync_from_plans_parallel
+from modules.purchases.payer_allocation.services import sync_from_plans
+
+# Повний синк payer_allocations із планів (напр., після річної хвилі затверджень).
+#   --processes N — партиції (компанії або кластери) у N процесах; на SQLite — послідовно
+#   --company-id  — лише одна компанія, послідовно
+# Код виходу 1, якщо якась партиція не вдалась і після повторів.
+
+def main():
+    parser = argparse.ArgumentParser(description="Синк розподілу (payer_allocations) із планів")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--by", choices=PARTITION_BY, default="company")
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--company-id", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.company_id:
+            stats = sync_from_plans(company_id=args.company_id, dry_run=args.dry_run)
+        else:
+            stats = sync_from_plans_parallel(
+                processes=args.processes,
+                by=args.by,
+                retries=args.retries,
+                dry_run=args.dry_run,
+                on_partition=lambda done, total: print(f"  partitions: {done}/{total}", flush=True),
+            )
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return 1 if stats.get("failed_partitions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# singleflight.py
+# -*- coding: utf-8 -*-
+"""
+Single-flight для дорогих читань: однакові одночасні виклики рахуються один раз.
+
+    @single_flight("payer_allocation.consolidated", tables=CONSOLIDATION_TABLES, share=copy_rows)
+    def get_consolidated_with_remaining(*, company_id=None, ...):
+        ...
+
+Перший виклик з ключем (назва + аргументи + версії таблиць-джерел) — «лідер» — рахує;
+виклики з тим самим ключем, що прийшли з інших потоків цього процесу, поки лідер рахує,
+чекають і отримують його результат (share — як роздати копію, щоб викликачі не псували
+спільні рядки). Після завершення лідера ключ звільняється: наступний виклик рахує знову,
+тож це не кеш.
+
+Версії таблиць (tables) — локальні лічильники, які збільшує шина інвалідації (cache_bus)
+після commit, що змінив таблицю. Виклик після власного commit має інший ключ і не
+приєднується до лідера, який почав рахувати ще до цих змін (read-your-writes).
+
+Крос-воркерний режим (cross_worker=True у декораторі і SINGLE_FLIGHT_CROSS_WORKER у
+конфігурації): лідер ще й бере блокування за ключем — pg_advisory_lock на PostgreSQL,
+lock-файл у <instance>/singleflight на інших БД, — тож одночасно рахує лише один воркер,
+решта чекає на нього. Результат між процесами не передається (воркер, що дочекався,
+рахує сам, по «теплій» БД), тому режим вимкнено за замовчуванням: він зменшує
+навантаження на БД ціною затримки для тих, хто чекав. Lock-файлів — фіксований набір
+(SINGLE_FLIGHT_LOCK_FILES, ключ → файл за хешем), тож каталог не росте з кількістю ключів;
+різні ключі, що потрапили в один файл, просто рахуються по черзі.
+
+Обхід (рахуємо одразу, без об'єднання):
+  * поза контекстом застосунку;
+  * сесія має незбережені об'єкти або вже змінила одну з таблиць-джерел (tables)
+    у незакоміченій транзакції (cache_bus) — такий виклик має бачити свої зміни.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+
+from cache_bus import invalidation_bus
+from extensions import db
+
+try:
+    import fcntl
+except ImportError:  # Windows — lock-файл недоступний, лише об'єднання в межах процесу
+    fcntl = None
+
+DEFAULTS = {
+    "SINGLE_FLIGHT_CROSS_WORKER": False,   # блокування між воркерами для декораторів з cross_worker=True
+    "SINGLE_FLIGHT_WAIT_TIMEOUT": 60,      # скільки послідовник чекає лідера в процесі, далі рахує сам
+    "SINGLE_FLIGHT_LOCK_TIMEOUT": 30,      # скільки чекати крос-воркерне блокування, далі рахувати без нього
+    "SINGLE_FLIGHT_LOCK_DIR": None,        # None → <instance>/singleflight
+    "SINGLE_FLIGHT_LOCK_FILES": 64,        # скільки lock-файлів у каталозі (ключ → файл за хешем)
+}
+
+_POLL_INTERVAL = 0.05
+
+_COUNTERS = ("calls", "leaders", "coalesced", "bypass", "wait_timeouts", "cross_waits", "lock_timeouts", "errors")
+
+
+def copy_rows(rows: List[dict]) -> List[dict]:
+    """share для списків рядків-словників: кожен викликач отримує власні dict."""
+    return [dict(r) for r in rows]
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlightGroup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[tuple, _Call] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._config = dict(DEFAULTS)
+        self._lock_dir: Optional[str] = None
+        self._versions: Dict[str, int] = {}
+
+    def init_app(self, app) -> None:
+        for key, value in DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self._config = {key: app.config[key] for key in DEFAULTS}
+        self._lock_dir = app.config["SINGLE_FLIGHT_LOCK_DIR"] or os.path.join(app.instance_path, "singleflight")
+
+    def _count(self, name: str, counter: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, dict.fromkeys(_COUNTERS, 0))
+            stats[counter] += 1
+
+    # ----------------------------- версії таблиць -----------------------------
+
+    def _track(self, tables: Tuple[str, ...]) -> None:
+        """Підписка на шину для таблиць, яких ще не відстежуємо."""
+        with self._lock:
+            new = [t for t in tables if t not in self._versions]
+            for t in new:
+                self._versions[t] = 0
+        if new:
+            invalidation_bus.subscribe(new, self._bump)
+
+    def _bump(self, table_names: Iterable[str]) -> None:
+        with self._lock:
+            for name in table_names:
+                if name in self._versions:
+                    self._versions[name] += 1
+
+    def _version_key(self, tables: Tuple[str, ...]) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._versions[t] for t in tables)
+
+    # ----------------------------- виклик -----------------------------
+
+    @staticmethod
+    def _bypassed(tables: Iterable[str]) -> bool:
+        if not has_app_context():
+            return True
+        session = db.session
+        if session.new or session.dirty or session.deleted:
+            return True
+        dirty = invalidation_bus.dirty_tables(session)
+        return any(t in dirty for t in tables)
+
+    def do(
+        self,
+        name: str,
+        key: Any,
+        compute: Callable[[], Any],
+        *,
+        tables: Iterable[str] = (),
+        share: Optional[Callable[[Any], Any]] = None,
+        cross_worker: bool = False,
+    ) -> Any:
+        self._count(name, "calls")
+        tables = tuple(tables)
+        self._track(tables)
+        call_key = (name, key, self._version_key(tables))
+        try:
+            hash(call_key)
+        except TypeError:  # аргументи, які не можуть бути ключем (списки тощо)
+            self._count(name, "bypass")
+            return compute()
+        if self._bypassed(tables):
+            self._count(name, "bypass")
+            return compute()
+
+        with self._lock:
+            call = self._calls.get(call_key)
+            leader = call is None
+            if leader:
+                call = self._calls[call_key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            self._count(name, "coalesced")
+            if not call.done.wait(self._config["SINGLE_FLIGHT_WAIT_TIMEOUT"]):
+                self._count(name, "wait_timeouts")
+                return compute()
+            if call.error is not None:
+                raise call.error
+            return share(call.result) if share else call.result
+
+        self._count(name, "leaders")
+        result = None
+        try:
+            if cross_worker and self._config["SINGLE_FLIGHT_CROSS_WORKER"]:
+                with self._cross_worker_lock(name, key):
+                    result = compute()
+            else:
+                result = compute()
+            return result
+        except BaseException as e:
+            call.error = e
+            self._count(name, "errors")
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(call_key, None)
+                waiters = call.waiters
+            # лідер уже віддає result своєму викликачу — послідовникам роздаємо знімок
+            if waiters and call.error is None:
+                call.result = share(result) if share else result
+            call.done.set()
+
+    # ----------------------------- між воркерами -----------------------------
+
+    @staticmethod
+    def _lock_id(name: str, key: Any) -> int:
+        digest = hashlib.blake2b(f"{name}:{key!r}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def _wait_for(self, name: str, try_acquire: Callable[[], bool]) -> bool:
+        if try_acquire():
+            return True
+        self._count(name, "cross_waits")
+        deadline = time.monotonic() + self._config["SINGLE_FLIGHT_LOCK_TIMEOUT"]
+        while time.monotonic() < deadline:
+            time.sleep(_POLL_INTERVAL)
+            if try_acquire():
+                return True
+        self._count(name, "lock_timeouts")
+        current_app.logger.warning("single-flight %s: не дочекались блокування, рахуємо без нього", name)
+        return False
+
+    @contextmanager
+    def _cross_worker_lock(self, name: str, key: Any):
+        lock_id = self._lock_id(name, key)
+        if db.engine.dialect.name == "postgresql":
+            with self._pg_lock(name, lock_id):
+                yield
+        else:
+            with self._file_lock(name, lock_id):
+                yield
+
+    @contextmanager
+    def _pg_lock(self, name: str, lock_id: int):
+        # окреме з'єднання в autocommit: блокування сесійне, транзакція не висить відкритою
+        conn = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        acquired = False
+        try:
+            acquired = self._wait_for(
+                name, lambda: bool(conn.execute(select(func.pg_try_advisory_lock(lock_id))).scalar())
+            )
+            yield
+        finally:
+            try:
+                if acquired:
+                    conn.execute(select(func.pg_advisory_unlock(lock_id)))
+            finally:
+                conn.close()
+
+    @contextmanager
+    def _file_lock(self, name: str, lock_id: int):
+        if fcntl is None or self._lock_dir is None:
+            yield
+            return
+        os.makedirs(self._lock_dir, exist_ok=True)
+        slot = lock_id % self._config["SINGLE_FLIGHT_LOCK_FILES"]
+        path = os.path.join(self._lock_dir, f"slot-{slot:03d}.lock")
+        with open(path, "a+b") as fh:
+            def try_acquire() -> bool:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return True
+                except BlockingIOError:
+                    return False
+
+            acquired = self._wait_for(name, try_acquire)
+            try:
+                yield
+            finally:
+                if acquired:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    # ----------------------------- метрики -----------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            per_name = {name: dict(s) for name, s in sorted(self._stats.items())}
+            in_flight = len(self._calls)
+        for s in per_name.values():
+            s["coalesced_ratio"] = round(s["coalesced"] / s["calls"], 3) if s["calls"] else None
+        return {
+            "functions": per_name,
+            "in_flight": in_flight,
+            "cross_worker": self._config["SINGLE_FLIGHT_CROSS_WORKER"],
+        }
+
+
+single_flight_group = SingleFlightGroup()
+
+
+def single_flight(
+    name: str,
+    *,
+    tables: Iterable[str] = (),
+    share: Optional[Callable[[Any], Any]] = None,
+    cross_worker: bool = False,
+    key: Optional[Callable[..., Any]] = None,
+):
+    """
+    Декоратор: однакові одночасні виклики функції рахуються один раз.
+    key(*args, **kwargs) — ключ виклику (за замовчуванням — усі аргументи).
+    Оригінальна функція без об'єднання — атрибут .uncoalesced.
+    """
+    tables = tuple(tables)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            return single_flight_group.do(
+                name, call_key, lambda: fn(*args, **kwargs),
+                tables=tables, share=share, cross_worker=cross_worker,
+            )
+
+        wrapper.uncoalesced = fn
+        return wrapper
+
+    return decorator
+
+
+def init_single_flight(app) -> None:
+    """Налаштування single-flight (таймаути, крос-воркерний режим). Викликається з create_app."""
+    single_flight_group.init_app(app)
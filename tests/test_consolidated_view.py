@@ -0,0 +1,165 @@
+"""
+Консолідація розподілу із залишком: SELECT з CTE (consolidated_remaining_select) і
+представлення v_consolidated_remaining (consolidated_view_ddl) на SQLite і PostgreSQL.
+"""
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+from modules.purchases.payer_allocation.models import PayerAllocation
+from modules.purchases.payer_allocation.services import (
+    CONSOLIDATED_VIEW,
+    consolidated_remaining_select,
+    consolidated_view_ddl,
+    get_consolidated_with_remaining,
+)
+from modules.purchases.payments.models import PaymentInbox, PaymentInboxItem
+from modules.reference.clusters.models import Cluster
+from modules.reference.companies.models import Company
+from modules.reference.fields.field_models import Field
+from modules.reference.manufacturers.models import Manufacturer
+from modules.reference.payers.models import Payer
+from modules.reference.products.models import Product
+from modules.reference.units.models import Unit
+from modules.reference.warehouses.models import Warehouse
+from modules.warehouse.models import StockBalance
+
+NUMBERS = ("total_qty", "already_ordered_qty", "stock_qty", "remaining_qty")
+
+# (компанія, продукт, платник) → (total, already, stock, remaining) для fixture_data
+EXPECTED = {
+    ("Co1", "P1", "PayerA"): (100.0, 25.0, 10.0, 65.0),  # два поля; тара 5 л не рахується
+    ("Co1", "P1", "PayerB"): (20.0, 0.0, 5.0, 15.0),     # залишок за назвами (старий рядок без id)
+    ("Co1", "P2", None): (30.0, 0.0, 0.0, 30.0),
+    ("Co2", "P1", "PayerA"): (50.0, 70.0, 0.0, 0.0),     # замовлено більше за план → 0
+}
+
+
+@pytest.fixture
+def fixture_data(app):
+    """Два підприємства, два продукти, два платники; stale-рядок і скасоване замовлення не рахуються."""
+    cl = Cluster(name="C1")
+    unit = Unit(name="л")
+    man = Manufacturer(name="Bayer")
+    payer_a, payer_b = Payer(name="PayerA"), Payer(name="PayerB")
+    db.session.add_all([cl, unit, man, payer_a, payer_b])
+    db.session.flush()
+    co1, co2 = Company(name="Co1", cluster_id=cl.id), Company(name="Co2", cluster_id=cl.id)
+    p1 = Product(name="P1", unit_id=unit.id, manufacturer_id=man.id, container="10 л")
+    p2 = Product(name="P2", unit_id=unit.id, manufacturer_id=man.id)
+    db.session.add_all([co1, co2, p1, p2])
+    db.session.flush()
+    f1a, f1b, f1c, f1d = (Field(name=f"F1{x}", company_id=co1.id, cluster_id=cl.id) for x in "abcd")
+    f2 = Field(name="F2", company_id=co2.id, cluster_id=cl.id)
+    wh = Warehouse(company_id=co1.id, name="WH1")
+    db.session.add_all([f1a, f1b, f1c, f1d, f2, wh])
+    db.session.flush()
+
+    def alloc(field, company, product, payer, qty, status="active"):
+        db.session.add(PayerAllocation(
+            field_id=field.id, company_id=company.id, product_id=product.id, manufacturer_id=man.id,
+            unit_id=unit.id, payer_id=payer.id if payer else None, qty=qty, status=status,
+        ))
+
+    alloc(f1a, co1, p1, payer_a, 60)
+    alloc(f1b, co1, p1, payer_a, 40)
+    alloc(f1d, co1, p1, payer_a, 999, status="stale")
+    alloc(f1c, co1, p1, payer_b, 20)
+    alloc(f1a, co1, p2, None, 30)
+    alloc(f2, co2, p1, payer_a, 50)
+
+    inbox = PaymentInbox(company_id=co1.id, items_json=[])
+    db.session.add(inbox)
+    db.session.flush()
+    for idx, (company, qty, status) in enumerate(
+        [(co1, 25, "submitted"), (co1, 1000, "cancelled"), (co2, 70, "submitted")], start=1
+    ):
+        db.session.add(PaymentInboxItem(
+            inbox_id=inbox.id, line_idx=idx, company_id=company.id, product_id=p1.id,
+            payer_id=payer_a.id, manufacturer_id=man.id, qty=qty, status=status,
+        ))
+
+    def stock(key, qty, **cols):
+        db.session.add(StockBalance(
+            balance_key=key, warehouse_id=wh.id, product_id=p1.id, unit_id=unit.id, qty=qty, **cols,
+        ))
+
+    stock("a10", 10, consumer_company_id=co1.id, payer_id=payer_a.id, package_text="10 л")
+    stock("a5", 100, consumer_company_id=co1.id, payer_id=payer_a.id, package_text="5 л")
+    stock("b-legacy", 5, consumer_company_name="Co1", payer_name="PayerB")
+    db.session.commit()
+    return {
+        "Co1": co1.id, "Co2": co2.id, "P1": p1.id, "P2": p2.id,
+        "PayerA": payer_a.id, "PayerB": payer_b.id, None: None,
+    }
+
+
+def _expected(ids, company=None):
+    return {
+        (ids[c], ids[p], ids[pay]): nums
+        for (c, p, pay), nums in EXPECTED.items()
+        if company is None or c == company
+    }
+
+
+def _by_key(rows):
+    return {(r["company_id"], r["product_id"], r["payer_id"]): tuple(float(r[n]) for n in NUMBERS) for r in rows}
+
+
+@pytest.mark.parametrize("dialect", [sqlite.dialect(), postgresql.dialect()], ids=["sqlite", "postgresql"])
+def test_view_ddl_compiles_for_dialect(app, dialect):
+    drop_sql, create_sql = consolidated_view_ddl(dialect)
+
+    assert drop_sql == f"DROP VIEW IF EXISTS {CONSOLIDATED_VIEW}"
+    assert create_sql.startswith(f"CREATE VIEW {CONSOLIDATED_VIEW} AS\nWITH ")
+    # literal_binds: представлення не може мати параметрів
+    assert "?" not in create_sql and "%(" not in create_sql
+    assert "'active'" in create_sql
+    for cte in ("alloc", "ordered", "stock"):
+        assert f"{cte} AS" in create_sql
+
+
+def test_select_rows(app, fixture_data):
+    rows = [dict(r._mapping) for r in db.session.execute(consolidated_remaining_select())]
+
+    assert _by_key(rows) == _expected(fixture_data)
+
+
+def test_select_filters(app, fixture_data):
+    ids = fixture_data
+    stmt = consolidated_remaining_select(["company_id"])
+    rows = [dict(r._mapping) for r in db.session.execute(stmt, {"company_id": ids["Co1"]})]
+    assert _by_key(rows) == _expected(ids, company="Co1")
+
+    stmt = consolidated_remaining_select(["company_id", "payer_id"])
+    rows = [dict(r._mapping) for r in db.session.execute(stmt, {"company_id": ids["Co1"], "payer_id": ids["PayerB"]})]
+    assert _by_key(rows) == {(ids["Co1"], ids["P1"], ids["PayerB"]): EXPECTED[("Co1", "P1", "PayerB")]}
+
+
+def test_view_rows(app, fixture_data):
+    drop_sql, create_sql = consolidated_view_ddl(db.engine.dialect)
+    with db.engine.begin() as conn:
+        conn.execute(text(drop_sql))
+        conn.execute(text(create_sql))
+    try:
+        rows = [dict(r._mapping) for r in db.session.execute(text(f"SELECT * FROM {CONSOLIDATED_VIEW}"))]
+    finally:
+        db.session.rollback()
+        with db.engine.begin() as conn:
+            conn.execute(text(drop_sql))
+
+    assert _by_key(rows) == _expected(fixture_data)
+    labels = {(r["company_name"], r["product_name"], r["payer_name"]): r for r in rows}
+    assert set(labels) == set(EXPECTED)
+    p1 = labels[("Co1", "P1", "PayerA")]
+    assert (p1["unit_name"], p1["manufacturer_name"], p1["package"]) == ("л", "Bayer", "10 л")
+    assert labels[("Co1", "P2", None)]["package"] is None
+
+
+def test_get_consolidated_with_remaining(app, fixture_data):
+    rows = get_consolidated_with_remaining(company_id=fixture_data["Co1"])
+
+    assert _by_key(rows) == _expected(fixture_data, company="Co1")
+    assert {r["company_name"] for r in rows} == {"Co1"}